@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 import os
 import sys
 from datetime import datetime
@@ -57,6 +57,8 @@ def start_screening():
         target_date = data.get('date')
         batch_start = data.get('batch_start', 0)  # 批次开始位置
         batch_size = data.get('batch_size', 20)   # 每批处理数量
+        snapshot_version = data.get('snapshot_version')  # 本轮筛选固定的快照版本
+        run_id = data.get('run_id')  # 断点续跑的运行 ID，第一批由服务端生成
         
         if not target_date:
             return jsonify({
@@ -67,13 +69,22 @@ def start_screening():
         logger.info(f"开始筛选 {target_date} 的股票，批次 {batch_start}-{batch_start + batch_size}")
         
         try:
+            from rules import CriteriaConfig
+            from run_store import get_shared_run_store, new_run_id
             from stock_screener import StockScreener
             
+            # 股票列表和每只股票的结果保存在运行存储中，实例重启或换了实例时按 run_id 接着处理
+            if not run_id and batch_start == 0 and get_shared_run_store() is not None:
+                run_id = new_run_id()
+            
             # 使用全局筛选器实例保持API统计
             global global_screener
-            if global_screener is None or batch_start == 0:
+            if global_screener is None or (batch_start == 0 and data.get('run_id') is None):
                 logger.info("正在创建股票筛选器...")
-                global_screener = StockScreener()
+                criteria = data.get('criteria')
+                global_screener = StockScreener(
+                    criteria_config=CriteriaConfig.from_dict(criteria) if criteria else None
+                )
             else:
                 logger.info("使用现有筛选器实例...")
             
@@ -84,23 +95,53 @@ def start_screening():
             batch_results = screener.screen_rescue_stocks_batch(
                 target_date, 
                 batch_start=batch_start, 
-                batch_size=batch_size
+                batch_size=batch_size,
+                snapshot_version=snapshot_version,
+                profile=data.get('profile'),  # 可选的性能分析模式
+                run_id=run_id
             )
             
+            if batch_results.get('snapshot_expired'):
+                # 固定的快照已被淘汰，后续批次不能对应到同一份股票列表，需重新开始
+                return jsonify({
+                    'success': False,
+                    'status': 'snapshot_expired',
+                    'message': batch_results['error']
+                })
+            
             logger.info(f"批次处理完成")
             
+            # 各批结果追加到服务端的同一个句柄下，导出时不必上传；
+            # 请求落到没有该句柄的实例时以相同句柄新建，导出时前端按行数判断是否完整
+            from result_store import get_shared_result_store
+            result_handle = data.get('result_handle')
+            store = get_shared_result_store()
+            if store is not None:
+                if not result_handle or not store.append(result_handle, batch_results['results']):
+                    result_handle = store.create(target_date, handle=result_handle or batch_results.get('run_id'))
+                    store.append(result_handle, batch_results['results'])
+                if batch_results.get('run_id') and not batch_results['has_more']:
+                    # 运行的完整结果：补上由其他实例处理的批次
+                    store.append(result_handle, screener.screening_results)
+            
             return jsonify({
                 'success': True,
                 'status': 'batch_completed',
                 'batch_start': batch_start,
                 'batch_size': batch_size,
                 'results': batch_results['results'],
+                'unevaluated': batch_results.get('unevaluated', []),
                 'total_stocks': batch_results['total_stocks'],
                 'processed_count': batch_results['processed_count'],
                 'has_more': batch_results['has_more'],
+                'snapshot_version': batch_results.get('snapshot_version'),
+                'run_id': batch_results.get('run_id'),
+                'result_handle': result_handle,
+                'cached': batch_results.get('cached', False),
                 'api_calls_made': batch_results.get('api_calls_made', 0),
                 'api_success_rate': batch_results.get('api_success_rate', 0),
                 'verification_info': batch_results.get('verification_info', {}),
+                'profile': batch_results.get('profile'),
                 'message': f'✅ 已处理 {batch_results["processed_count"]}/{batch_results["total_stocks"]} 只股票，找到 {len(batch_results["results"])} 只符合条件的股票 | 📡 API调用: {batch_results.get("api_calls_made", 0)}次 (成功率: {batch_results.get("api_success_rate", 0):.1f}%)'
             })
             
@@ -120,6 +161,34 @@ def start_screening():
             'message': f'筛选失败: {str(e)}'
         }), 500
 
+@app.route('/screen/stream')
+def stream_screening_events():
+    """以 server-sent events 推送一次完整筛选的进度和结果"""
+    target_date = request.args.get('date')
+    snapshot_version = request.args.get('snapshot_version')
+    if not target_date:
+        return jsonify({
+            'success': False,
+            'message': '请提供筛选日期'
+        }), 400
+    
+    from result_store import get_shared_result_store
+    from run_store import get_shared_run_store, new_run_id
+    from stock_screener import StockScreener
+    from streaming import SSE_HEADERS, stream_screening
+    
+    # 逐股保存检查点；连接被平台超时断开后以同一 run_id 重新连接即从中断处继续
+    run_id = request.args.get('run_id') or (new_run_id() if get_shared_run_store() is not None else None)
+    global global_screener
+    global_screener = StockScreener()
+    logger.info(f"开始流式筛选 {target_date} 的股票")
+    return Response(
+        stream_with_context(stream_screening(global_screener, target_date, snapshot_version,
+                                             result_store=get_shared_result_store(), run_id=run_id)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
 @app.route('/progress')
 def get_progress():
     """获取筛选进度"""
@@ -137,21 +206,76 @@ def get_results():
         'message': '请重新执行筛选获取结果'
     })
 
-@app.route('/export/excel', methods=['POST'])
-def export_excel():
-    """导出Excel"""
+@app.route('/runs/<run_id>')
+def get_run(run_id):
+    """查询断点续跑的运行：进度及已判定的结果"""
+    from run_store import get_shared_run_store
+    store = get_shared_run_store()
+    run = store.get(run_id) if store is not None else None
+    if run is None:
+        return jsonify({
+            'success': False,
+            'message': '运行不存在或已过期'
+        }), 404
     return jsonify({
-        'success': False,
-        'message': '导出功能暂时不可用'
-    }), 501
+        'success': True,
+        **run,
+        'results': store.results(run_id),
+        'unevaluated': store.unevaluated(run_id)
+    })
 
-@app.route('/export/csv', methods=['POST'])
-def export_csv():
-    """导出CSV"""
-    return jsonify({
-        'success': False,
-        'message': '导出功能暂时不可用'
-    }), 501
+@app.route('/results/<handle>')
+def get_result_handle(handle):
+    """查询服务端保存的结果集"""
+    from exporters import available_formats
+    from result_store import get_shared_result_store
+    store = get_shared_result_store()
+    info = store.info(handle) if store is not None else None
+    if info is None:
+        return jsonify({
+            'success': False,
+            'message': '结果不存在或已过期'
+        }), 404
+    return jsonify({'success': True, **info, 'formats': available_formats()})
+
+@app.route('/export/<format>', methods=['GET', 'POST'])
+def export_results(format):
+    """流式导出筛选结果（csv、excel、parquet、arrow）
+
+    优先按 result_handle 从服务端读取；实例上没有该结果时使用请求中上传的结果。
+    """
+    from exporters import ExportUnavailableError, chunked, export_headers, open_export
+    from result_store import get_shared_result_store
+    try:
+        data = dict(request.args.items())
+        data.update(request.get_json(silent=True) or {})
+        
+        store = get_shared_result_store()
+        handle = data.get('result_handle')
+        if handle and store is not None and store.info(handle) is not None:
+            chunks = store.iter_chunks(handle)
+        elif data.get('results'):
+            chunks = chunked(data['results'])
+        else:
+            return jsonify({
+                'success': False,
+                'message': '没有可导出的结果'
+            }), 400
+        
+        stream, filename, mimetype = open_export(format, chunks)
+        return Response(stream_with_context(stream), mimetype=mimetype, headers=export_headers(filename))
+        
+    except ExportUnavailableError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 501
+    except Exception as e:
+        logger.error(f"导出失败: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'导出失败: {str(e)}'
+        }), 500
 
 @app.route('/status')
 def get_status():
@@ -209,9 +333,8 @@ def verify_data():
                 }
                 
                 if hist_data is not None and len(hist_data) > 0:
-                    latest_data = hist_data.iloc[-1]
-                    verification_item['latest_close'] = float(latest_data.get('收盘', 0))
-                    verification_item['latest_date'] = str(latest_data.get('日期', ''))
+                    verification_item['latest_close'] = float(hist_data.field('close')[-1])
+                    verification_item['latest_date'] = hist_data.date_strings()[-1]
                 
                 verification_data.append(verification_item)
                 
@@ -271,6 +394,12 @@ def get_api_statistics():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 文本格式的运行指标"""
+    from metrics import CONTENT_TYPE, render
+    return Response(render(), content_type=CONTENT_TYPE)
+
 @app.route('/data-verification-detailed')
 def get_detailed_verification():
     """获取详细的数据验证信息"""
@@ -315,9 +444,8 @@ def get_detailed_verification():
             }
             
             if hist_data is not None and len(hist_data) > 0:
-                latest = hist_data.iloc[-1]
-                sample_info['latest_close'] = float(latest.get('收盘', 0))
-                sample_info['latest_date'] = str(latest.get('日期', ''))
+                sample_info['latest_close'] = float(hist_data.field('close')[-1])
+                sample_info['latest_date'] = hist_data.date_strings()[-1]
             
             verification_samples.append(sample_info)
         
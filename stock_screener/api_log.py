@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# 保留的最近调用记录数
+DEFAULT_LOG_CAPACITY = 200
+# get_api_statistics 返回的最近调用数
+RECENT_CALLS = 10
+
+# 调用状态：进行中及三种结束状态
+CALL_STATUSES = ('calling', 'success', 'error', 'warning')
+
+# 耗时直方图的桶上界（秒），最后一个桶收纳更慢的调用
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+
+class ApiCallLog:
+    """API 调用记录
+
+    最近的调用保存在固定容量的环形缓冲区中，各状态的计数和耗时聚合（次数、总和、
+    最大值、分桶直方图）随调用增量更新，统计的时间和内存开销与历史调用数无关。
+    """
+
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY):
+        self.calls = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.total = 0
+        self.status_counts = dict.fromkeys(CALL_STATUSES, 0)
+        self.last_call_time = None
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+
+    def start(self, api_name, description):
+        """记录一次调用开始，返回调用记录（结束时传给 complete）"""
+        with self.lock:
+            self.total += 1
+            self.last_call_time = datetime.now()
+            call_info = {
+                'call_id': self.total,
+                'api_name': api_name,
+                'description': description,
+                'timestamp': self.last_call_time.isoformat(),
+                'status': 'calling',
+            }
+            self.status_counts['calling'] += 1
+            self.calls.append(call_info)
+        call_info['_started'] = time.monotonic()
+        return call_info
+
+    def complete(self, call_info, status, key, info):
+        """更新调用状态；记录可能已被挤出缓冲区，计数仍然更新
+
+        同一次调用可能先成功后又被标记为警告（如数据不足），计数随状态转移，
+        耗时只在第一次结束时计入。
+        """
+        with self.lock:
+            previous = call_info['status']
+            self.status_counts[previous] -= 1
+            self.status_counts[status] += 1
+            call_info['status'] = status
+            call_info[key] = info
+            call_info['completed_at'] = datetime.now().isoformat()
+            if previous == 'calling':
+                self._observe(time.monotonic() - call_info['_started'])
+
+    def _observe(self, seconds):
+        self.latency_count += 1
+        self.latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                break
+
+    def _quantile(self, q):
+        """由直方图估计分位数，返回所在桶的上界"""
+        if self.latency_count == 0:
+            return None
+        rank = q * self.latency_count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            seen += count
+            if seen >= rank:
+                return bound if bound != float('inf') else self.latency_max
+        return self.latency_max
+
+    def recent(self, n=RECENT_CALLS):
+        """最近 n 次调用的副本"""
+        with self.lock:
+            start = max(0, len(self.calls) - n)
+            return [
+                {key: value for key, value in self.calls[i].items() if not key.startswith('_')}
+                for i in range(start, len(self.calls))
+            ]
+
+    def latency_statistics(self):
+        with self.lock:
+            return {
+                'count': self.latency_count,
+                'avg_ms': round(self.latency_sum / self.latency_count * 1000, 1) if self.latency_count else None,
+                'max_ms': round(self.latency_max * 1000, 1),
+                'p50_ms': _ms(self._quantile(0.5)),
+                'p99_ms': _ms(self._quantile(0.99)),
+                'buckets': {
+                    ('+Inf' if bound == float('inf') else str(bound)): count
+                    for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)
+                },
+            }
+
+    def statistics(self):
+        with self.lock:
+            return {
+                'total_calls': self.total,
+                'in_flight_calls': self.status_counts['calling'],
+                'successful_calls': self.status_counts['success'],
+                'failed_calls': self.status_counts['error'],
+                'warning_calls': self.status_counts['warning'],
+                'last_call_time': self.last_call_time.isoformat() if self.last_call_time else None,
+            }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import os
 from datetime import datetime
 import logging
+from exporters import ExportUnavailableError, available_formats, chunked, export_headers, open_export
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from result_store import get_shared_result_store
+from rules import CriteriaConfig
 from stock_screener import StockScreener
 import json
 import io
@@ -38,19 +42,30 @@ def start_screening():
         
         logger.info(f"开始筛选 {target_date} 的自救股票")
         
-        # 创建筛选器实例并直接执行筛选
-        screener = StockScreener()
-        results = screener.screen_rescue_stocks(target_date)
+        # 创建筛选器实例并直接执行筛选（可选的自定义阈值）
+        criteria_config = CriteriaConfig.from_dict(data['criteria']) if data.get('criteria') else None
+        screener = StockScreener(criteria_config=criteria_config)
+        results = screener.screen_rescue_stocks(target_date, profile=data.get('profile'))
         summary = screener.get_screening_summary()
         
         logger.info(f"筛选完成，共找到 {len(results)} 只符合条件的股票")
         
+        # 结果保存在服务端，导出时按句柄读取
+        result_handle = None
+        store = get_shared_result_store()
+        if store is not None:
+            result_handle = store.create(target_date)
+            store.append(result_handle, results)
+        
         return jsonify({
             'success': True,
             'status': 'completed',
             'message': f'筛选完成，找到 {len(results)} 只符合条件的股票',
             'results': results,
-            'summary': summary
+            'summary': summary,
+            'cached': screener.last_result_cached,
+            'profile': screener.last_profile,
+            'result_handle': result_handle
         })
         
     except Exception as e:
@@ -78,89 +93,50 @@ def get_results():
         'message': '请重新执行筛选获取结果'
     })
 
-@app.route('/export/excel', methods=['POST'])
-def export_excel():
-    """导出Excel - 内存处理"""
-    try:
-        data = request.get_json()
-        results = data.get('results', [])
-        
-        if not results:
-            return jsonify({
-                'success': False,
-                'message': '没有可导出的结果'
-            }), 400
-        
-        # 创建内存中的Excel文件
-        from io import BytesIO
-        import pandas as pd
-        
-        output = BytesIO()
-        
-        # 转换结果为DataFrame
-        df = pd.DataFrame(results)
-        
-        # 写入Excel
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='筛选结果')
-        
-        output.seek(0)
-        
-        filename = f"自救股票筛选结果_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
-    except Exception as e:
-        logger.error(f"导出Excel失败: {e}")
+@app.route('/results/<handle>')
+def get_result_handle(handle):
+    """查询服务端保存的结果集"""
+    store = get_shared_result_store()
+    info = store.info(handle) if store is not None else None
+    if info is None:
         return jsonify({
             'success': False,
-            'message': f'导出失败: {str(e)}'
-        }), 500
+            'message': '结果不存在或已过期'
+        }), 404
+    return jsonify({'success': True, **info, 'formats': available_formats()})
 
-@app.route('/export/csv', methods=['POST'])
-def export_csv():
-    """导出CSV - 内存处理"""
+@app.route('/export/<format>', methods=['GET', 'POST'])
+def export_results(format):
+    """流式导出筛选结果（csv、excel、parquet、arrow）
+
+    优先按 result_handle 从服务端读取；实例上没有该结果时使用请求中上传的结果。
+    """
     try:
-        data = request.get_json()
-        results = data.get('results', [])
-        
-        if not results:
+        data = dict(request.args.items())
+        data.update(request.get_json(silent=True) or {})
+        
+        store = get_shared_result_store()
+        handle = data.get('result_handle')
+        if handle and store is not None and store.info(handle) is not None:
+            chunks = store.iter_chunks(handle)
+        elif data.get('results'):
+            chunks = chunked(data['results'])
+        else:
             return jsonify({
                 'success': False,
                 'message': '没有可导出的结果'
             }), 400
         
-        # 创建内存中的CSV文件
-        from io import StringIO
-        import pandas as pd
-        
-        output = StringIO()
-        
-        # 转换结果为DataFrame并写入CSV
-        df = pd.DataFrame(results)
-        df.to_csv(output, index=False, encoding='utf-8-sig')
-        
-        # 转换为BytesIO
-        mem = io.BytesIO()
-        mem.write(output.getvalue().encode('utf-8-sig'))
-        mem.seek(0)
-        
-        filename = f"自救股票筛选结果_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        return send_file(
-            mem,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='text/csv'
-        )
+        stream, filename, mimetype = open_export(format, chunks)
+        return Response(stream_with_context(stream), mimetype=mimetype, headers=export_headers(filename))
         
+    except ExportUnavailableError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 501
     except Exception as e:
-        logger.error(f"导出CSV失败: {e}")
+        logger.error(f"导出失败: {e}")
         return jsonify({
             'success': False,
             'message': f'导出失败: {str(e)}'
@@ -175,6 +151,11 @@ def get_status():
         'environment': 'vercel'
     })
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found_error(error):
     """404错误处理"""
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+自救策略回测
+在 (交易日 × 股票) 面板上用滑动窗口一次性计算每个交易日的筛选结果，
+并统计命中股票之后 N 个交易日的收益率
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from history_store import HistoryStore
+from market_session import shift_date_int, to_date_int
+from limit_prices import limit_ratios
+from vectorized_screener import CONDITION_NAMES, PANEL_FIELDS, rescue_criteria_masks
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 与 get_stock_history 相同的10个自然日窗口
+WINDOW_CALENDAR_DAYS = 10
+DEFAULT_HORIZONS = (1, 3, 5, 10)
+# 每个分片的交易日数，控制 (交易日 × 股票 × 窗口) 临时数组的内存占用
+SHARD_DAYS = 64
+
+
+def window_starts(dates):
+    """每个交易日对应窗口的起始下标"""
+    dates = np.asarray(dates)
+    starts = [shift_date_int(d, -WINDOW_CALENDAR_DAYS) for d in dates]
+    return np.searchsorted(dates, starts, side='left')
+
+
+def rolling_windows(market, day_indices, starts, width):
+    """为指定交易日构造 (交易日 × 股票 × 窗口) 面板，窗口外的位置填 NaN"""
+    offsets = np.arange(-width + 1, 1)
+    index = day_indices[:, None] + offsets[None, :]
+    outside = index < starts[day_indices][:, None]
+    index = np.clip(index, 0, None)
+
+    windows = {}
+    for field in PANEL_FIELDS:
+        values = market[field][index]
+        values[outside] = np.nan
+        windows[field] = values.transpose(0, 2, 1)
+    return windows
+
+
+def evaluate_days(market, dates, day_indices, ratios):
+    """计算指定交易日的各条件掩码，每个掩码形状为 (交易日 × 股票)"""
+    starts = window_starts(dates)
+    day_indices = np.asarray(day_indices)
+    if len(day_indices) == 0:
+        n_stocks = market['close'].shape[1]
+        return {name: np.zeros((0, n_stocks), dtype=bool) for name in CONDITION_NAMES + ('all',)}
+
+    width = int((day_indices - starts[day_indices]).max()) + 1
+    masks = {name: [] for name in CONDITION_NAMES + ('all',)}
+    for offset in range(0, len(day_indices), SHARD_DAYS):
+        chunk = day_indices[offset:offset + SHARD_DAYS]
+        chunk_masks = rescue_criteria_masks(rolling_windows(market, chunk, starts, width), ratios)
+        for name in masks:
+            masks[name].append(chunk_masks[name])
+    return {name: np.concatenate(parts) for name, parts in masks.items()}
+
+
+def _evaluate_shard(args):
+    """进程池任务：shard 内包含计算窗口所需的前置交易日"""
+    market, dates, day_indices, ratios = args
+    return evaluate_days(market, dates, day_indices, ratios)
+
+
+def forward_returns(close, horizons):
+    """信号日收盘买入、持有 N 个交易日后收盘卖出的收益率，形状为 (交易日 × 股票)"""
+    returns = {}
+    for horizon in horizons:
+        values = np.full_like(close, np.nan)
+        if horizon < len(close):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values[:-horizon] = close[horizon:] / close[:-horizon] - 1
+        returns[horizon] = values
+    return returns
+
+
+def summarize_returns(hits, returns):
+    """统计命中股票的远期收益"""
+    summary = {}
+    for horizon, values in returns.items():
+        selected = values[hits]
+        selected = selected[~np.isnan(selected)]
+        summary[horizon] = {
+            'count': int(len(selected)),
+            'mean': float(selected.mean()) if len(selected) else None,
+            'median': float(np.median(selected)) if len(selected) else None,
+            'std': float(selected.std()) if len(selected) else None,
+            'win_rate': float((selected > 0).mean()) if len(selected) else None,
+        }
+    return summary
+
+
+def run_backtest(dates, codes, market, start_date=None, end_date=None,
+                 horizons=DEFAULT_HORIZONS, processes=1):
+    """对 [start_date, end_date] 内每个交易日执行全部自救条件
+
+    market 的每个字段形状为 (交易日 × 股票)，dates 为升序的 yyyymmdd 整数。
+    开始日之前需要至少10个自然日的数据用于构造窗口，结束日之后的数据用于计算远期收益。
+    processes > 1 时按交易日分片交给进程池并行计算。
+    """
+    started = time.perf_counter()
+    dates = np.asarray(dates, dtype=np.int64)
+    codes = np.asarray(codes, dtype=str)
+    start_date = to_date_int(start_date) if start_date else int(dates[0])
+    end_date = to_date_int(end_date) if end_date else int(dates[-1])
+    day_indices = np.flatnonzero((dates >= start_date) & (dates <= end_date))
+    ratios = limit_ratios(codes)
+
+    if processes > 1 and len(day_indices) > processes:
+        starts = window_starts(dates)
+        shards = []
+        for chunk in np.array_split(day_indices, processes):
+            first = int(starts[chunk[0]])
+            last = int(chunk[-1]) + 1
+            shard_market = {field: market[field][first:last] for field in PANEL_FIELDS}
+            shards.append((shard_market, dates[first:last], chunk - first, ratios))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parts = list(executor.map(_evaluate_shard, shards))
+        masks = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    else:
+        masks = evaluate_days(market, dates, day_indices, ratios)
+
+    hits = masks['all']
+    returns = {
+        horizon: values[day_indices]
+        for horizon, values in forward_returns(market['close'], horizons).items()
+    }
+    daily_hits = {
+        int(dates[day]): codes[hits[i]].tolist()
+        for i, day in enumerate(day_indices) if hits[i].any()
+    }
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'trading_days': int(len(day_indices)),
+        'stocks': int(len(codes)),
+        'daily_hits': daily_hits,
+        'total_hits': int(hits.sum()),
+        'condition_pass_counts': {name: int(masks[name].sum()) for name in CONDITION_NAMES},
+        'forward_returns': summarize_returns(hits, returns),
+        'elapsed_seconds': time.perf_counter() - started,
+    }
+
+
+def run_backtest_from_store(start_date, end_date, horizons=DEFAULT_HORIZONS, processes=1, store=None):
+    """用本地历史数据回测（股票范围为本地已存储的股票，存在幸存者偏差）"""
+    store = store or HistoryStore()
+    start_date, end_date = to_date_int(start_date), to_date_int(end_date)
+    dates, codes, market = store.read_market(
+        shift_date_int(start_date, -WINDOW_CALENDAR_DAYS), to_date_int(np.datetime64('today'))
+    )
+    if not dates:
+        logger.error("本地没有可用于回测的历史数据")
+        return None
+    logger.info(f"回测数据: {len(dates)} 个交易日 × {len(codes)} 只股票")
+    return run_backtest(dates, codes, market, start_date, end_date, horizons, processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='自救策略回测')
+    parser.add_argument('--start', required=True, help='开始日期，如 2020-01-01')
+    parser.add_argument('--end', required=True, help='结束日期，如 2024-12-31')
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(DEFAULT_HORIZONS))
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    result = run_backtest_from_store(args.start, args.end, args.horizons, args.processes)
+    if result is None:
+        return
+
+    print(f"回测区间: {result['start_date']} - {result['end_date']}，"
+          f"{result['trading_days']} 个交易日 × {result['stocks']} 只股票，耗时 {result['elapsed_seconds']:.2f}秒")
+    print(f"命中次数: {result['total_hits']}")
+    for name, count in result['condition_pass_counts'].items():
+        print(f"  {name}: {count}")
+    for horizon, stats in result['forward_returns'].items():
+        if stats['count']:
+            print(f"  {horizon}日收益: 均值 {stats['mean']:.2%}，中位数 {stats['median']:.2%}，"
+                  f"胜率 {stats['win_rate']:.1%} ({stats['count']}次)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+紧凑的K线与股票记录
+BarArray 以列数组保存单只股票按日期排序的日线（OHLC 为 float32，成交量为 int64，
+日期为 yyyymmdd 的 int32），数据获取层返回它、筛选规则直接读取它，不再为每只股票
+构造 pandas DataFrame。StockRow 是行情快照中一只股票的 __slots__ 记录。
+"""
+import numpy as np
+import pandas as pd
+
+from market_session import from_date_int
+
+# 价格列 float32 只保留约7位有效数字，读出时按价格最小变动单位（分）还原
+PRICE_DECIMALS = 2
+
+# BarArray 字段 -> akshare 日线列名
+BAR_FIELDS = {
+    'open': '开盘',
+    'high': '最高',
+    'low': '最低',
+    'close': '收盘',
+    'volume': '成交量',
+    'amount': '成交额',
+}
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+# 快速日期解析的合理年份范围
+MIN_YEAR, MAX_YEAR = 1990, 2100
+
+
+def date_ints(values):
+    """日期列（字符串、date 或 datetime）转换为 yyyymmdd 的 int32 数组"""
+    try:
+        # ISO 字符串和 date 对象由 numpy 直接解析，比 pd.to_datetime 快一个数量级；
+        # numpy 会把 "20240105" 当作年份，解析出的年份不合理时改用 pandas
+        dates = np.asarray(values, dtype='datetime64[D]')
+        parsed_years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        if len(dates) and (parsed_years.min() < MIN_YEAR or parsed_years.max() > MAX_YEAR):
+            raise ValueError('日期格式不是 YYYY-MM-DD')
+    except (TypeError, ValueError):
+        dates = pd.to_datetime(pd.Series(values)).to_numpy(dtype='datetime64[D]')
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+    return (years * 10000 + months * 100 + days).astype(np.int32)
+
+
+class BarArray:
+    """单只股票的日线，各字段为等长的一维数组，按日期升序
+
+    切片（tail、between）返回共享底层数组的视图，不复制数据。
+    """
+
+    __slots__ = ('symbol', 'dates', 'open', 'high', 'low', 'close', 'volume', 'amount')
+
+    def __init__(self, symbol, dates, open, high, low, close, volume, amount=None):
+        self.symbol = symbol
+        self.dates = np.asarray(dates, dtype=np.int32)
+        self.open = np.asarray(open, dtype=np.float32)
+        self.high = np.asarray(high, dtype=np.float32)
+        self.low = np.asarray(low, dtype=np.float32)
+        self.close = np.asarray(close, dtype=np.float32)
+        self.volume = np.asarray(volume, dtype=np.int64)
+        # 成交额量级可达 1e10，float32 精度不足
+        self.amount = np.asarray(amount if amount is not None else np.full(len(self.dates), np.nan),
+                                 dtype=np.float64)
+
+    @classmethod
+    def empty(cls, symbol):
+        return cls(symbol, [], [], [], [], [], [], [])
+
+    @classmethod
+    def from_frame(cls, symbol, frame):
+        """由 akshare 格式的日线 DataFrame 构造，按日期排序，丢弃收盘价缺失的行"""
+        if frame is None or len(frame) == 0:
+            return cls.empty(symbol)
+
+        def column(name):
+            if name not in frame.columns:
+                return np.full(len(frame), np.nan)
+            return pd.to_numeric(frame[name], errors='coerce').to_numpy(dtype=np.float64)
+
+        values = {field: column(name) for field, name in BAR_FIELDS.items()}
+        dates = date_ints(frame['日期'])
+        keep = ~np.isnan(values['close'])
+        order = np.argsort(dates[keep], kind='stable')
+        values = {field: array[keep][order] for field, array in values.items()}
+        values['volume'] = np.nan_to_num(values['volume']).round()
+        return cls(symbol, dates[keep][order], **values)
+
+    @classmethod
+    def concat(cls, first, second):
+        return cls(first.symbol, *(np.concatenate([getattr(first, name), getattr(second, name)])
+                                   for name in cls.__slots__[1:]))
+
+    def _take(self, index):
+        return BarArray(self.symbol, *(getattr(self, name)[index] for name in self.__slots__[1:]))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def tail(self, n):
+        return self._take(slice(max(0, len(self) - n), None))
+
+    def between(self, start_int, end_int):
+        """日期在 [start_int, end_int] 内的K线"""
+        lo, hi = np.searchsorted(self.dates, [start_int, end_int + 1])
+        return self._take(slice(lo, hi))
+
+    def after(self, date_int):
+        """日期晚于 date_int 的K线"""
+        return self._take(slice(np.searchsorted(self.dates, date_int + 1), None))
+
+    def field(self, name):
+        """规则计算用的 float64 数组，价格按分还原"""
+        values = getattr(self, name).astype(np.float64)
+        return np.round(values, PRICE_DECIMALS) if name in PRICE_FIELDS else values
+
+    def rule_bars(self, fields=('open', 'high', 'low', 'close', 'volume')):
+        """规则输入：字段 -> float64 一维数组"""
+        return {name: self.field(name) for name in fields}
+
+    def date_strings(self):
+        return [from_date_int(int(d)).isoformat() for d in self.dates]
+
+    def to_frame(self):
+        """转换为 akshare 格式的 DataFrame（导出、兼容旧接口用）"""
+        return pd.DataFrame({
+            '日期': self.date_strings(),
+            '股票代码': self.symbol,
+            **{name: self.field(field) for field, name in BAR_FIELDS.items()},
+        })
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__[1:])
+
+
+class StockRow:
+    """行情快照中的一只股票，字段取自快照的同名列（缺失时为 0）"""
+
+    __slots__ = ('code', 'name', 'price', 'change_pct', 'volume', 'turnover', 'market_cap')
+
+    # 字段 -> 行情快照列名
+    COLUMNS = {
+        'price': '最新价',
+        'change_pct': '涨跌幅',
+        'volume': '成交量',
+        'turnover': '成交额',
+        'market_cap': '总市值',
+    }
+
+    def __init__(self, code, name, price=0, change_pct=0, volume=0, turnover=0, market_cap=0):
+        self.code = code
+        self.name = name
+        self.price = price
+        self.change_pct = change_pct
+        self.volume = volume
+        self.turnover = turnover
+        self.market_cap = market_cap
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """按列批量构造记录列表，避免逐行 iterrows 产生的 Series"""
+        columns = [
+            snapshot[name].tolist() if name in snapshot.columns else [0] * len(snapshot)
+            for name in cls.COLUMNS.values()
+        ]
+        return [cls(*values) for values in zip(snapshot['代码'].tolist(), snapshot['名称'].tolist(), *columns)]
+
+    def to_result(self):
+        """筛选结果中的一条记录"""
+        return {
+            'code': self.code,
+            'name': self.name,
+            'current_price': self.price,
+            'change_pct': self.change_pct,
+            'volume': self.volume,
+            'turnover': self.turnover,
+            'market_cap': self.market_cap,
+        }
+
+    def __repr__(self):
+        return f"StockRow({self.code} {self.name})"
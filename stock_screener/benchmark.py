@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+"""
+性能基准脚本
+在随机生成的 (股票 × 交易日) 面板上比较向量化引擎与逐只股票的标量路径；
+--suite 在合成行情（synthetic_market）上离线测量完整筛选流程和各条件函数；
+--record / --replay 录制一次真实筛选的上游响应并离线回放计时；
+--cold-start 在新进程中测量 api/index.py 的导入耗时和首个请求的延迟；
+--live 比较盘中增量筛选（live_screener）与每次从头完整筛选的单轮耗时；
+--workers 测量分片筛选（work_queue）的吞吐量随 worker 进程数的变化
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, time as clock_time
+
+import numpy as np
+import pandas as pd
+
+from backtest import evaluate_days, run_backtest, window_starts
+from bars import BAR_FIELDS, BarArray
+from cache import SnapshotCache
+from data_fetcher import StockDataFetcher
+from stock_screener import StockScreener
+from limit_prices import limit_prices, limit_ratios, previous_close, round_price
+from live_screener import LiveScreener
+from providers import AkshareProvider, RecordingProvider, ReplayProvider
+from rate_limiter import SHARED_RATE_LIMITER, TokenBucket
+from rules import DEFAULT_RULES, CriteriaConfig, RulePlan
+from snapshot_artifact import build_artifact
+from synthetic_market import SyntheticMarket
+from vectorized_screener import rescue_criteria_masks, screen_panel
+from work_queue import run_local
+
+
+def random_panel(n_stocks, n_days=9, seed=0):
+    """生成带停牌、涨跌停和小阳线的随机面板
+
+    收盘价按前收盘价随机游走，涨跌停日的收盘价恰为交易所规则下的涨跌停价，
+    其余日子的涨跌幅限制在涨跌停价之内。
+    """
+    rng = np.random.default_rng(seed)
+    prefixes = ('600', '601', '603', '000', '002', '300', '688', '830')
+    codes = np.array([f"{prefixes[i % len(prefixes)]}{i // len(prefixes):03d}" for i in range(n_stocks)])
+    ratios = limit_ratios(codes)[:, None]
+
+    # 混合涨跌停、小阳线与随机波动
+    move = rng.choice(
+        ['up', 'down', 'small', 'random'], size=(n_stocks, n_days), p=[0.1, 0.05, 0.35, 0.5]
+    )
+    gap = rng.normal(0, 0.01, (n_stocks, n_days))
+    body = np.where(move == 'small', rng.uniform(0.015, 0.05, (n_stocks, n_days)),
+                    rng.normal(0, 0.03, (n_stocks, n_days)))
+
+    # 停牌日不产生K线，复牌后以停牌前的收盘价为前收盘价
+    suspended = rng.random((n_stocks, n_days)) < 0.05
+    close = np.empty((n_stocks, n_days))
+    open_price = np.empty((n_stocks, n_days))
+    prev = np.round(rng.uniform(3, 80, n_stocks), 2)[:, None]
+    for day in range(n_days):
+        up, down = limit_prices(prev, ratios)
+        today_open = np.clip(round_price(prev * (1 + gap[:, [day]])), down, up)
+        today_close = np.clip(round_price(today_open * (1 + body[:, [day]])), down, up)
+        today_close = np.where(move[:, [day]] == 'up', up, today_close)
+        today_close = np.where(move[:, [day]] == 'down', down, today_close)
+        open_price[:, [day]] = today_open
+        close[:, [day]] = today_close
+        prev = np.where(suspended[:, [day]], prev, today_close)
+
+    high = np.round(np.maximum(open_price, close) * (1 + rng.uniform(0, 0.02, (n_stocks, n_days))), 2)
+    low = np.round(np.minimum(open_price, close) * (1 - rng.uniform(0, 0.02, (n_stocks, n_days))), 2)
+    volume = rng.integers(1000, 100000, (n_stocks, n_days)).astype(float)
+
+    panel = {'open': open_price, 'high': high, 'low': low, 'close': close, 'volume': volume}
+    for values in panel.values():
+        values[suspended] = np.nan
+    return codes, panel
+
+
+def panel_to_frames(codes, panel):
+    """把面板拆成 akshare 日线格式的逐股 DataFrame（日期为连续工作日）"""
+    dates = pd.bdate_range('2024-01-02', periods=panel['close'].shape[1]).strftime('%Y-%m-%d')
+    frames = {}
+    for i, code in enumerate(codes):
+        frame = pd.DataFrame({
+            '日期': dates,
+            '开盘': panel['open'][i], '收盘': panel['close'][i],
+            '最高': panel['high'][i], '最低': panel['low'][i],
+            '成交量': panel['volume'][i],
+        })
+        frames[code] = frame[~frame['收盘'].isna()].reset_index(drop=True)
+    return frames
+
+
+def panel_to_bars(codes, panel):
+    """把面板拆成与 get_stock_history 返回格式一致的逐股 BarArray"""
+    return {code: BarArray.from_frame(code, frame) for code, frame in panel_to_frames(codes, panel).items()}
+
+
+def scalar_screen(codes, panel):
+    """用 StockScreener.check_rescue_criteria 逐只筛选同一份面板，作为对照"""
+    histories = panel_to_bars(codes, panel)
+    screener = StockScreener.__new__(StockScreener)
+    screener.data_fetcher = StockDataFetcher(use_history_store=False, snapshot_artifact=None)
+    screener.rule_plan = RulePlan()
+    screener.limit_table = None
+    screener.profiler = None
+
+    def get_stock_history(symbol, days=5, min_days=None, **kwargs):
+        bars = histories[symbol]
+        return bars.tail(days) if len(bars) >= (min_days or days) else None
+
+    screener.data_fetcher.get_stock_history = get_stock_history
+    return [code for code in codes if screener.check_rescue_criteria(None, code)]
+
+
+def benchmark_vectorized(n_stocks, repeat=20):
+    """测量向量化引擎耗时，并校验与标量路径结果一致"""
+    codes, panel = random_panel(n_stocks)
+
+    start = time.perf_counter()
+    expected = scalar_screen(codes, panel)
+    scalar_seconds = time.perf_counter() - start
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matched = screen_panel(codes, panel)
+        timings.append(time.perf_counter() - start)
+
+    assert matched == expected, "向量化结果与标量路径不一致"
+    return {
+        'stocks': n_stocks,
+        'matched': len(matched),
+        'scalar_ms': scalar_seconds * 1000,
+        'vectorized_ms': float(np.median(timings)) * 1000,
+    }
+
+
+def random_market(n_stocks, n_days, seed=0):
+    """生成 (交易日 × 股票) 的随机行情，日期为连续的工作日"""
+    codes, panel = random_panel(n_stocks, n_days, seed)
+    dates = pd.bdate_range('2019-01-02', periods=n_days).strftime('%Y%m%d').astype(int).to_numpy()
+    market = {field: np.ascontiguousarray(values.T) for field, values in panel.items()}
+    return dates, codes, market
+
+
+def check_backtest_days(dates, codes, market, day_indices):
+    """对抽样交易日逐日切片计算，校验回测结果与单日筛选一致"""
+    ratios = limit_ratios(codes)
+    masks = evaluate_days(market, dates, day_indices, ratios)
+    starts = window_starts(dates)
+    for i, day in enumerate(day_indices):
+        window = {field: values[starts[day]:day + 1].T for field, values in market.items()}
+        expected = rescue_criteria_masks(window, ratios)
+        for name, mask in expected.items():
+            assert np.array_equal(masks[name][i], mask), f"{dates[day]} {name} 回测结果与单日筛选不一致"
+
+
+def benchmark_backtest(n_stocks=3000, n_days=1250, processes=(1, 4)):
+    """测量多年回测耗时（默认约5年 × 3000只股票）"""
+    dates, codes, market = random_market(n_stocks, n_days)
+    check_backtest_days(dates, codes, market, np.arange(10, n_days, max(1, n_days // 20)))
+
+    results = []
+    for workers in processes:
+        result = run_backtest(dates, codes, market, processes=workers)
+        results.append({
+            'processes': workers,
+            'trading_days': result['trading_days'],
+            'stocks': result['stocks'],
+            'hits': result['total_hits'],
+            'seconds': result['elapsed_seconds'],
+        })
+    return results
+
+
+# 基准套件默认的股票规模
+SUITE_SIZES = (100, 1000, 5000)
+# 分批路径每批的股票数
+SUITE_BATCH_SIZE = 200
+# 基准中不限速：合成接口的延迟由 SyntheticMarket.latency 模拟
+UNTHROTTLED_RATE = 1e9
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+# 冷启动预算（毫秒），超出时报告 OVER
+COLD_START_BUDGET_MS = {
+    'import': 500,
+    'status': 50,
+    'screen': 3000,
+}
+# 导入 api/index.py 时不应加载的模块
+COLD_START_HEAVY_MODULES = ('pandas', 'akshare')
+COLD_START_BATCH_SIZE = 20
+# 盘中每轮刷新时最新价变化的股票比例
+LIVE_CHANGED_RATIO = 0.1
+# 分片筛选基准：合成接口的平均延迟（秒）和所有 worker 共享的速率上限（次/秒）
+WORKER_LATENCY = 0.05
+WORKER_RATE_LIMIT = 60.0
+# 在新进程中执行：导入入口、请求 /status、请求第一批 /screen，输出 JSON
+COLD_START_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+result = {'import_ms': (time.perf_counter() - started) * 1000,
+          'heavy_modules': [name for name in sys.argv[4:] if name in sys.modules]}
+client = index.app.test_client()
+started = time.perf_counter()
+client.get('/status')
+result['status_ms'] = (time.perf_counter() - started) * 1000
+started = time.perf_counter()
+body = client.post('/screen', json={'date': sys.argv[2], 'batch_size': int(sys.argv[3])}).get_json()
+result['screen_ms'] = (time.perf_counter() - started) * 1000
+result['screen_success'] = body.get('success')
+result['snapshot_version'] = body.get('snapshot_version')
+result['api_calls'] = body.get('api_calls_made')
+print(json.dumps(result))
+"""
+
+
+def latency_summary(seconds, count=None):
+    """耗时样本（秒）的 p50/p99（毫秒）及吞吐量（次/秒）"""
+    seconds = np.asarray(seconds, dtype=float)
+    total = float(seconds.sum())
+    if len(seconds) == 0:
+        return {'count': 0, 'p50_ms': None, 'p99_ms': None, 'per_second': None}
+    return {
+        'count': len(seconds),
+        'p50_ms': float(np.percentile(seconds, 50)) * 1000,
+        'p99_ms': float(np.percentile(seconds, 99)) * 1000,
+        'per_second': (count or len(seconds)) / total if total > 0 else None,
+    }
+
+
+def synthetic_screener(provider, rules=None):
+    """连接指定数据源（合成行情、cassette 回放）的筛选器：不用本地存储和结果缓存，使用独立的快照缓存和不限速的令牌桶"""
+    screener = StockScreener(use_result_cache=False, rules=rules)
+    screener.data_fetcher = StockDataFetcher(
+        use_history_store=False, snapshot_cache=SnapshotCache(),
+        rate_limiter=TokenBucket(UNTHROTTLED_RATE), provider=provider, snapshot_artifact=None
+    )
+    return screener
+
+
+def without_first_limit_up():
+    """去掉条件5的规则集：条件5（当天涨停）与条件1（当天非涨停）矛盾，植入的形态只满足条件1~4"""
+    return [rule for rule in DEFAULT_RULES if rule.name != 'first_limit_up_in_3_days']
+
+
+def run_screening(screener, target_date, batch_size=None, max_stocks=None):
+    """执行一次完整筛选（batch_size 为 None 时走 screen_rescue_stocks，否则分批），返回 (结果, 耗时秒)"""
+    started = time.perf_counter()
+    if batch_size is None:
+        results = screener.screen_rescue_stocks(target_date, max_stocks=max_stocks, profile='stages')
+    else:
+        results, batch_start, snapshot_version = [], 0, None
+        while True:
+            response = screener.screen_rescue_stocks_batch(
+                target_date, batch_start=batch_start, batch_size=batch_size,
+                snapshot_version=snapshot_version, profile='stages'
+            )
+            results.extend(response['results'])
+            snapshot_version = response['snapshot_version']
+            batch_start = response['processed_count']
+            if not response['has_more']:
+                break
+    return results, time.perf_counter() - started
+
+
+def benchmark_screening(market, batch_size=None, rules=None):
+    """在合成行情上运行一次完整筛选
+
+    返回整轮耗时、吞吐量（全市场股票数 / 秒）、逐股检查耗时的 p50/p99 及命中的代码。
+    """
+    screener = synthetic_screener(market, rules)
+    calls_before = dict(market.calls)
+    # 合成行情的最新交易日即"今天"的快照，按实时筛选路径执行
+    results, elapsed = run_screening(screener, datetime.now().strftime('%Y-%m-%d'), batch_size, market.n_stocks)
+
+    return {
+        'path': 'screen' if batch_size is None else f'batch({batch_size})',
+        'stocks': market.n_stocks,
+        'checked': len(screener.profiler.stocks),
+        'matched': sorted(result['code'] for result in results),
+        'unevaluated': len(screener.unevaluated_stocks),
+        'upstream_calls': {name: market.calls[name] - calls_before[name] for name in market.calls},
+        'seconds': elapsed,
+        'stocks_per_second': market.n_stocks / elapsed,
+        'per_stock': latency_summary(list(screener.profiler.stocks.values())),
+        'stages': screener.last_profile['stages'],
+    }
+
+
+def record_screening(path, target_date=None, max_stocks=None):
+    """用 akshare 执行一次真实筛选，把全部上游响应录制到 cassette，返回命中的代码"""
+    recorder = RecordingProvider(AkshareProvider(), path)
+    screener = synthetic_screener(recorder)
+    screener.data_fetcher.rate_limiter = SHARED_RATE_LIMITER
+    results, _ = run_screening(screener, target_date or datetime.now().strftime('%Y-%m-%d'), max_stocks=max_stocks)
+    recorder.save()
+    return sorted(result['code'] for result in results)
+
+
+def benchmark_replay(path, target_date=None, max_stocks=None, repeat=3):
+    """回放 cassette 重复执行同一次筛选，离线测量耗时（用于二分定位性能回退）"""
+    timings, matched = [], None
+    for _ in range(repeat):
+        replay = ReplayProvider(path)
+        screener = synthetic_screener(replay)
+        results, elapsed = run_screening(screener, target_date or datetime.now().strftime('%Y-%m-%d'),
+                                         max_stocks=max_stocks)
+        codes = sorted(result['code'] for result in results)
+        assert matched is None or codes == matched, "同一 cassette 的回放结果不一致"
+        matched = codes
+        timings.append(elapsed)
+    return {
+        'cassette': path,
+        'source': replay.source,
+        'recorded_at': replay.recorded_at,
+        'replayed_calls': replay.replayed,
+        'misses': replay.misses,
+        'matched': matched,
+        'seconds': float(np.median(timings)),
+        'per_stock': latency_summary(list(screener.profiler.stocks.values())),
+        'stages': screener.last_profile['stages'],
+    }
+
+
+def market_windows(market, n_bars):
+    """合成行情中每只股票最近 n_bars 根非停牌K线（含前收盘价和涨跌停价），用于逐股调用条件函数"""
+    windows = []
+    for i in range(market.n_stocks):
+        present = ~np.isnan(market.bars['close'][i])
+        bars = {field: values[i, present] for field, values in market.bars.items()}
+        bars['prev_close'] = previous_close(bars['close'])
+        bars['limit_up'], bars['limit_down'] = limit_prices(bars['prev_close'], market.ratios[i])
+        windows.append({field: values[-n_bars:] for field, values in bars.items()})
+    return windows
+
+
+def benchmark_criteria(market, config=None):
+    """测量每个条件函数：逐股调用的单次耗时 p50/p99，以及对全市场一次向量化调用的耗时"""
+    config = config or CriteriaConfig()
+    n_bars = max(rule.lookback for rule in DEFAULT_RULES) + 1
+    windows = market_windows(market, n_bars)
+    panel = {field: np.stack([window[field] for window in windows if len(window['close']) == n_bars])
+             for field in windows[0]}
+
+    results = []
+    for rule in DEFAULT_RULES:
+        timings = []
+        for window in windows:
+            if len(window['close']) < rule.lookback:
+                continue
+            bars = {field: values[-rule.lookback:] for field, values in window.items()}
+            start = time.perf_counter()
+            rule.mask(bars, config)
+            timings.append(time.perf_counter() - start)
+
+        bars = {field: values[:, -rule.lookback:] for field, values in panel.items()}
+        start = time.perf_counter()
+        passed = rule.mask(bars, config)
+        vectorized = time.perf_counter() - start
+        results.append({
+            'rule': rule.name,
+            'scalar': latency_summary(timings),
+            'vectorized_ms': vectorized * 1000,
+            'pass_rate': float(np.mean(passed)) if len(passed) else None,
+        })
+    return results
+
+
+def legacy_history_arrays(symbol, frame, days):
+    """旧的逐股 DataFrame 路径：排序、规整日期和列、截取尾部、再逐列转换为规则输入"""
+    frame = frame.sort_values('日期')
+    frame['股票代码'] = symbol
+    frame['日期'] = pd.to_datetime(frame['日期']).dt.strftime('%Y-%m-%d')
+    frame = frame[['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额']].reset_index(drop=True)
+    frame = frame.tail(days)
+    bars = {field: pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=float)
+            for field, column in BAR_FIELDS.items() if field != 'amount'}
+    return frame, bars
+
+
+def benchmark_history_representation(n_stocks=5000, days=5, seed=0):
+    """比较逐股 DataFrame 与 BarArray 两种历史数据表示：每只股票的转换 CPU 耗时和常驻内存
+
+    内存为全部股票的历史数据保留在缓存中时 tracemalloc 统计的分配量。
+    """
+    market = SyntheticMarket(n_stocks, seed=seed)
+    start_date = int(market.date_ints[0])
+    end_date = int(market.date_ints[-1])
+    raw = {code: market.stock_zh_a_hist(code, start_date=start_date, end_date=end_date) for code in market.codes}
+
+    def measure(convert):
+        # CPU 与内存分开测量，tracemalloc 本身会显著拖慢分配
+        frames = {code: frame.copy() for code, frame in raw.items()}
+        started = time.process_time()
+        for code, frame in frames.items():
+            convert(code, frame)
+        cpu = time.process_time() - started
+
+        frames = {code: frame.copy() for code, frame in raw.items()}
+        tracemalloc.start()
+        kept = {code: convert(code, frames.pop(code)) for code in list(frames)}
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return kept, {
+            'cpu_us_per_stock': cpu / n_stocks * 1e6,
+            'retained_mb': retained / 2 ** 20,
+            'peak_mb': peak / 2 ** 20,
+        }
+
+    legacy, legacy_stats = measure(lambda code, frame: legacy_history_arrays(code, frame, days))
+    compact, compact_stats = measure(lambda code, frame: (
+        lambda bars: (bars, bars.rule_bars()))(BarArray.from_frame(code, frame).tail(days)))
+    for code in market.codes:
+        for field, values in legacy[code][1].items():
+            assert np.array_equal(values, compact[code][1][field], equal_nan=True), f"{code} {field} 两种表示不一致"
+    return {
+        'stocks': n_stocks,
+        'dataframe': legacy_stats,
+        'bar_array': compact_stats,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def cold_start_probe(env, target_date):
+    """在新的 Python 进程中执行 COLD_START_PROBE，返回其测量结果"""
+    output = subprocess.run(
+        [sys.executable, '-c', COLD_START_PROBE, API_DIR, target_date, str(COLD_START_BATCH_SIZE),
+         *COLD_START_HEAVY_MODULES],
+        env=env, capture_output=True, text=True, check=True, cwd=API_DIR,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark_cold_start(n_stocks=5000, repeat=3):
+    """测量 Vercel 入口的冷启动：无快照文件与有预构建快照文件两种情况，各取 repeat 次的中位数
+
+    子进程使用合成行情（STOCK_DATA_PROVIDER=synthetic:N）和临时目录中的本地存储、结果缓存。
+    """
+    target_date = datetime.now().strftime('%Y-%m-%d')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact_path = os.path.join(tmp, 'snapshot_artifact.npz')
+        build_artifact(artifact_path, provider=SyntheticMarket(n_stocks))
+        for label, artifact in (('no_artifact', os.path.join(tmp, 'missing.npz')), ('artifact', artifact_path)):
+            runs = []
+            for run in range(repeat):
+                env = dict(
+                    os.environ,
+                    STOCK_DATA_PROVIDER=f'synthetic:{n_stocks}',
+                    STOCK_SNAPSHOT_ARTIFACT=artifact,
+                    STOCK_HISTORY_DIR=os.path.join(tmp, f'history-{label}-{run}'),
+                    STOCK_RESULT_CACHE_PATH=os.path.join(tmp, f'results-{label}-{run}.sqlite'),
+                )
+                runs.append(cold_start_probe(env, target_date))
+            summary = {key: float(np.median([r[key] for r in runs])) for key in ('import_ms', 'status_ms', 'screen_ms')}
+            summary.update({key: runs[-1][key] for key in ('heavy_modules', 'screen_success', 'snapshot_version', 'api_calls')})
+            summary['budget'] = {
+                name: summary[f'{name}_ms'] <= budget for name, budget in COLD_START_BUDGET_MS.items()
+            }
+            results[label] = summary
+    return {'stocks': n_stocks, 'results': results}
+
+
+def drift_market(market, ratio, rng):
+    """模拟一次盘中刷新：随机一部分股票的最新价小幅变动（最高/最低随之扩展），全部股票成交量增加"""
+    b = market.bars
+    rows = rng.choice(market.n_stocks, size=int(market.n_stocks * ratio), replace=False)
+    moved = round_price(b['close'][rows, -1] * (1 + rng.normal(0, 0.003, len(rows))))
+    b['close'][rows, -1] = moved
+    b['high'][rows, -1] = np.fmax(b['high'][rows, -1], moved)
+    b['low'][rows, -1] = np.fmin(b['low'][rows, -1], moved)
+    b['volume'][:, -1] += rng.integers(1, 1000, market.n_stocks)
+
+
+def benchmark_live(n_stocks=5000, ticks=5, ratio=LIVE_CHANGED_RATIO, latency=0.0, seed=0):
+    """每轮刷新 ratio 比例的股票后，分别测量增量筛选一轮和从头完整筛选一次的耗时，并核对两者命中一致
+
+    完整筛选每轮清空历史数据缓存，与"每次重新筛选全部股票"一致；两者都不限速。
+    """
+    market = SyntheticMarket(n_stocks, seed=seed, latency=latency)
+    rules = without_first_limit_up()
+    live = LiveScreener(synthetic_screener(market, rules))
+    full = synthetic_screener(market, rules)
+    now = datetime.combine(market.dates[-1].date(), clock_time(10, 0))
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    started = time.perf_counter()
+    live.refresh(now)
+    first_tick = time.perf_counter() - started
+    rng = np.random.default_rng(seed)
+    live_seconds, full_seconds, history_calls, reevaluated = [], [], 0, 0
+    for _ in range(ticks):
+        drift_market(market, ratio, rng)
+        live.screener.data_fetcher.snapshot_cache.clear()
+        calls_before = market.calls['stock_zh_a_hist']
+        started = time.perf_counter()
+        events = live.refresh(now)
+        live_seconds.append(time.perf_counter() - started)
+        reevaluated += events[-1][1]['changed']
+        history_calls += market.calls['stock_zh_a_hist'] - calls_before
+
+        full.data_fetcher.snapshot_cache.clear()
+        full.data_fetcher.history_cache.clear()
+        results, elapsed = run_screening(full, today, max_stocks=n_stocks)
+        full_seconds.append(elapsed)
+        assert set(live.matches) == {row['code'] for row in results}, "增量筛选与完整筛选的命中不一致"
+    return {
+        'stocks': n_stocks,
+        'changed_per_tick': int(n_stocks * ratio),
+        'reevaluated_per_tick': reevaluated / ticks,
+        'first_tick_ms': first_tick * 1000,
+        'live_ms': float(np.median(live_seconds)) * 1000,
+        'full_ms': float(np.median(full_seconds)) * 1000,
+        'history_calls_per_tick': history_calls / ticks,
+        'matched': len(live.matches),
+    }
+
+
+def sharded_worker_screener(n_stocks, latency, seed=0):
+    """分片筛选基准中每个 worker 进程的筛选器：各自生成同一份合成行情，单线程检查"""
+    screener = synthetic_screener(SyntheticMarket(n_stocks, seed=seed, latency=latency), without_first_limit_up())
+    screener.max_workers = 1
+    return screener
+
+
+def benchmark_workers(n_stocks=2000, workers=(1, 2, 4, 8), latency=WORKER_LATENCY, rate=WORKER_RATE_LIMIT,
+                      shard_size=20):
+    """同一份合成行情上分别用不同数量的 worker 进程完成一次分片筛选，核对结果与单进程完整筛选一致
+
+    每个 worker 单线程检查，吞吐量受接口延迟限制；worker 共用 rate 次/秒的 SQLite 令牌桶。
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    expected, _ = run_screening(sharded_worker_screener(n_stocks, 0.0), today, max_stocks=n_stocks)
+    expected = sorted(row['code'] for row in expected)
+    factory = functools.partial(sharded_worker_screener, n_stocks, latency)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in workers:
+            results, stats = run_local(today, count, shard_size, rate, factory,
+                                       path=os.path.join(tmp, f'queue-{count}.sqlite'))
+            assert sorted(row['code'] for row in results) == expected, "分片筛选与完整筛选的结果不一致"
+            rows.append(dict(stats, matched=len(results)))
+    return {'stocks': n_stocks, 'latency': latency, 'rate': rate, 'results': rows}
+
+
+def run_suite(sizes=SUITE_SIZES, latency=0.0, error_rate=0.0, seed=0):
+    """在各规模的合成行情上测量 screen_rescue_stocks、分批路径和各条件函数"""
+    suite = []
+    for n_stocks in sizes:
+        market = SyntheticMarket(n_stocks, seed=seed, latency=latency, error_rate=error_rate)
+        screen = benchmark_screening(market)
+        batch = benchmark_screening(market, batch_size=SUITE_BATCH_SIZE)
+        planted = benchmark_screening(market, rules=without_first_limit_up())
+        suite.append({
+            'stocks': n_stocks,
+            'planted': len(market.planted),
+            'planted_found': len(market.planted & set(planted['matched'])),
+            'screening': [screen, batch],
+            'criteria': benchmark_criteria(market),
+        })
+    return suite
+
+
+def print_suite(suite):
+    def ms(value):
+        return f"{value:>9.2f}" if value is not None else f"{'-':>9}"
+
+    for entry in suite:
+        print(f"\n== {entry['stocks']} 只股票（植入 {entry['planted']} 只，条件1~4 找回 {entry['planted_found']} 只）")
+        print(f"{'路径':<12} {'检查':>6} {'命中':>6} {'未评估':>6} {'耗时(秒)':>9} {'股票/秒':>9} {'p50(ms)':>9} {'p99(ms)':>9}")
+        for result in entry['screening']:
+            per_stock = result['per_stock']
+            print(f"{result['path']:<12} {result['checked']:>6} {len(result['matched']):>6} "
+                  f"{result['unevaluated']:>6} {result['seconds']:>9.3f} {result['stocks_per_second']:>9.0f} "
+                  f"{ms(per_stock['p50_ms'])} {ms(per_stock['p99_ms'])}")
+        print(f"{'条件':<26} {'p50(us)':>9} {'p99(us)':>9} {'次/秒':>10} {'向量化(ms)':>10} {'通过率':>7}")
+        for result in entry['criteria']:
+            scalar = result['scalar']
+            print(f"{result['rule']:<26} {scalar['p50_ms'] * 1000:>9.1f} {scalar['p99_ms'] * 1000:>9.1f} "
+                  f"{scalar['per_second']:>10.0f} {result['vectorized_ms']:>10.3f} {result['pass_rate']:>7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='自救筛选性能基准')
+    parser.add_argument('--stocks', type=int, nargs='+', default=[100, 1000, 3000])
+    parser.add_argument('--backtest', action='store_true', help='同时测量5年 × 3000只股票的回测耗时')
+    parser.add_argument('--suite', type=int, nargs='*', metavar='N',
+                        help=f'在合成行情上测量完整筛选流程，默认规模 {list(SUITE_SIZES)}')
+    parser.add_argument('--latency', type=float, default=0.0, help='合成接口的平均延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='合成接口的失败概率')
+    parser.add_argument('--history', type=int, nargs='?', const=5000, metavar='N',
+                        help='比较逐股 DataFrame 与 BarArray 的转换耗时和内存（默认 5000 只股票）')
+    parser.add_argument('--cold-start', type=int, nargs='?', const=5000, metavar='N',
+                        help='在新进程中测量 api/index.py 的导入耗时和首个请求延迟（默认 5000 只合成股票）')
+    parser.add_argument('--live', type=int, nargs='?', const=5000, metavar='N',
+                        help=f'比较盘中增量筛选与完整筛选的单轮耗时（默认 5000 只股票，每轮 {LIVE_CHANGED_RATIO:.0%} 价格变化）')
+    parser.add_argument('--workers', type=int, nargs='*', metavar='N',
+                        help='分片筛选的吞吐量基准（worker 进程数，默认 1 2 4 8）')
+    parser.add_argument('--record', metavar='CASSETTE', help='执行一次真实筛选并把上游响应录制到 cassette')
+    parser.add_argument('--replay', metavar='CASSETTE', help='回放 cassette 离线重复同一次筛选并计时')
+    parser.add_argument('--date', help='录制/回放的筛选日期，默认今天')
+    parser.add_argument('--max-stocks', type=int, default=100, help='录制/回放时最多检查的股票数')
+    args = parser.parse_args()
+
+    if args.record:
+        matched = record_screening(args.record, args.date, args.max_stocks)
+        print(f"已录制到 {args.record}，命中 {len(matched)} 只: {matched}")
+        return
+    if args.replay:
+        logging.getLogger().setLevel(logging.WARNING)
+        result = benchmark_replay(args.replay, args.date, args.max_stocks)
+        print(f"回放 {result['cassette']}（{result['source']} 录制于 {result['recorded_at']}）: "
+              f"{result['replayed_calls']} 次请求，{result['misses']} 次未命中，命中 {len(result['matched'])} 只")
+        print(f"耗时 {result['seconds']:.3f} 秒，逐股 p50 {result['per_stock']['p50_ms']:.2f} ms，"
+              f"p99 {result['per_stock']['p99_ms']:.2f} ms")
+        for name, stage in result['stages'].items():
+            print(f"  {name:<20} {stage['seconds']:>9.4f} 秒 ×{stage['count']}")
+        return
+    if args.live is not None:
+        logging.getLogger().setLevel(logging.WARNING)
+        result = benchmark_live(args.live, latency=args.latency)
+        print(f"{result['stocks']} 只股票，每轮 {result['changed_per_tick']} 只价格变化，"
+              f"{result['reevaluated_per_tick']:.0f} 只越过阈值重新判定，命中 {result['matched']} 只")
+        print(f"首轮 {result['first_tick_ms']:.1f} ms；增量 {result['live_ms']:.1f} ms/轮"
+              f"（{result['history_calls_per_tick']:.1f} 次历史请求），完整筛选 {result['full_ms']:.1f} ms/轮，"
+              f"{result['full_ms'] / result['live_ms']:.1f}x")
+        return
+    if args.workers is not None:
+        logging.getLogger().setLevel(logging.WARNING)
+        result = benchmark_workers(workers=args.workers or (1, 2, 4, 8), latency=args.latency or WORKER_LATENCY)
+        print(f"{result['stocks']} 只合成股票，接口延迟 {result['latency'] * 1000:.0f} ms，"
+              f"共享速率上限 {result['rate']:.0f} 次/秒")
+        print(f"{'worker':>8} {'分片':>6} {'股票':>6} {'命中':>6} {'耗时(秒)':>10} {'只/秒':>8} {'加速比':>8}")
+        base = result['results'][0]['stocks_per_second']
+        for row in result['results']:
+            print(f"{row['workers']:>8} {row['shards']:>6} {row['stocks']:>6} {row['matched']:>6} "
+                  f"{row['seconds']:>10.2f} {row['stocks_per_second']:>8.1f} {row['stocks_per_second'] / base:>8.2f}")
+        return
+    if args.cold_start is not None:
+        result = benchmark_cold_start(args.cold_start)
+        print(f"冷启动（{result['stocks']} 只合成股票，预算 {COLD_START_BUDGET_MS} ms）")
+        print(f"{'快照':<12} {'导入(ms)':>9} {'/status':>9} {'/screen':>9} {'上游调用':>8} {'预算':>6}  重模块")
+        for label, stats in result['results'].items():
+            verdict = 'OK' if all(stats['budget'].values()) else 'OVER'
+            print(f"{label:<12} {stats['import_ms']:>9.1f} {stats['status_ms']:>9.1f} {stats['screen_ms']:>9.1f} "
+                  f"{stats['api_calls'] or 0:>8} {verdict:>6}  {stats['heavy_modules'] or '-'}")
+        return
+    if args.history is not None:
+        result = benchmark_history_representation(args.history)
+        print(f"{result['stocks']} 只股票的历史数据（进程峰值 RSS {result['max_rss_mb']:.1f} MB）")
+        print(f"{'表示':<12} {'CPU(us/只)':>12} {'常驻(MB)':>10} {'峰值(MB)':>10}")
+        for name in ('dataframe', 'bar_array'):
+            stats = result[name]
+            print(f"{name:<12} {stats['cpu_us_per_stock']:>12.1f} {stats['retained_mb']:>10.2f} {stats['peak_mb']:>10.2f}")
+        return
+    if args.suite is not None:
+        logging.getLogger().setLevel(logging.WARNING)
+        print_suite(run_suite(args.suite or SUITE_SIZES, args.latency, args.error_rate))
+        return
+
+    print(f"{'股票数':>8} {'命中':>6} {'标量(ms)':>12} {'向量化(ms)':>12}")
+    for n_stocks in args.stocks:
+        result = benchmark_vectorized(n_stocks)
+        print(f"{result['stocks']:>8} {result['matched']:>6} "
+              f"{result['scalar_ms']:>12.1f} {result['vectorized_ms']:>12.2f}")
+
+    if args.backtest:
+        print(f"\n{'进程数':>8} {'交易日':>8} {'股票数':>8} {'命中':>6} {'耗时(秒)':>10}")
+        for result in benchmark_backtest():
+            print(f"{result['processes']:>8} {result['trading_days']:>8} {result['stocks']:>8} "
+                  f"{result['hits']:>6} {result['seconds']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
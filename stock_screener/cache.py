@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from market_session import snapshot_expiry
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存，线程安全"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, count=True):
+        """读取缓存，过期条目视为不存在"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def record_hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def statistics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups * 100) if lookups > 0 else 0,
+                'size': len(self.entries),
+                'evictions': self.evictions,
+            }
+
+
+class SnapshotCache:
+    """带版本号的行情快照缓存
+
+    每次从数据源获取的快照分配一个版本号；盘中短时间有效，收盘后有效到下次开盘。
+    同一轮分批筛选通过版本号固定在同一份快照上。版本数超过 max_versions 时只淘汰
+    pin_ttl 秒内没有被读取过的旧版本：仍在分批筛选的版本每批都会读取，不会因为其他
+    筛选或盘中跟踪不断产生新快照而被挤出。
+    """
+
+    def __init__(self, intraday_ttl=30, max_versions=4, pin_ttl=600):
+        self.intraday_ttl = intraday_ttl
+        self.max_versions = max_versions
+        self.pin_ttl = pin_ttl
+        self.versions = OrderedDict()
+        self.current_version = None
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+    def current(self, now=None):
+        """返回仍在有效期内的最新快照 (版本号, 数据)，没有则返回 (None, None)"""
+        now = now or datetime.now()
+        with self.lock:
+            entry = self.versions.get(self.current_version)
+            if entry is None or now >= entry['expires_at']:
+                return None, None
+            entry['used_at'] = now
+            return self.current_version, entry['data']
+
+    def get(self, version, now=None):
+        """按版本号读取快照，不检查有效期；已被淘汰时返回 None"""
+        with self.lock:
+            entry = self.versions.get(version)
+            if entry is None:
+                return None
+            entry['used_at'] = now or datetime.now()
+            return entry['data']
+
+    def put(self, data, now=None, version=None, expires_at=None, live=None):
+        """保存新快照并返回其版本号
+
+        不指定 version 时视为最新的实时快照；指定 version（如历史日期快照）时按给定的
+        失效时间保存，且不替换当前的实时快照，除非 live 为 True（如预构建的快照文件）。
+        """
+        now = now or datetime.now()
+        with self.lock:
+            is_live = version is None if live is None else live
+            if version is None:
+                self.sequence += 1
+                version = f"{now.strftime('%Y%m%d%H%M%S')}-{self.sequence}"
+            self.versions[version] = {
+                'data': data,
+                'fetched_at': now,
+                'expires_at': expires_at or snapshot_expiry(now, self.intraday_ttl),
+                'used_at': now,
+            }
+            if is_live:
+                self.current_version = version
+            self._evict(now)
+            return version
+
+    def _evict(self, now):
+        """从最旧的版本起淘汰超出数量且 pin_ttl 内未被读取的版本"""
+        excess = len(self.versions) - self.max_versions
+        for version in list(self.versions):
+            if excess <= 0:
+                break
+            entry = self.versions[version]
+            if version != self.current_version and (now - entry['used_at']).total_seconds() > self.pin_ttl:
+                del self.versions[version]
+                excess -= 1
+
+    def clear(self):
+        with self.lock:
+            self.versions.clear()
+            self.current_version = None
@@ -1,28 +1,141 @@
-import akshare as ak
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from api_log import ApiCallLog
+from bars import BarArray
+from cache import SnapshotCache, TTLCache
+from history_store import HISTORY_FIELDS, get_shared_history_store
+from limit_prices import limit_down_mask, limit_up_mask, stock_limit_ratio
+from market_session import last_closed_date, shift_date_int, to_date_int
+from metrics import (
+    CACHE_REQUESTS,
+    THROTTLE_WAIT_SECONDS,
+    THROTTLE_WAITS,
+    UPSTREAM_LATENCY,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_RETRIES,
+)
+from providers import get_default_provider
+from rate_limiter import SHARED_RATE_CONTROLLER, SHARED_RATE_LIMITER
+from snapshot_artifact import DEFAULT_ARTIFACT_PATH, get_artifact
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 筛选阈值（标量与向量化路径共用），涨跌停价见 limit_prices
+SMALL_POSITIVE_MIN_PCT = 1.0
+SMALL_POSITIVE_MAX_PCT = 6.0
+SMALL_POSITIVE_MIN_BODY_RATIO = 0.5
+
+# 单次运行内的历史数据请求缓存
+HISTORY_CACHE_SIZE = 4096
+HISTORY_CACHE_TTL = 120  # 秒，盘中最新K线会变化，不宜过长
+
+# 上游请求失败时的重试策略（指数退避 + 随机抖动）
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5  # 秒
+RETRY_MAX_DELAY = 8.0
+
+# 进程内共享的行情快照缓存，同一进程中的所有筛选器复用
+SHARED_SNAPSHOT_CACHE = SnapshotCache(intraday_ttl=30)
+
+class DataFetchError(Exception):
+    """重试后仍无法从数据源获取数据，股票应记为未评估而不是不符合条件"""
+    
+    def __init__(self, symbol, message):
+        super().__init__(f"{symbol}: {message}")
+        self.symbol = symbol
+
+
+class SnapshotExpiredError(Exception):
+    """分批筛选固定的快照版本已被淘汰，后续批次不能改用其他快照（批次偏移会对应到另一份股票列表）"""
+
+    def __init__(self, version):
+        super().__init__(f"快照版本 {version} 已过期，请重新开始筛选")
+        self.version = version
+
+
 class StockDataFetcher:
-    def __init__(self):
+    def __init__(self, history_store=None, use_history_store=True, snapshot_cache=None,
+                 rate_limiter=None, rate_controller=None, provider=None,
+                 snapshot_artifact=DEFAULT_ARTIFACT_PATH):
         self.market_data = None
-        self.api_calls_count = 0
-        self.api_calls_log = []
+        # 行情数据源，默认为 akshare（见 providers）
+        self.provider = provider or get_default_provider()
+        # 预构建的快照文件（见 snapshot_artifact），None 表示不使用
+        self.snapshot_artifact = snapshot_artifact
+        if rate_limiter is None:
+            rate_limiter = SHARED_RATE_LIMITER
+            rate_controller = rate_controller or SHARED_RATE_CONTROLLER
+        self.rate_limiter = rate_limiter
+        self.rate_controller = rate_controller
+        self.retry_count = 0
+        self.log_lock = threading.Lock()
+        self.current_call = threading.local()
+        self.snapshot_cache = snapshot_cache or SHARED_SNAPSHOT_CACHE
+        self.snapshot_version = None
+        self.api_log = ApiCallLog()
         self.data_source_verified = False
-        self.last_api_call_time = None
+        self.history_store = history_store
+        self.history_store_hits = 0
+        self.history_cache = TTLCache(maxsize=HISTORY_CACHE_SIZE, ttl=HISTORY_CACHE_TTL)
+        self.history_cache_windows = {}
+        self.history_cache_lock = threading.Lock()
+        if self.history_store is None and use_history_store:
+            self.history_store = self._open_history_store()
+    
+    def _open_history_store(self):
+        """进程内共享的本地历史数据存储，目录不可写时（如只读文件系统）退化为纯网络模式"""
+        return get_shared_history_store(adjust="qfq")
+        
+    def get_all_stocks(self, snapshot_version=None):
+        """获取所有A股股票列表
+
+        指定 snapshot_version 时返回该版本的快照，使分批筛选的每一批都基于同一份股票列表，
+        该版本已不可用时抛出 SnapshotExpiredError；否则使用仍在有效期内的缓存快照，
+        过期才重新请求数据源。
+        """
+        if snapshot_version is not None:
+            pinned = self.snapshot_cache.get(snapshot_version)
+            if pinned is None and snapshot_version.startswith('artifact-'):
+                # 新实例上继续同一轮分批筛选：版本号来自快照文件，直接从磁盘恢复
+                artifact = self._load_artifact()
+                if artifact is not None and artifact.version == snapshot_version:
+                    pinned = self._use_artifact(artifact)
+            if pinned is not None:
+                CACHE_REQUESTS.inc(cache='snapshot', result='hit')
+                self.market_data = pinned
+                self.snapshot_version = snapshot_version
+                return pinned
+            CACHE_REQUESTS.inc(cache='snapshot', result='miss')
+            logger.error(f"快照版本 {snapshot_version} 已不可用")
+            raise SnapshotExpiredError(snapshot_version)
+        
+        version, cached = self.snapshot_cache.current()
+        CACHE_REQUESTS.inc(cache='snapshot', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            logger.info(f"使用缓存的股票列表快照 {version} ({len(cached)} 只股票)")
+            self.market_data = cached
+            self.snapshot_version = version
+            return cached
+        
+        artifact = self._load_artifact()
+        if artifact is not None and artifact.is_current(intraday_ttl=self.snapshot_cache.intraday_ttl):
+            CACHE_REQUESTS.inc(cache='snapshot_artifact', result='hit')
+            logger.info(f"📦 使用预构建的快照 {artifact.version} ({len(artifact.data)} 只股票)")
+            return self._use_artifact(artifact)
         
-    def get_all_stocks(self):
-        """获取所有A股股票列表"""
         try:
             logger.info("正在获取A股股票列表...")
             self._log_api_call("get_all_stocks", "获取A股股票列表")
             
             # 获取A股实时行情数据
-            stock_data = ak.stock_zh_a_spot_em()
+            stock_data = self._call_upstream("get_all_stocks", self.provider.stock_zh_a_spot_em)
             
             # 筛选主板股票（排除创业板、科创板）
             # 主板股票代码：以000、001、002、600、601、603、605开头
@@ -37,6 +150,8 @@ class StockDataFetcher:
             
             logger.info(f"获取到 {len(non_st_stocks)} 只主板非ST股票")
             self.market_data = non_st_stocks
+            self.snapshot_version = self.snapshot_cache.put(non_st_stocks)
+            self._save_universe(non_st_stocks)
             self.data_source_verified = True
             self._log_api_success("get_all_stocks", f"成功获取{len(non_st_stocks)}只股票")
             return non_st_stocks
@@ -46,69 +161,333 @@ class StockDataFetcher:
             self._log_api_error("get_all_stocks", str(e))
             return None
     
-    def get_stock_history(self, symbol, days=5):
-        """获取股票历史数据"""
+    def _load_artifact(self):
+        """读取预构建的快照文件，来源与当前数据源不同时忽略"""
+        if not self.snapshot_artifact:
+            return None
+        artifact = get_artifact(self.snapshot_artifact)
+        if artifact is None or artifact.source != self.provider.name:
+            return None
+        return artifact
+    
+    def _use_artifact(self, artifact):
+        self.snapshot_cache.put(
+            artifact.data, now=artifact.fetched_at, version=artifact.version,
+            expires_at=artifact.expires_at(self.snapshot_cache.intraday_ttl), live=True
+        )
+        self.market_data = artifact.data
+        self.snapshot_version = artifact.version
+        return artifact.data
+    
+    def _save_universe(self, stocks):
+        if self.history_store is None:
+            return
         try:
-            # 在每次API调用前增加延迟
-            time.sleep(0.05)  # 50ms延迟
-            
-            self._log_api_call("get_stock_history", f"获取股票{symbol}历史数据({days}天)")
-            
-            # 获取历史数据，period可选："daily", "weekly", "monthly"
-            # adjust可选："", "qfq", "hfq" 分别表示不复权、前复权、后复权
-            hist_data = ak.stock_zh_a_hist(
-                symbol=symbol, 
-                period="daily", 
-                start_date=(datetime.now() - timedelta(days=10)).strftime("%Y%m%d"),
-                end_date=datetime.now().strftime("%Y%m%d"),
-                adjust="qfq"
-            )
+            self.history_store.save_universe(stocks)
+        except Exception as e:
+            logger.warning(f"保存股票列表失败: {e}")
+    
+    def get_snapshot_as_of(self, as_of, max_workers=1):
+        """由本地日线数据构造指定交易日的行情快照，列名与 get_all_stocks 一致
+
+        股票范围取最近一次保存的股票列表；本地缺少的K线会补充获取一次并写入本地存储，
+        之后同一日期的筛选完全离线完成。
+        """
+        version = f"asof-{as_of}"
+        cached = self.snapshot_cache.get(version)
+        if cached is not None:
+            self.market_data = cached
+            self.snapshot_version = version
+            return cached
+        
+        universe = self.history_store.load_universe() if self.history_store is not None else None
+        artifact = self._load_artifact() if universe is None else None
+        if artifact is not None:
+            universe = artifact.universe()
+        if universe is None:
+            logger.warning("本地没有保存的股票列表，使用实时股票列表作为历史筛选范围")
+            live_stocks = self.get_all_stocks()
+            if live_stocks is None:
+                return None
+            universe = live_stocks[['代码', '名称']]
+        
+        codes = universe['代码'].tolist()
+        dates, panel, _ = self.get_history_panel(codes, shift_date_int(as_of, -10), as_of, max_workers=max_workers)
+        closes = panel['close']
+        traded = [i for i in range(len(dates)) if not np.isnan(closes[:, i]).all()]
+        if not traded:
+            logger.warning(f"{as_of} 之前10天内没有任何交易数据")
+            return universe.iloc[0:0]
+        
+        # 目标日期非交易日时取其之前最近的交易日
+        day = traded[-1]
+        prev_close = np.full(len(codes), np.nan)
+        for i in range(day):
+            prev_close = np.where(np.isnan(closes[:, i]), prev_close, closes[:, i])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change_pct = (closes[:, day] / prev_close - 1) * 100
+        
+        snapshot = universe.reset_index(drop=True).assign(**{
+            '今开': panel['open'][:, day],
+            '最新价': closes[:, day],
+            '最高': panel['high'][:, day],
+            '最低': panel['low'][:, day],
+            '成交量': panel['volume'][:, day],
+            '成交额': panel['amount'][:, day],
+            '昨收': prev_close,
+            '涨跌幅': np.round(change_pct, 2),
+            '总市值': np.nan,
+        })
+        logger.info(f"由本地数据构造 {dates[day]} 的行情快照: {len(snapshot)} 只股票")
+        
+        self.snapshot_cache.put(snapshot, version=version, expires_at=datetime.max)
+        self.market_data = snapshot
+        self.snapshot_version = version
+        return snapshot
+    
+    def get_stock_history(self, symbol, days=5, raise_errors=False, end_date=None, min_days=None):
+        """获取股票历史数据
+
+        返回最近 days 根K线（BarArray），不足 min_days（默认等于 days）根时返回 None。
+        end_date 为 yyyymmdd 整数时返回截至该日（含）的数据，用于历史日期筛选。
+        raise_errors 为 True 时，重试后仍失败会抛出 DataFetchError，便于调用方区分
+        "数据不足/不符合" 与 "未能评估"。
+        """
+        try:
+            end_date = end_date or to_date_int(datetime.now())
+            start_date = shift_date_int(end_date, -10)
+            calls_before = self.api_calls_count
+            hist_data = self._get_cached_history(symbol, start_date, end_date, adjust="qfq")
             
-            if hist_data is not None and len(hist_data) >= days:
-                # 按日期排序，确保最新数据在最后
-                hist_data = hist_data.sort_values('日期')
-                self._log_api_success("get_stock_history", f"成功获取股票{symbol}历史数据({len(hist_data)}天)")
+            if hist_data is not None and len(hist_data) >= (min_days or days):
                 return hist_data.tail(days)
+            
+            warning_info = f"股票{symbol}历史数据不足({len(hist_data) if hist_data is not None else 0}天)"
+            if self.api_calls_count > calls_before:
+                self._log_api_warning("get_stock_history", warning_info)
             else:
-                self._log_api_warning("get_stock_history", f"股票{symbol}历史数据不足({len(hist_data) if hist_data is not None else 0}天)")
-                return None
+                logger.warning(f"⚠️ 本地数据: {warning_info}")
+            return None
             
         except Exception as e:
             logger.warning(f"获取股票 {symbol} 历史数据失败: {e}")
             self._log_api_error("get_stock_history", f"股票{symbol}: {str(e)}")
+            if raise_errors:
+                raise DataFetchError(symbol, str(e)) from e
             return None
     
-    def is_limit_up(self, open_price, close_price, stock_code):
-        """判断是否涨停"""
-        if pd.isna(open_price) or pd.isna(close_price) or open_price <= 0:
-            return False
-            
-        # 计算涨幅
-        pct_change = (close_price - open_price) / open_price * 100
+    def _get_cached_history(self, symbol, start_date, end_date, adjust):
+        """按 (代码, 起始日, 结束日, 复权方式) 缓存历史数据，被已缓存窗口覆盖的请求直接截取"""
+        key = (symbol, start_date, end_date, adjust)
+        hist_data = self.history_cache.get(key, count=False)
+        if hist_data is None:
+            hist_data = self._slice_cached_superset(symbol, start_date, end_date, adjust)
+        if hist_data is not None:
+            self.history_cache.record_hit()
+            CACHE_REQUESTS.inc(cache='history', result='hit')
+            return hist_data
         
-        # 主板涨停限制为10%，创业板和科创板为20%
-        if stock_code.startswith(('300', '688')):
-            limit_threshold = 19.5  # 略小于20%，避免浮点精度问题
-        else:
-            limit_threshold = 9.5   # 略小于10%
-            
-        return pct_change >= limit_threshold
+        self.history_cache.record_miss()
+        CACHE_REQUESTS.inc(cache='history', result='miss')
+        hist_data = self._load_history(symbol, start_date, end_date, adjust)
+        if hist_data is not None:
+            self.history_cache.put(key, hist_data)
+            with self.history_cache_lock:
+                self.history_cache_windows.setdefault((symbol, adjust), set()).add((start_date, end_date))
+        return hist_data
     
-    def is_limit_down(self, open_price, close_price, stock_code):
-        """判断是否跌停"""
-        if pd.isna(open_price) or pd.isna(close_price) or open_price <= 0:
-            return False
-            
-        # 计算跌幅
-        pct_change = (close_price - open_price) / open_price * 100
+    def _slice_cached_superset(self, symbol, start_date, end_date, adjust):
+        """在已缓存的窗口中查找覆盖请求区间的超集并截取"""
+        with self.history_cache_lock:
+            windows = self.history_cache_windows.get((symbol, adjust))
+            if not windows:
+                return None
+            candidates = list(windows)
+        
+        for window_start, window_end in candidates:
+            cached = self.history_cache.get((symbol, window_start, window_end, adjust), count=False)
+            if cached is None:
+                with self.history_cache_lock:
+                    windows.discard((window_start, window_end))
+                continue
+            if window_start <= start_date and window_end >= end_date:
+                return cached.between(start_date, end_date)
+        return None
+    
+    def _load_history(self, symbol, start_date, end_date, adjust):
+        """优先从本地存储读取历史数据，只向数据源请求缺失的交易日"""
+        store = self.history_store
+        if store is None:
+            return self._fetch_history(symbol, start_date, end_date, adjust)
+        
+        closed_through = last_closed_date()
+        fetch_range = store.plan_fetch(symbol, start_date, end_date, closed_through)
+        if fetch_range is None:
+            self.history_store_hits += 1
+            CACHE_REQUESTS.inc(cache='history_store', result='hit')
+            return store.read_bars(symbol, start_date, end_date)
+        CACHE_REQUESTS.inc(cache='history_store', result='miss')
+        
+        fetch_start, fetch_end = fetch_range
+        fresh = self._fetch_history(symbol, fetch_start, fetch_end, adjust)
+        if not store.matches_last_bar(symbol, fresh):
+            # 除权除息后前复权价格整体变化，本地数据作废后重新获取
+            logger.info(f"股票{symbol}复权数据已变化，重建本地历史数据")
+            store.invalidate(symbol)
+            fetch_start = start_date
+            fresh = self._fetch_history(symbol, fetch_start, fetch_end, adjust)
+        
+        store.write(symbol, fresh, fetch_start, min(fetch_end, closed_through))
+        
+        # 已定型的K线来自本地存储，未收盘的最新K线直接使用刚获取的数据
+        stored = store.read_bars(symbol, start_date, min(end_date, closed_through))
+        if fresh is None or len(fresh) == 0:
+            return stored
+        live = fresh.after(closed_through)
+        if len(live) == 0:
+            return stored
+        return BarArray.concat(stored, live)
+    
+    def _fetch_history(self, symbol, start_date, end_date, adjust):
+        """从数据源获取区间内的日线数据，转换为按日期排序的 BarArray"""
+        self._log_api_call("get_stock_history", f"获取股票{symbol}历史数据({start_date}-{end_date})")
+        
+        # 获取历史数据，period可选："daily", "weekly", "monthly"
+        # adjust可选："", "qfq", "hfq" 分别表示不复权、前复权、后复权
+        hist_data = self._call_upstream(
+            "get_stock_history",
+            self.provider.stock_zh_a_hist,
+            symbol=symbol, 
+            period="daily", 
+            start_date=str(start_date),
+            end_date=str(end_date),
+            adjust=adjust
+        )
+        
+        if hist_data is None or len(hist_data) == 0:
+            self._log_api_success("get_stock_history", f"股票{symbol}在区间内无交易数据")
+            return None
+        
+        hist_data = BarArray.from_frame(symbol, hist_data)
+        self._log_api_success("get_stock_history", f"成功获取股票{symbol}历史数据({len(hist_data)}天)")
+        return hist_data
+    
+    def _call_upstream(self, api_name, func, **kwargs):
+        """调用上游接口：经令牌桶限流，按结果调整速率，失败时指数退避加抖动重试
+
+        每次请求的耗时、结果和限流等待按上游函数名（如 stock_zh_a_hist）计入 metrics。
+        本地数据源（本地存储、回放）不限速，重试前也不等待。
+        """
+        upstream = getattr(func, '__name__', api_name)
+        remote = self.provider.remote
+        last_error = None
+        for attempt in range(MAX_RETRIES + 1):
+            waited = self.rate_limiter.acquire() if remote else 0.0
+            if waited:
+                THROTTLE_WAITS.inc()
+                THROTTLE_WAIT_SECONDS.inc(waited)
+            started = time.monotonic()
+            try:
+                result = func(**kwargs)
+            except Exception as e:
+                last_error = e
+                UPSTREAM_LATENCY.observe(time.monotonic() - started, api=upstream)
+                UPSTREAM_REQUESTS.inc(api=upstream, outcome='error')
+                if self.rate_controller and remote:
+                    self.rate_controller.on_error()
+                if attempt == MAX_RETRIES:
+                    break
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                with self.log_lock:
+                    self.retry_count += 1
+                UPSTREAM_RETRIES.inc(api=upstream)
+                logger.warning(f"🔁 {api_name} 第{attempt + 1}次失败，{delay:.2f}秒后重试: {e}")
+                if remote:
+                    time.sleep(delay)
+                continue
+            latency = time.monotonic() - started
+            UPSTREAM_LATENCY.observe(latency, api=upstream)
+            UPSTREAM_REQUESTS.inc(api=upstream, outcome='success')
+            if self.rate_controller and remote:
+                self.rate_controller.on_success(latency)
+            return result
+        raise last_error
+    
+    def get_history_panel(self, codes, start_date, end_date, adjust="qfq", max_workers=1):
+        """获取多只股票的 (股票 × 交易日) 面板数据，本地已有的部分不再请求数据源
+
+        返回 (日期列表, {字段: 二维数组}, 获取失败的股票代码列表)。
+        """
+        store = self.history_store
+        closed_through = last_closed_date()
+        live_frames = {}
+        failed_codes = []
         
-        # 主板跌停限制为-10%，创业板和科创板为-20%
-        if stock_code.startswith(('300', '688')):
-            limit_threshold = -19.5
+        def load(code):
+            try:
+                return code, self._load_history(code, start_date, end_date, adjust)
+            except Exception as e:
+                logger.warning(f"获取股票 {code} 历史数据失败: {e}")
+                self._log_api_error("get_stock_history", f"股票{code}: {str(e)}")
+                failed_codes.append(code)
+                return code, None
+        
+        missing = [
+            code for code in codes
+            if store is None or store.plan_fetch(code, start_date, end_date, closed_through) is not None
+        ]
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for code, frame in executor.map(load, missing):
+                if frame is None or len(frame) == 0:
+                    continue
+                if store is not None:
+                    frame = frame.after(closed_through)
+                if len(frame) > 0:
+                    live_frames[code] = frame
+        
+        if store is not None:
+            dates, panel = store.read_panel(codes, start_date, min(end_date, closed_through))
         else:
-            limit_threshold = -9.5
-            
-        return pct_change <= limit_threshold
+            dates, panel = [], {key: np.empty((len(codes), 0)) for key in HISTORY_FIELDS.values()}
+        
+        # 把未收盘的最新K线（或无本地存储时的全部K线）补到面板右侧
+        live_dates = sorted({int(d) for frame in live_frames.values() for d in frame.dates} - set(dates))
+        if live_dates:
+            all_dates = sorted(set(dates) | set(live_dates))
+            positions = np.searchsorted(all_dates, dates)
+            for key in panel:
+                widened = np.full((len(codes), len(all_dates)), np.nan)
+                widened[:, positions] = panel[key]
+                panel[key] = widened
+            dates = all_dates
+            code_rows = {code: i for i, code in enumerate(codes)}
+            for code, frame in live_frames.items():
+                columns = np.searchsorted(dates, frame.dates)
+                for key in HISTORY_FIELDS.values():
+                    panel[key][code_rows[code], columns] = frame.field(key)
+        
+        return dates, panel, failed_codes
+    
+    def flush_history_store(self):
+        """将本地历史数据落盘"""
+        if self.history_store is None:
+            return
+        try:
+            self.history_store.flush()
+        except Exception as e:
+            logger.warning(f"保存本地历史数据失败: {e}")
+    
+    def is_limit_up(self, prev_close, close_price, stock_code):
+        """判断是否涨停：收盘价达到由前收盘价计算的涨停价"""
+        if pd.isna(prev_close) or pd.isna(close_price):
+            return False
+        return bool(limit_up_mask(close_price, prev_close, stock_limit_ratio(stock_code)))
+    
+    def is_limit_down(self, prev_close, close_price, stock_code):
+        """判断是否跌停：收盘价达到由前收盘价计算的跌停价"""
+        if pd.isna(prev_close) or pd.isna(close_price):
+            return False
+        return bool(limit_down_mask(close_price, prev_close, stock_limit_ratio(stock_code)))
     
     def is_small_positive_line(self, open_price, close_price, high_price, low_price):
         """判断是否为小阳线"""
@@ -121,7 +500,7 @@ class StockDataFetcher:
             
         # 涨幅控制在1%-6%之间（小阳线）
         pct_change = (close_price - open_price) / open_price * 100
-        if not (1.0 <= pct_change <= 6.0):
+        if not (SMALL_POSITIVE_MIN_PCT <= pct_change <= SMALL_POSITIVE_MAX_PCT):
             return False
             
         # 上下影线不能过长（实体部分占比较大）
@@ -132,34 +511,21 @@ class StockDataFetcher:
             return False
             
         body_ratio = body_size / total_range
-        return body_ratio >= 0.5  # 实体至少占50%
+        return body_ratio >= SMALL_POSITIVE_MIN_BODY_RATIO  # 实体至少占50%
     
     def check_first_limit_up_in_3_days(self, hist_data, stock_code):
         """检查是否为近3日内首次涨停（首板）"""
         if hist_data is None or len(hist_data) < 3:
             return False
             
-        hist_data = hist_data.tail(3).copy()  # 取最近3天
+        # 多取一天作为最早一天的前收盘价
+        closes = hist_data.field('close')[-4:].tolist()
+        if len(closes) < 4:
+            closes.insert(0, np.nan)
+        limit_ups = [self.is_limit_up(closes[i - 1], closes[i], stock_code) for i in range(1, 4)]
         
-        for i, row in hist_data.iterrows():
-            open_p = row.get('开盘', 0)
-            close_p = row.get('收盘', 0)
-            
-            if self.is_limit_up(open_p, close_p, stock_code):
-                # 如果是最新的一天涨停，检查前面2天是否没有涨停
-                if i == hist_data.index[-1]:  # 最新交易日
-                    # 检查前两天
-                    prev_days = hist_data[hist_data.index < i]
-                    for _, prev_row in prev_days.iterrows():
-                        prev_open = prev_row.get('开盘', 0)
-                        prev_close = prev_row.get('收盘', 0)
-                        if self.is_limit_up(prev_open, prev_close, stock_code):
-                            return False  # 前面有涨停，不是首板
-                    return True  # 前面没有涨停，是首板
-                else:
-                    return False  # 不是最新交易日的涨停
-        
-        return False  # 最近3天都没有涨停
+        # 最新一天涨停，且前两天没有涨停
+        return limit_ups[-1] and not any(limit_ups[:-1])
     
     def get_stock_basic_info(self, symbol):
         """获取股票基本信息"""
@@ -174,72 +540,52 @@ class StockDataFetcher:
             logger.warning(f"获取股票 {symbol} 基本信息失败: {e}")
             return None
     
+    @property
+    def api_calls_count(self):
+        return self.api_log.total
+    
     def _log_api_call(self, api_name, description):
         """记录API调用"""
-        self.api_calls_count += 1
-        self.last_api_call_time = datetime.now()
-        
-        call_info = {
-            'call_id': self.api_calls_count,
-            'api_name': api_name,
-            'description': description,
-            'timestamp': self.last_api_call_time.isoformat(),
-            'status': 'calling'
-        }
-        
-        self.api_calls_log.append(call_info)
-        logger.info(f"📡 API调用 #{self.api_calls_count}: {api_name} - {description}")
+        call_info = self.api_log.start(api_name, description)
+        # 记录当前线程正在进行的调用，并发时成功/失败状态写回对应的记录
+        self.current_call.info = call_info
+        logger.info(f"📡 API调用 #{call_info['call_id']}: {api_name} - {description}")
+    
+    def _complete_api_call(self, status, key, info):
+        call_info = getattr(self.current_call, 'info', None)
+        if call_info is None:
+            return
+        self.api_log.complete(call_info, status, key, info)
     
     def _log_api_success(self, api_name, result_info):
         """记录API调用成功"""
-        if self.api_calls_log:
-            self.api_calls_log[-1]['status'] = 'success'
-            self.api_calls_log[-1]['result'] = result_info
-            self.api_calls_log[-1]['completed_at'] = datetime.now().isoformat()
-        
+        self._complete_api_call('success', 'result', result_info)
         logger.info(f"✅ API调用成功: {api_name} - {result_info}")
     
     def _log_api_error(self, api_name, error_info):
         """记录API调用失败"""
-        if self.api_calls_log:
-            self.api_calls_log[-1]['status'] = 'error'
-            self.api_calls_log[-1]['error'] = error_info
-            self.api_calls_log[-1]['completed_at'] = datetime.now().isoformat()
-        
+        self._complete_api_call('error', 'error', error_info)
         logger.error(f"❌ API调用失败: {api_name} - {error_info}")
     
     def _log_api_warning(self, api_name, warning_info):
         """记录API调用警告"""
-        if self.api_calls_log:
-            self.api_calls_log[-1]['status'] = 'warning'
-            self.api_calls_log[-1]['warning'] = warning_info
-            self.api_calls_log[-1]['completed_at'] = datetime.now().isoformat()
-        
+        self._complete_api_call('warning', 'warning', warning_info)
         logger.warning(f"⚠️ API调用警告: {api_name} - {warning_info}")
     
     def get_api_statistics(self):
-        """获取API调用统计信息"""
-        if not self.api_calls_log:
-            return {
-                'total_calls': 0,
-                'successful_calls': 0,
-                'failed_calls': 0,
-                'warning_calls': 0,
-                'data_source_verified': self.data_source_verified,
-                'last_call_time': None
-            }
-        
-        successful = len([call for call in self.api_calls_log if call.get('status') == 'success'])
-        failed = len([call for call in self.api_calls_log if call.get('status') == 'error'])
-        warnings = len([call for call in self.api_calls_log if call.get('status') == 'warning'])
-        
-        return {
-            'total_calls': self.api_calls_count,
-            'successful_calls': successful,
-            'failed_calls': failed,
-            'warning_calls': warnings,
-            'success_rate': (successful / self.api_calls_count * 100) if self.api_calls_count > 0 else 0,
+        """获取API调用统计信息，计数和耗时为增量维护的聚合值，开销与调用次数无关"""
+        stats = self.api_log.statistics()
+        total = stats['total_calls']
+        stats.update({
+            'success_rate': (stats['successful_calls'] / total * 100) if total > 0 else 0,
+            'latency': self.api_log.latency_statistics(),
+            'data_source': self.provider.name,
             'data_source_verified': self.data_source_verified,
-            'last_call_time': self.last_api_call_time.isoformat() if self.last_api_call_time else None,
-            'api_calls_log': self.api_calls_log[-10:]  # 只返回最近10次调用
-        }
\ No newline at end of file
+            'history_cache': self.history_cache.statistics(),
+            'history_store_hits': self.history_store_hits,
+            'rate_limiter': self.rate_limiter.statistics(),
+            'rate_controller': self.rate_controller.statistics() if self.rate_controller else None,
+            'retries': self.retry_count,
+            'api_calls_log': self.api_log.recent(),  # 只返回最近10次调用
+        })
+        return stats
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+筛选结果的流式导出
+结果按块（dict 列表）输入，逐块编码后输出字节：CSV 按块写出；XLSX 使用 openpyxl 的
+只写工作簿，行数据直接写入临时文件；Parquet 与 Arrow 需要可选依赖 pyarrow。
+各格式的内存占用只与块大小有关，与结果总数无关。
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime
+
+# 结果字段 -> 导出列名
+EXPORT_COLUMNS = {
+    'code': '股票代码',
+    'name': '股票名称',
+    'current_price': '最新价',
+    'change_pct': '涨跌幅(%)',
+    'volume': '成交量',
+    'turnover': '成交额',
+    'market_cap': '总市值',
+}
+# 导出时保留两位小数的字段
+ROUNDED_FIELDS = ('current_price', 'change_pct')
+# 内存中的结果列表切分为块时每块的行数
+CHUNK_ROWS = 500
+# 从临时文件读出时每次发送的字节数
+STREAM_BLOCK_BYTES = 64 * 1024
+
+
+class ExportUnavailableError(RuntimeError):
+    """导出格式不存在或缺少所需的可选依赖"""
+
+
+def export_row(row):
+    """一条筛选结果 -> 按 EXPORT_COLUMNS 排列的值"""
+    values = []
+    for field in EXPORT_COLUMNS:
+        value = row.get(field)
+        if hasattr(value, 'item'):
+            value = value.item()
+        if field in ROUNDED_FIELDS and isinstance(value, float):
+            value = round(value, 2)
+        values.append(value)
+    return values
+
+
+def _stream_file(f):
+    f.seek(0)
+    while True:
+        block = f.read(STREAM_BLOCK_BYTES)
+        if not block:
+            return
+        yield block
+
+
+def iter_csv(chunks):
+    """UTF-8（带 BOM，便于 Excel 识别）CSV，每块结果编码后立即输出"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS.values())
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(export_row(row) for row in chunk)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_xlsx(chunks):
+    """只写模式的 openpyxl 工作簿，写完后从临时文件分块输出"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('筛选结果')
+    sheet.append(list(EXPORT_COLUMNS.values()))
+    for chunk in chunks:
+        for row in chunk:
+            sheet.append(export_row(row))
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        yield from _stream_file(f)
+
+
+def _arrow_batches(chunks):
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ('股票代码', pa.string()),
+        ('股票名称', pa.string()),
+        ('最新价', pa.float64()),
+        ('涨跌幅(%)', pa.float64()),
+        ('成交量', pa.float64()),
+        ('成交额', pa.float64()),
+        ('总市值', pa.float64()),
+    ])
+
+    def batches():
+        for chunk in chunks:
+            columns = list(zip(*(export_row(row) for row in chunk))) if chunk else [()] * len(schema)
+            yield pa.record_batch([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                  schema=schema)
+
+    return pa, schema, batches()
+
+
+def iter_parquet(chunks):
+    """每块结果写为一个 row group，写完后从临时文件分块输出"""
+    pa, schema, batches = _arrow_batches(chunks)
+    import pyarrow.parquet as pq
+
+    with tempfile.TemporaryFile() as f:
+        with pq.ParquetWriter(f, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        yield from _stream_file(f)
+
+
+def iter_arrow(chunks):
+    """Arrow IPC 流格式，每块结果编码为一个 record batch 后立即输出"""
+    pa, schema, batches = _arrow_batches(chunks)
+    sink = io.BytesIO()
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield drain()
+    writer.close()
+    yield drain()
+
+
+# 格式 -> (编码函数, 扩展名, MIME 类型)
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'csv', 'text/csv; charset=utf-8'),
+    'excel': (iter_xlsx, 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': (iter_parquet, 'parquet', 'application/vnd.apache.parquet'),
+    'arrow': (iter_arrow, 'arrow', 'application/vnd.apache.arrow.stream'),
+}
+FORMAT_ALIASES = {'xlsx': 'excel'}
+
+
+def chunked(rows, chunk_rows=CHUNK_ROWS):
+    """内存中的结果列表切分为块"""
+    for start in range(0, len(rows), chunk_rows):
+        yield rows[start:start + chunk_rows]
+
+
+def available_formats():
+    """当前环境可用的导出格式"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return [name for name in EXPORT_FORMATS if name not in ('parquet', 'arrow')]
+    return list(EXPORT_FORMATS)
+
+
+def open_export(format, chunks):
+    """返回 (字节迭代器, 文件名, MIME 类型)
+
+    格式未知或缺少依赖时立即抛出 ExportUnavailableError，便于在开始发送响应前返回错误。
+    """
+    name = FORMAT_ALIASES.get(format.lower(), format.lower())
+    if name not in EXPORT_FORMATS:
+        raise ExportUnavailableError(f'不支持的导出格式: {format}')
+    if name not in available_formats():
+        raise ExportUnavailableError('Parquet/Arrow 导出需要安装 pyarrow')
+    encode, extension, mimetype = EXPORT_FORMATS[name]
+    filename = f"rescue_stocks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return encode(chunks), filename, mimetype
+
+
+def export_headers(filename):
+    """下载响应的附加头：附件文件名，并禁止代理缓冲以便边生成边发送"""
+    return {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    }
+
+
+def write_export(format, rows, path):
+    """把结果列表写入文件，返回路径"""
+    stream, _, _ = open_export(format, chunked(rows))
+    with open(path, 'wb') as f:
+        for block in stream:
+            f.write(block)
+    return path
@@ -0,0 +1,404 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内互斥
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+from bars import BarArray
+from market_session import shift_date_int
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认存储目录，可通过环境变量 STOCK_HISTORY_DIR 覆盖（如 Vercel 上指向 /tmp）
+DEFAULT_HISTORY_DIR = os.environ.get(
+    'STOCK_HISTORY_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history')
+)
+
+# 存储的列：akshare 列名 -> 文件名
+HISTORY_FIELDS = {
+    '开盘': 'open',
+    '收盘': 'close',
+    '最高': 'high',
+    '最低': 'low',
+    '成交量': 'volume',
+    '成交额': 'amount',
+}
+
+INITIAL_DATE_CAPACITY = 256
+INITIAL_CODE_CAPACITY = 1024
+
+
+class HistoryStore:
+    """本地列式日线存储
+
+    每个字段一个 (日期 × 代码) 的 float64 内存映射文件，新交易日只需写入一行，
+    按日期读取整个市场是连续内存。coverage 记录每只股票已从数据源完整获取过的
+    自然日区间，区间内的K线不再重复请求。
+
+    同一目录可被多个实例和进程同时使用：写入、扩容和落盘都持有目录下的文件锁，
+    并先重新加载其他进程已落盘的元数据；新分配的代码或日期槽位立即写入元数据，
+    保证各进程的槽位一致。覆盖区间的变更在 flush 时与磁盘上的合并。进程内应通过
+    get_shared_history_store 共用一个实例。
+    """
+
+    def __init__(self, root_dir=None, adjust='qfq'):
+        self.root_dir = os.path.join(root_dir or DEFAULT_HISTORY_DIR, adjust or 'none')
+        self.adjust = adjust
+        self.lock = threading.RLock()
+        self.codes = []
+        self.code_index = {}
+        self.dates = []
+        self.date_index = {}
+        self.coverage = {}
+        self.date_capacity = 0
+        self.code_capacity = 0
+        self.columns = {}
+        self.dirty = False
+        # 本实例尚未落盘的覆盖区间，重新加载元数据后再合并回去
+        self.pending_coverage = {}
+        self.meta_stamp = None
+        self.lock_file = None
+        self.lock_pid = None
+        self.lock_depth = 0
+
+        os.makedirs(self.root_dir, exist_ok=True)
+        with self._file_lock():
+            if os.path.exists(self._meta_path()):
+                self._load()
+            else:
+                self._allocate(INITIAL_DATE_CAPACITY, INITIAL_CODE_CAPACITY)
+                self._write_meta()
+        logger.info(f"加载本地历史数据: {len(self.codes)} 只股票, {len(self.dates)} 个交易日")
+
+    def _meta_path(self):
+        return os.path.join(self.root_dir, 'meta.json')
+
+    def _column_path(self, field_key):
+        return os.path.join(self.root_dir, f'{field_key}.f64')
+
+    @contextmanager
+    def _file_lock(self, exclusive=True):
+        """持有进程内锁和目录的文件锁（写入用排他锁，读取用共享锁），可重入"""
+        with self.lock:
+            if fcntl is None or self.lock_depth > 0:
+                self.lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self.lock_depth -= 1
+                return
+            if self.lock_pid != os.getpid():
+                # fork 出的子进程与父进程共用同一个打开的文件，flock 互不排斥，需重新打开
+                self.lock_file = open(os.path.join(self.root_dir, '.lock'), 'a')
+                self.lock_pid = os.getpid()
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _stat_meta(self):
+        try:
+            stat = os.stat(self._meta_path())
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _sync(self):
+        """其他实例或进程落盘过新的元数据时重新加载（需持有文件锁）"""
+        if self._stat_meta() != self.meta_stamp:
+            self._load()
+
+    def _load(self):
+        """加载元数据并映射列文件，未落盘的覆盖区间合并到磁盘上的区间"""
+        self.meta_stamp = self._stat_meta()
+        with open(self._meta_path(), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        self.codes = meta['codes']
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.dates = meta['dates']
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+        self.coverage = {code: tuple(span) for code, span in meta['coverage'].items()}
+        for code, (covered_from, covered_through) in self.pending_coverage.items():
+            self._cover(code, covered_from, covered_through)
+        self.date_capacity = meta['date_capacity']
+        self.code_capacity = meta['code_capacity']
+
+        for field_key in HISTORY_FIELDS.values():
+            self.columns[field_key] = np.memmap(
+                self._column_path(field_key), dtype=np.float64, mode='r+',
+                shape=(self.date_capacity, self.code_capacity)
+            )
+
+    def _write_meta(self):
+        """将列数据和元数据落盘（需持有排他文件锁）"""
+        for column in self.columns.values():
+            column.flush()
+        meta = {
+            'codes': self.codes,
+            'dates': self.dates,
+            'coverage': {code: list(span) for code, span in self.coverage.items()},
+            'date_capacity': self.date_capacity,
+            'code_capacity': self.code_capacity,
+            'fields': list(HISTORY_FIELDS.values()),
+        }
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path())
+        self.meta_stamp = self._stat_meta()
+        self.pending_coverage = {}
+        self.dirty = False
+
+    def _allocate(self, date_capacity, code_capacity):
+        """按新容量重建列文件，保留已有数据"""
+        old_columns = self.columns
+        new_columns = {}
+        for field_key in HISTORY_FIELDS.values():
+            tmp_path = self._column_path(field_key) + '.tmp'
+            column = np.memmap(tmp_path, dtype=np.float64, mode='w+',
+                               shape=(date_capacity, code_capacity))
+            column[:] = np.nan
+            if field_key in old_columns:
+                old = old_columns[field_key]
+                column[:old.shape[0], :old.shape[1]] = old
+            column.flush()
+            del column
+            os.replace(tmp_path, self._column_path(field_key))
+            new_columns[field_key] = np.memmap(
+                self._column_path(field_key), dtype=np.float64, mode='r+',
+                shape=(date_capacity, code_capacity)
+            )
+
+        self.columns = new_columns
+        self.date_capacity = date_capacity
+        self.code_capacity = code_capacity
+        self.dirty = True
+
+    def _ensure_code(self, symbol):
+        index = self.code_index.get(symbol)
+        if index is not None:
+            return index
+        if len(self.codes) >= self.code_capacity:
+            self._allocate(self.date_capacity, self.code_capacity * 2)
+        index = len(self.codes)
+        self.codes.append(symbol)
+        self.code_index[symbol] = index
+        return index
+
+    def _ensure_date(self, date_int):
+        index = self.date_index.get(date_int)
+        if index is not None:
+            return index
+        if len(self.dates) >= self.date_capacity:
+            self._allocate(self.date_capacity * 2, self.code_capacity)
+        index = len(self.dates)
+        self.dates.append(date_int)
+        self.date_index[date_int] = index
+        return index
+
+    def _cover(self, symbol, covered_from, covered_through):
+        """把 [covered_from, covered_through] 并入股票的覆盖区间，返回新区间"""
+        span = self.coverage.get(symbol)
+        if span is not None and covered_from <= shift_date_int(span[1], 1):
+            span = (min(span[0], covered_from), max(span[1], covered_through))
+        elif covered_from <= covered_through:
+            span = (covered_from, covered_through)
+        else:
+            return span
+        self.coverage[symbol] = span
+        return span
+
+    def _date_rows(self, start_int, end_int):
+        """返回区间内日期及对应行号，按日期升序"""
+        selected = sorted((d, i) for d, i in self.date_index.items() if start_int <= d <= end_int)
+        return [d for d, _ in selected], [i for _, i in selected]
+
+    def last_bar(self, symbol):
+        """返回股票最后一根已存储K线的 (日期, 收盘价)"""
+        with self._file_lock(exclusive=False):
+            self._sync()
+            col = self.code_index.get(symbol)
+            if col is None or not self.dates:
+                return None
+            closes = self.columns['close'][:len(self.dates), col]
+            valid = np.flatnonzero(~np.isnan(closes))
+            if len(valid) == 0:
+                return None
+            row = max(valid, key=lambda i: self.dates[i])
+            return self.dates[row], float(closes[row])
+
+    def plan_fetch(self, symbol, start_int, end_int, closed_through):
+        """计算还需从数据源获取的区间，完全命中本地时返回 None"""
+        with self._file_lock(exclusive=False):
+            self._sync()
+            span = self.coverage.get(symbol)
+            if span is None or span[0] > start_int:
+                return start_int, end_int
+            if end_int <= closed_through and span[1] >= end_int:
+                return None
+            # 从最后一根已存K线开始取，用于校验复权数据是否变化
+            last = self.last_bar(symbol)
+            fetch_start = last[0] if last else shift_date_int(span[1], 1)
+            return fetch_start, end_int
+
+    def matches_last_bar(self, symbol, bars):
+        """检查新数据（BarArray）与本地最后一根K线是否一致（不一致说明复权因子已变化）"""
+        last = self.last_bar(symbol)
+        if last is None or bars is None or len(bars) == 0:
+            return True
+        overlap = bars.between(last[0], last[0])
+        if len(overlap) == 0:
+            return True
+        return abs(float(overlap.field('close')[0]) - last[1]) < 1e-6
+
+    def write(self, symbol, bars, covered_from, covered_through):
+        """写入K线（BarArray），并将 [covered_from, covered_through] 标记为已完整获取"""
+        with self._file_lock():
+            self._sync()
+            slots = (len(self.codes), len(self.dates))
+            col = self._ensure_code(symbol)
+            if bars is not None and len(bars) > 0:
+                keep = bars.dates <= covered_through
+                date_rows = [self._ensure_date(int(date_int)) for date_int in bars.dates[keep]]
+                for field_key in HISTORY_FIELDS.values():
+                    self.columns[field_key][date_rows, col] = bars.field(field_key)[keep]
+
+            span = self._cover(symbol, covered_from, covered_through)
+            if span is not None:
+                self.pending_coverage[symbol] = span
+            self.dirty = True
+            if (len(self.codes), len(self.dates)) != slots:
+                # 新槽位立即落盘，其他进程不会把同一槽位分配给别的代码或日期
+                self._write_meta()
+
+    def invalidate(self, symbol):
+        """清除某只股票的全部本地数据"""
+        with self._file_lock():
+            self._sync()
+            col = self.code_index.get(symbol)
+            if col is None:
+                return
+            for column in self.columns.values():
+                column[:, col] = np.nan
+            self.coverage.pop(symbol, None)
+            self.pending_coverage.pop(symbol, None)
+            self._write_meta()
+
+    def read_bars(self, symbol, start_int, end_int):
+        """读取区间内的K线，返回 BarArray"""
+        with self._file_lock(exclusive=False):
+            self._sync()
+            col = self.code_index.get(symbol)
+            if col is None:
+                return BarArray.empty(symbol)
+            date_ints, rows = self._date_rows(start_int, end_int)
+            data = {
+                field_key: self.columns[field_key][rows, col] if rows else np.empty(0)
+                for field_key in HISTORY_FIELDS.values()
+            }
+
+        keep = ~np.isnan(data['close'])
+        data['volume'] = np.nan_to_num(data['volume'])
+        return BarArray(symbol, np.asarray(date_ints, dtype=np.int32)[keep],
+                        **{field_key: values[keep] for field_key, values in data.items()})
+
+    def read(self, symbol, start_int, end_int):
+        """读取区间内的K线，格式与 ak.stock_zh_a_hist 一致"""
+        return self.read_bars(symbol, start_int, end_int).to_frame()
+
+    def read_panel(self, codes, start_int, end_int):
+        """读取多只股票的 (股票 × 交易日) 面板，返回 (日期列表, {字段: 二维数组})"""
+        with self._file_lock(exclusive=False):
+            self._sync()
+            date_ints, rows = self._date_rows(start_int, end_int)
+            cols = np.array([self.code_index.get(code, -1) for code in codes], dtype=np.int64)
+            known = cols >= 0
+            panel = {}
+            for field_key in HISTORY_FIELDS.values():
+                values = np.full((len(codes), len(rows)), np.nan)
+                if rows and known.any():
+                    values[known] = self.columns[field_key][np.ix_(rows, cols[known])].T
+                panel[field_key] = values
+        return date_ints, panel
+
+    def read_market(self, start_int, end_int):
+        """读取全部股票的 (交易日 × 股票) 面板，返回 (日期列表, 代码列表, {字段: 二维数组})"""
+        with self._file_lock(exclusive=False):
+            self._sync()
+            date_ints, rows = self._date_rows(start_int, end_int)
+            n_codes = len(self.codes)
+            market = {
+                field_key: np.array(self.columns[field_key][rows, :n_codes]) if rows
+                else np.empty((0, n_codes))
+                for field_key in HISTORY_FIELDS.values()
+            }
+            return date_ints, list(self.codes), market
+
+    def fingerprint(self, start_int, end_int):
+        """区间内全部K线的指纹，任何股票的数据写入或失效后都会变化"""
+        date_ints, codes, market = self.read_market(start_int, end_int)
+        digest = hashlib.sha1()
+        digest.update(json.dumps([date_ints, codes]).encode('utf-8'))
+        for field_key in HISTORY_FIELDS.values():
+            digest.update(np.ascontiguousarray(market[field_key]).tobytes())
+        return digest.hexdigest()
+
+    def save_universe(self, stocks):
+        """保存股票列表（代码、名称），供历史日期筛选时离线使用"""
+        universe = [
+            {'代码': code, '名称': name}
+            for code, name in zip(stocks['代码'], stocks['名称'])
+        ]
+        with self._file_lock():
+            tmp_path = os.path.join(self.root_dir, 'universe.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(universe, f, ensure_ascii=False)
+            os.replace(tmp_path, os.path.join(self.root_dir, 'universe.json'))
+
+    def load_universe(self):
+        """读取保存的股票列表，没有时返回 None"""
+        path = os.path.join(self.root_dir, 'universe.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return pd.DataFrame(json.load(f), columns=['代码', '名称'])
+
+    def flush(self):
+        """将元数据和列数据落盘，覆盖区间与其他进程已落盘的合并"""
+        with self._file_lock():
+            if not self.dirty:
+                return
+            self._sync()
+            self._write_meta()
+
+
+_shared_stores = {}
+_shared_stores_lock = threading.Lock()
+
+
+def get_shared_history_store(root_dir=None, adjust='qfq'):
+    """进程内共享的本地历史数据存储（每个目录一个实例），目录不可写时返回 None"""
+    key = (os.path.abspath(root_dir or DEFAULT_HISTORY_DIR), adjust)
+    with _shared_stores_lock:
+        if key not in _shared_stores:
+            try:
+                _shared_stores[key] = HistoryStore(root_dir, adjust=adjust)
+            except Exception as e:
+                logger.warning(f"本地历史数据存储不可用，将直接请求数据源: {e}")
+                return None
+        return _shared_stores[key]
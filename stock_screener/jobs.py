@@ -0,0 +1,213 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from metrics import JOBS
+from result_store import get_shared_result_store
+from rules import CriteriaConfig
+from run_store import get_shared_run_store
+from stock_screener import StockScreener
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 同时执行的筛选任务数
+DEFAULT_MAX_JOBS = 2
+# 保留的已结束任务数，超出后淘汰最久未访问的
+DEFAULT_MAX_FINISHED_JOBS = 32
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class ScreeningJob:
+    """一次筛选任务的状态和结果"""
+
+    def __init__(self, job_id, key, target_date, params, criteria=None, run_id=None):
+        self.job_id = job_id
+        self.key = key
+        self.target_date = target_date
+        self.params = params
+        self.criteria = criteria or {}
+        self.status = 'queued'
+        self.progress = 0
+        self.message = '排队中...'
+        self.results = []
+        self.summary = {}
+        self.profile = None
+        self.error_message = ''
+        self.screener = None
+        # 服务端保存结果的句柄（见 result_store），导出时使用
+        self.result_handle = None
+        # 逐股保存检查点的运行 ID（见 run_store），进程中断后可按此 ID 续跑
+        self.run_id = run_id
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    def update(self, **fields):
+        with self.lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def to_dict(self, include_results=False):
+        with self.lock:
+            data = {
+                'job_id': self.job_id,
+                'date': self.target_date,
+                'params': self.params,
+                'criteria': self.criteria,
+                'status': self.status,
+                'progress': self.progress,
+                'message': self.error_message if self.status == 'error' else self.message,
+                'created_at': self.created_at.isoformat(),
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'result_handle': self.result_handle,
+                'run_id': self.run_id,
+            }
+            if include_results:
+                data['results'] = self.results
+                data['summary'] = self.summary
+                if self.profile is not None:
+                    data['profile'] = self.profile
+            return data
+
+
+class JobManager:
+    """筛选任务调度器
+
+    每个任务有独立的 ID、进度和结果，由有界线程池执行；相同日期和参数的请求在任务
+    未结束前复用同一个任务（singleflight）。已结束的任务按 LRU 保留 max_finished 个。
+    完成的任务结果以任务 ID 为句柄保存到 result_store，任务被淘汰后仍可导出。
+    运行存储可用时任务以任务 ID 为运行 ID 逐股保存检查点；提交时指定已有的 run_id
+    则续跑该运行（可以是其他进程中断的运行），同一运行同时只有一个任务。
+    """
+
+    def __init__(self, max_jobs=DEFAULT_MAX_JOBS, max_finished=DEFAULT_MAX_FINISHED_JOBS,
+                 screener_factory=StockScreener, result_store=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='screening-job')
+        self.max_finished = max_finished
+        self.screener_factory = screener_factory
+        self.result_store = result_store
+        self.jobs = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def job_key(target_date, params, criteria=None):
+        criteria = CriteriaConfig.from_dict(criteria).to_dict() if criteria else {}
+        return (
+            target_date,
+            tuple(sorted(params.items())),
+            tuple(sorted((name, str(value)) for name, value in criteria.items())),
+        )
+
+    def submit(self, target_date, criteria=None, run_id=None, **params):
+        """提交筛选任务，返回 (任务, 是否复用了进行中的任务)
+
+        criteria 为自定义筛选阈值（CriteriaConfig 的字段），参与任务去重。
+        run_id 为要续跑的运行，此时按运行去重，阈值以运行固定的为准。
+        """
+        key = ('run', run_id) if run_id else self.job_key(target_date, params, criteria)
+        with self.lock:
+            job = self.inflight.get(key)
+            if job is not None:
+                logger.info(f"🔁 复用进行中的筛选任务 {job.job_id}")
+                return job, True
+
+            job_id = uuid.uuid4().hex[:12]
+            if run_id is None and get_shared_run_store() is not None:
+                run_id = job_id
+            job = ScreeningJob(job_id, key, target_date, params, criteria, run_id)
+            self.jobs[job.job_id] = job
+            self.inflight[key] = job
+            self._evict()
+
+        JOBS.inc(status='queued')
+        logger.info(f"📥 新建筛选任务 {job.job_id}: {target_date} {params}")
+        self.executor.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id):
+        """按 ID 查询任务，不存在（或已被淘汰）时返回 None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                self.jobs.move_to_end(job_id)
+            return job
+
+    def latest(self):
+        """最近提交或访问的任务"""
+        with self.lock:
+            return next(reversed(self.jobs.values()), None)
+
+    def _run(self, job):
+        def progress_callback(progress, message):
+            job.update(progress=progress, message=message)
+
+        JOBS.dec(status='queued')
+        JOBS.inc(status='running')
+        try:
+            job.update(status='running', message='正在初始化...')
+            if job.criteria:
+                screener = self.screener_factory(criteria_config=CriteriaConfig.from_dict(job.criteria))
+            else:
+                screener = self.screener_factory()
+            job.update(screener=screener)
+            results = screener.screen_rescue_stocks(job.target_date, progress_callback, run_id=job.run_id,
+                                                    **job.params)
+            job.update(result_handle=self._store_results(job, results))
+            job.update(
+                status='completed',
+                progress=100,
+                message=f'筛选完成，找到 {len(results)} 只符合条件的股票'
+                        + ('（缓存结果）' if getattr(screener, 'last_result_cached', False) else ''),
+                results=results,
+                summary=screener.get_screening_summary(),
+                profile=getattr(screener, 'last_profile', None),
+            )
+            logger.info(f"✅ 筛选任务 {job.job_id} 完成，共找到 {len(results)} 只符合条件的股票")
+        except Exception as e:
+            logger.error(f"筛选任务 {job.job_id} 失败: {e}")
+            job.update(status='error', error_message=str(e), message=f'筛选失败: {str(e)}')
+        finally:
+            JOBS.dec(status='running')
+            job.update(finished_at=datetime.now())
+            with self.lock:
+                if self.inflight.get(job.key) is job:
+                    del self.inflight[job.key]
+                self._evict()
+
+    def _store_results(self, job, results):
+        """以任务 ID 为句柄保存结果，存储不可用时返回 None"""
+        store = self.result_store or get_shared_result_store()
+        if store is None:
+            return None
+        try:
+            handle = store.create(job.target_date, handle=job.job_id, meta={'params': job.params,
+                                                                           'criteria': job.criteria})
+            store.append(handle, results)
+            return handle
+        except Exception as e:
+            logger.warning(f"保存筛选任务 {job.job_id} 的结果失败: {e}")
+            return None
+
+    def _evict(self):
+        """淘汰超出数量的已结束任务（进行中的任务不淘汰）"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ACTIVE_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def statistics(self):
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+            return {
+                'jobs': len(statuses),
+                'inflight': len(self.inflight),
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'completed': statuses.count('completed'),
+                'error': statuses.count('error'),
+            }
@@ -0,0 +1,215 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+# 板块及对应的涨跌幅限制
+BOARD_MAIN = 'main'
+BOARD_CHINEXT = 'chinext'
+BOARD_STAR = 'star'
+BOARD_BSE = 'bse'
+
+BOARD_PREFIXES = (
+    (BOARD_CHINEXT, ('300', '301')),
+    (BOARD_STAR, ('688', '689')),
+    (BOARD_BSE, ('43', '83', '87', '88', '92')),
+)
+
+LIMIT_RATIOS = {
+    BOARD_MAIN: 0.10,
+    BOARD_CHINEXT: 0.20,
+    BOARD_STAR: 0.20,
+    BOARD_BSE: 0.30,
+}
+# 主板 ST 股票；创业板、科创板、北交所的 ST 股票与普通股票相同
+ST_LIMIT_RATIO = 0.05
+
+# 最小报价单位（元），收盘价与涨跌停价相差不超过半个单位即视为触及
+PRICE_TICK = 0.01
+HALF_TICK = PRICE_TICK / 2
+
+# 新股上市后不设涨跌幅限制的交易日数
+NEW_LISTING_FREE_DAYS = {
+    BOARD_MAIN: 5,
+    BOARD_CHINEXT: 5,
+    BOARD_STAR: 5,
+    BOARD_BSE: 1,
+}
+
+# 注册制新股上市首日名称前加 N，此后至不设涨跌幅限制期结束前加 C
+NEW_LISTING_PREFIXES = ('N', 'C')
+
+# 按交易日缓存的涨跌停价表数量
+MAX_CACHED_TABLES = 8
+
+
+def board_of(codes):
+    """按代码前缀返回每只股票所属板块"""
+    codes = np.asarray(codes, dtype=str)
+    boards = np.full(codes.shape, BOARD_MAIN, dtype=object)
+    for board, prefixes in BOARD_PREFIXES:
+        matched = np.zeros(codes.shape, dtype=bool)
+        for prefix in prefixes:
+            matched |= np.char.startswith(codes, prefix)
+        boards[matched] = board
+    return boards
+
+
+def limit_ratios(codes, names=None):
+    """每只股票的涨跌幅限制比例，names 用于识别主板 ST 股票"""
+    boards = board_of(codes)
+    ratios = np.array([LIMIT_RATIOS[board] for board in boards.ravel()], dtype=float).reshape(boards.shape)
+    if names is not None:
+        names = np.asarray(names, dtype=str)
+        st = np.char.find(names, 'ST') >= 0
+        ratios = np.where(st & (boards == BOARD_MAIN), ST_LIMIT_RATIO, ratios)
+    return ratios
+
+
+def new_listing_mask(names):
+    """按名称前缀识别上市初期不设涨跌幅限制的新股（如 N华丰、C华丰）"""
+    return np.array([
+        len(name) > 1 and name[0] in NEW_LISTING_PREFIXES and not name[1].isascii()
+        for name in np.asarray(names, dtype=str).ravel()
+    ], dtype=bool).reshape(np.shape(names))
+
+
+@lru_cache(maxsize=16384)
+def stock_limit_ratio(code, name=None):
+    """单只股票的涨跌幅限制比例（含 ST 与新股豁免，豁免时为 NaN），不在当日涨跌停价表中时使用"""
+    names = None if name is None else [name]
+    if names is not None and new_listing_mask(names)[0]:
+        return np.nan
+    return float(limit_ratios([code], names)[0])
+
+
+def round_price(values):
+    """按交易所规则四舍五入到分（加微小量抵消二进制浮点误差，如 10.005 → 10.01）"""
+    values = np.asarray(values, dtype=float)
+    return np.floor(values * 100 + 0.5 + 1e-6) / 100
+
+
+def limit_prices(prev_close, ratios):
+    """由前收盘价计算 (涨停价, 跌停价)，前收盘价缺失时为 NaN（视为无涨跌幅限制）"""
+    prev_close = np.asarray(prev_close, dtype=float)
+    with np.errstate(invalid='ignore'):
+        valid = prev_close > 0
+    prev_close = np.where(valid, prev_close, np.nan)
+    return round_price(prev_close * (1 + ratios)), round_price(prev_close * (1 - ratios))
+
+
+def at_limit_up(close, up):
+    """收盘价是否达到给定的涨停价（精确比较，容差半个报价单位；涨停价为 NaN 表示无限制）"""
+    with np.errstate(invalid='ignore'):
+        return ~np.isnan(close) & (np.asarray(close, dtype=float) >= np.asarray(up, dtype=float) - HALF_TICK)
+
+
+def at_limit_down(close, down):
+    """收盘价是否达到给定的跌停价"""
+    with np.errstate(invalid='ignore'):
+        return ~np.isnan(close) & (np.asarray(close, dtype=float) <= np.asarray(down, dtype=float) + HALF_TICK)
+
+
+def limit_up_mask(close, prev_close, ratios):
+    """收盘价是否达到由前收盘价计算的涨停价"""
+    return at_limit_up(close, limit_prices(prev_close, ratios)[0])
+
+
+def limit_down_mask(close, prev_close, ratios):
+    """收盘价是否达到由前收盘价计算的跌停价"""
+    return at_limit_down(close, limit_prices(prev_close, ratios)[1])
+
+
+def previous_close(close):
+    """沿最后一维（时间轴）取上一根K线的收盘价，第一根为 NaN"""
+    close = np.asarray(close, dtype=float)
+    prev = np.full(close.shape, np.nan)
+    prev[..., 1:] = close[..., :-1]
+    return prev
+
+
+class LimitPriceTable:
+    """某个交易日全市场的涨跌停价
+
+    由前收盘价一次性向量化计算，覆盖板块、ST 和新股上市初期不设涨跌幅限制的情况；
+    当天K线的涨跌停判定直接与 up / down 做数组比较。ratios 同时是各股票当日的涨跌幅
+    限制比例（不设限制时为 NaN），历史K线的涨跌停价按 ratio / ratios_for 查表计算，
+    各条筛选路径因此使用相同的板块、ST 和新股豁免。
+    """
+
+    def __init__(self, trade_date, codes, prev_close, names=None, listing_days=None):
+        self.trade_date = trade_date
+        self.codes = np.asarray(codes, dtype=str)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        ratios = limit_ratios(self.codes, names)
+
+        # 上市以来的交易日数（含当日）已知时按天数判定新股，否则按名称前缀
+        if listing_days is not None:
+            boards = board_of(self.codes)
+            free_days = np.array([NEW_LISTING_FREE_DAYS[board] for board in boards], dtype=float)
+            self.exempt = np.asarray(listing_days, dtype=float) <= free_days
+        elif names is not None:
+            self.exempt = new_listing_mask(names)
+        else:
+            self.exempt = np.zeros(len(self.codes), dtype=bool)
+        self.ratios = np.where(self.exempt, np.nan, ratios)
+        self.up, self.down = limit_prices(prev_close, self.ratios)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, trade_date=None):
+        """由行情快照（含 代码、名称、昨收 列）构造"""
+        prev_close = snapshot['昨收'].to_numpy(dtype=float) if '昨收' in snapshot.columns \
+            else np.full(len(snapshot), np.nan)
+        names = snapshot['名称'].to_numpy(dtype=str) if '名称' in snapshot.columns else None
+        return cls(trade_date, snapshot['代码'].to_numpy(dtype=str), prev_close, names)
+
+    def limit_up_mask(self, close):
+        return at_limit_up(close, self.up)
+
+    def limit_down_mask(self, close):
+        return at_limit_down(close, self.down)
+
+    def ratio(self, code, name=None):
+        """股票当日的涨跌幅限制比例，不在表中时按代码和名称计算"""
+        i = self.code_index.get(code)
+        return float(self.ratios[i]) if i is not None else stock_limit_ratio(code, name)
+
+    def ratios_for(self, codes):
+        """一组股票当日的涨跌幅限制比例，不在表中的按板块计算"""
+        rows = np.array([self.code_index.get(code, -1) for code in codes], dtype=np.int64)
+        ratios = limit_ratios(codes) if (rows < 0).any() else np.empty(len(rows))
+        known = rows >= 0
+        ratios[known] = self.ratios[rows[known]]
+        return ratios
+
+    def get(self, code):
+        """返回 (涨停价, 跌停价)，不在表中时返回 None"""
+        i = self.code_index.get(code)
+        if i is None:
+            return None
+        return float(self.up[i]), float(self.down[i])
+
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def table_for_snapshot(snapshot, trade_date, version=None):
+    """同一交易日（及快照版本）的涨跌停价表只计算一次
+
+    表的行与快照的行一一对应；同一键下股票列表不一致（如未指定版本）时重新计算。
+    """
+    key = (trade_date, version)
+    codes = snapshot['代码'].to_numpy(dtype=str)
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None and np.array_equal(table.codes, codes):
+            _tables.move_to_end(key)
+            return table
+    table = LimitPriceTable.from_snapshot(snapshot, trade_date)
+    with _tables_lock:
+        _tables[key] = table
+        while len(_tables) > MAX_CACHED_TABLES:
+            _tables.popitem(last=False)
+    return table
@@ -0,0 +1,288 @@
+"""
+盘中增量筛选
+按固定间隔刷新行情快照（stock_zh_a_spot_em），与上一份快照按代码比较各股票相对筛选阈值的
+位置：当天K线是否通过只看当天的规则（含涨停价与小阳线阈值）、最新价是否触及涨停价、成交量
+是否达到昨日成交量。成交量和成交额每次刷新都会变化，但只有越过这些阈值、新进入股票列表或
+上次未能评估的股票才重新判定，其余股票沿用上次结论。交易日内前几日的K线不会变化，每只股票
+只在首次通过快照预筛选时获取一次，之后的判定只用内存中的数组，不再请求历史数据。
+
+维护的命中集合变化时向订阅者推送 add / update / remove 事件，多个客户端共享同一个轮询；
+命中股票的行情变化但结论不变时推送 update。
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from bars import StockRow
+from data_fetcher import DataFetchError
+from limit_prices import at_limit_up, table_for_snapshot
+from market_session import session_date, shift_date_int
+from stock_screener import StockScreener, snapshot_today_bars
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 轮询间隔（秒），与盘中行情快照的缓存时间一致
+LIVE_POLL_INTERVAL = 30
+# 每个订阅者最多积压的事件数，超出后丢弃该订阅者（客户端过慢或已断开）
+MAX_PENDING_EVENTS = 10000
+# 规则使用的字段（不含由收盘价计算的 prev_close）
+RULE_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class SnapshotDiff:
+    """两份行情快照按代码比较的结果
+
+    values 为每只股票相对筛选阈值的状态（布尔矩阵，每列一个阈值），changed 为新快照中需要
+    重新判定的行（新增或越过了某个阈值），removed 为从股票列表中消失的代码。
+    """
+
+    def __init__(self, codes, values, previous=None):
+        self.codes = codes
+        self.values = values
+        if previous is None:
+            self.changed = np.ones(len(codes), dtype=bool)
+            self.removed = []
+            return
+        prev_codes, prev_values = previous
+        indexer = pd.Index(prev_codes).get_indexer(codes)
+        present = indexer >= 0
+        old = prev_values[np.where(present, indexer, 0)]
+        self.changed = ~present | (old != values).any(axis=1)
+        self.removed = prev_codes[~np.isin(prev_codes, codes)].tolist()
+
+    @property
+    def state(self):
+        return self.codes, self.values
+
+
+class LiveScreener:
+    """盘中持续刷新的筛选
+
+    refresh() 执行一轮"刷新快照 → 比较 → 增量判定"，返回本轮的事件列表；subscribe()
+    的订阅者由后台线程按 interval 轮询推送，最后一个订阅者退出后轮询停止。
+    """
+
+    def __init__(self, screener=None, interval=LIVE_POLL_INTERVAL):
+        self.screener = screener or StockScreener(use_result_cache=False)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.subscribers = []
+        self.thread = None
+        self.session = None
+        self.previous = None
+        self.snapshot_version = None
+        # 代码 -> 前几个交易日K线的各字段数组
+        self.prior = {}
+        # 代码 -> 昨日成交量，用于判断当天成交量是否越过缩量阈值
+        self.prior_volume = {}
+        # 上次未能评估、下一轮无论是否变化都重新判定的代码
+        self.pending = set()
+        # 当前命中：代码 -> 结果记录
+        self.matches = {}
+        self.ticks = 0
+
+    def refresh(self, now=None):
+        """执行一轮增量筛选，推送给订阅者并返回本轮的 [(事件类型, 数据)]"""
+        with self.refresh_lock:
+            matches = dict(self.matches)
+            events = self._refresh(now or datetime.now(), matches)
+            # 更新命中集合与推送在同一把锁内，新订阅者不会重复收到本轮的 add
+            with self.lock:
+                self.matches = matches
+                self._broadcast(events)
+        return events
+
+    def _refresh(self, now, matches):
+        started = time.perf_counter()
+        fetcher = self.screener.data_fetcher
+        session = session_date(now)
+        events = []
+        if session != self.session:
+            # 新的交易日：前几日的K线、上一份快照和命中集合都失效，全部重新判定
+            self.session = session
+            self.previous = None
+            self.prior = {}
+            self.prior_volume = {}
+            self.pending = set()
+            for code, row in matches.items():
+                events.append(('remove', {'code': code, 'name': row['name']}))
+            matches.clear()
+
+        snapshot = fetcher.get_all_stocks()
+        if snapshot is None or len(snapshot) == 0:
+            return events + [('error', {'message': '无法获取股票数据'})]
+        if fetcher.snapshot_version == self.snapshot_version and self.previous is not None and not self.pending:
+            return events + [('tick', self._tick_stats(0, 0, 0, len(matches), started))]
+        self.snapshot_version = fetcher.snapshot_version
+
+        codes = snapshot['代码'].to_numpy(dtype=str)
+        table = table_for_snapshot(snapshot, session, self.snapshot_version)
+        today = snapshot_today_bars(snapshot, table)
+
+        # 只看当天K线的规则对全部股票向量化判定，不通过的直接判为不符合；通过的股票首次出现时
+        # 获取前几日K线（上次获取失败的也在此重试）
+        candidates = self.screener.snapshot_mask(today)
+        missing = [code for code in codes[candidates] if code not in self.prior]
+        fetched, failed = self._load_prior(missing, session)
+        self.pending = failed
+
+        diff = SnapshotDiff(codes, self._thresholds(codes, today, candidates), self.previous)
+        changed = diff.changed | np.isin(codes, missing)
+        index = np.flatnonzero(changed)
+
+        rows = StockRow.from_snapshot(snapshot.iloc[index])
+        for i, stock in zip(index, rows):
+            if stock.code in failed:
+                continue
+            matched = bool(candidates[i]) and self.screener.rule_plan.evaluate(
+                {field: np.append(self.prior[stock.code][field], today[field][i]) for field in RULE_FIELDS},
+                stock.code, float(table.ratios[i])
+            )
+            if matched:
+                row = stock.to_result()
+                events.append(('update' if stock.code in matches else 'add', row))
+                matches[stock.code] = row
+            elif stock.code in matches:
+                del matches[stock.code]
+                events.append(('remove', {'code': stock.code, 'name': stock.name}))
+        for code in diff.removed:
+            row = matches.pop(code, None)
+            if row is not None:
+                events.append(('remove', {'code': code, 'name': row['name']}))
+
+        # 结论不变的命中股票只刷新展示的行情
+        unchanged = np.flatnonzero(~changed & np.isin(codes, list(matches)))
+        for stock in StockRow.from_snapshot(snapshot.iloc[unchanged]):
+            row = stock.to_result()
+            if row != matches[stock.code]:
+                events.append(('update', row))
+                matches[stock.code] = row
+
+        self.previous = diff.state
+        stats = self._tick_stats(len(index), fetched, len(failed), len(matches), started)
+        events.append(('tick', stats))
+        logger.info(f"🔄 增量筛选: {stats['changed']} 只越过阈值，获取 {fetched} 只历史数据，"
+                    f"当前命中 {stats['matched_count']} 只，耗时 {stats['elapsed_ms']:.1f}ms")
+        return events
+
+    def _thresholds(self, codes, today, candidates):
+        """各股票相对筛选阈值的状态，内置规则的判定结论只会在某一列变化时改变
+
+        列依次为：是否通过只看当天K线的规则（含涨停价、小阳线阈值），最新价是否触及涨停价
+        （多日规则中的首板判断），成交量是否达到昨日成交量（缩量判断，昨日成交量未知时为 False）。
+        """
+        yesterday = np.fromiter((self.prior_volume.get(code, np.nan) for code in codes),
+                                dtype=float, count=len(codes))
+        with np.errstate(invalid='ignore'):
+            volume_up = today['volume'] >= yesterday
+        return np.column_stack([candidates, at_limit_up(today['close'], today['limit_up']), volume_up])
+
+    def _load_prior(self, codes, session):
+        """获取前几个交易日的K线（截至 session 前一天），返回 (获取数, 失败的代码集合)"""
+        if not codes:
+            return 0, set()
+        fetcher = self.screener.data_fetcher
+        plan = self.screener.rule_plan
+        end_date = shift_date_int(session, -1)
+
+        def load(code):
+            bars = fetcher.get_stock_history(code, days=plan.max_bars - 1, min_days=1,
+                                             raise_errors=True, end_date=end_date)
+            if bars is None:
+                return {field: np.empty(0) for field in RULE_FIELDS}
+            return bars.rule_bars(RULE_FIELDS)
+
+        failed = set()
+        with ThreadPoolExecutor(max_workers=max(1, self.screener.max_workers)) as executor:
+            futures = {executor.submit(load, code): code for code in codes}
+            for future in as_completed(futures):
+                code = futures[future]
+                try:
+                    bars = self.prior[code] = future.result()
+                    self.prior_volume[code] = float(bars['volume'][-1]) if len(bars['volume']) else np.nan
+                except DataFetchError as e:
+                    logger.warning(f"⚠️ 股票 {code} 历史数据获取失败，下一轮重试: {e}")
+                    failed.add(code)
+        fetcher.flush_history_store()
+        return len(codes) - len(failed), failed
+
+    def _tick_stats(self, changed, fetched, failed, matched, started):
+        self.ticks += 1
+        return {
+            'tick': self.ticks,
+            'session_date': self.session,
+            'snapshot_version': self.snapshot_version,
+            'changed': changed,
+            'history_fetched': fetched,
+            'unevaluated': failed,
+            'matched_count': matched,
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+            'timestamp': datetime.now().isoformat(),
+        }
+
+    def subscribe(self):
+        """订阅增量事件，返回事件队列；第一个事件为 start（含当前命中集合）"""
+        events = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+        with self.lock:
+            events.put(('start', {
+                'matches': list(self.matches.values()),
+                'session_date': self.session,
+                'interval': self.interval,
+            }))
+            self.subscribers.append(events)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name='live-screener')
+                self.thread.start()
+        return events
+
+    def is_subscribed(self, events):
+        with self.lock:
+            return events in self.subscribers
+
+    def unsubscribe(self, events):
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def _broadcast(self, events):
+        """调用方持有 self.lock"""
+        for subscriber in list(self.subscribers):
+            try:
+                for event in events:
+                    subscriber.put_nowait(event)
+            except queue.Full:
+                logger.warning("订阅者积压的事件过多，已断开")
+                self.subscribers.remove(subscriber)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"增量筛选失败: {e}")
+                with self.lock:
+                    self._broadcast([('error', {'message': f'筛选失败: {str(e)}'})])
+            time.sleep(self.interval)
+
+    def statistics(self):
+        with self.lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'running': self.thread is not None,
+                'ticks': self.ticks,
+                'session_date': self.session,
+                'tracked_stocks': len(self.prior),
+                'matched_count': len(self.matches),
+            }
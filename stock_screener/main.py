@@ -1,9 +1,16 @@
-from flask import Flask, render_template, request, jsonify, send_file
-import threading
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import os
 from datetime import datetime
 import logging
+import threading
+from exporters import ExportUnavailableError, available_formats, chunked, export_headers, open_export
+from jobs import JobManager
+from live_screener import LiveScreener
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from result_store import get_shared_result_store
+from run_store import get_shared_run_store, new_run_id
 from stock_screener import StockScreener
+from streaming import SSE_HEADERS, stream_live, stream_screening
 import json
 import io
 
@@ -17,59 +24,42 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 
-# 全局变量存储筛选状态和结果
-screening_status = {
-    'status': 'idle',  # idle, running, completed, error
-    'progress': 0,
-    'message': '',
-    'results': [],
-    'summary': {},
-    'error_message': ''
-}
-
-screener = None
-screening_thread = None
-
-def progress_callback(progress, message):
-    """筛选进度回调函数"""
-    global screening_status
-    screening_status['progress'] = progress
-    screening_status['message'] = message
-    logger.info(f"筛选进度: {progress}% - {message}")
-
-def run_screening(target_date):
-    """在后台线程中运行筛选"""
-    global screening_status, screener
-    
-    try:
-        screening_status['status'] = 'running'
-        screening_status['progress'] = 0
-        screening_status['message'] = '正在初始化...'
-        
-        # 创建筛选器实例
-        screener = StockScreener()
-        
-        # 开始筛选
-        logger.info(f"开始筛选 {target_date} 的自救股票")
-        results = screener.screen_rescue_stocks(target_date, progress_callback)
-        
-        # 获取筛选摘要
-        summary = screener.get_screening_summary()
-        
-        # 更新状态
-        screening_status['status'] = 'completed'
-        screening_status['progress'] = 100
-        screening_status['message'] = f'筛选完成，找到 {len(results)} 只符合条件的股票'
-        screening_status['results'] = results
-        screening_status['summary'] = summary
-        
-        logger.info(f"筛选完成，共找到 {len(results)} 只符合条件的股票")
-        
-    except Exception as e:
-        logger.error(f"筛选过程发生错误: {e}")
-        screening_status['status'] = 'error'
-        screening_status['error_message'] = str(e)
-        screening_status['message'] = f'筛选失败: {str(e)}'
+# 筛选任务调度器：每个任务独立的进度和结果
+job_manager = JobManager()
+
+# 盘中增量筛选：所有订阅的客户端共享一个轮询，首次订阅时创建
+live_screener = None
+live_screener_lock = threading.Lock()
+
+def get_live_screener():
+    global live_screener
+    with live_screener_lock:
+        if live_screener is None:
+            live_screener = LiveScreener()
+        return live_screener
+
+def resolve_job(job_id=None):
+    """按 job_id 查找任务，未提供时使用最近的任务（兼容旧版前端）"""
+    if job_id:
+        return job_manager.get(job_id)
+    return job_manager.latest()
+
+def export_chunks(data):
+    """导出的数据来源：服务端结果句柄 > 任务结果 > 请求中上传的结果（兼容旧版前端）"""
+    store = get_shared_result_store()
+    handle = data.get('result_handle')
+    if handle:
+        if store is not None and store.info(handle) is not None:
+            return store.iter_chunks(handle)
+    else:
+        job = resolve_job(data.get('job_id'))
+        if job is not None and job.status == 'completed':
+            if job.result_handle and store is not None:
+                return store.iter_chunks(job.result_handle)
+            return chunked(job.results)
+    if data.get('results'):
+        return chunked(data['results'])
+    return None
 
 @app.route('/')
 def index():
@@ -79,9 +69,7 @@ def index():
 
 @app.route('/screen', methods=['POST'])
 def start_screening():
-    """启动筛选"""
-    global screening_thread, screening_status
-    
+    """启动筛选任务，相同日期和参数的进行中任务直接复用"""
     try:
         data = request.get_json()
         target_date = data.get('date')
@@ -92,34 +80,23 @@ def start_screening():
                 'message': '请提供筛选日期'
             })
         
-        # 检查是否已有筛选在进行
-        if screening_status['status'] == 'running':
-            return jsonify({
-                'success': False,
-                'message': '筛选已在进行中，请等待完成'
-            })
-        
-        # 重置状态
-        screening_status = {
-            'status': 'idle',
-            'progress': 0,
-            'message': '',
-            'results': [],
-            'summary': {},
-            'error_message': ''
-        }
+        params = {}
+        if data.get('max_stocks'):
+            params['max_stocks'] = int(data['max_stocks'])
+        if data.get('profile'):
+            params['profile'] = data['profile']
         
-        # 启动筛选线程
-        screening_thread = threading.Thread(
-            target=run_screening,
-            args=(target_date,)
-        )
-        screening_thread.daemon = True
-        screening_thread.start()
+        # 指定 run_id 时续跑中断的运行
+        job, attached = job_manager.submit(target_date, criteria=data.get('criteria'), run_id=data.get('run_id'),
+                                           **params)
         
         return jsonify({
             'success': True,
-            'message': '筛选已启动'
+            'status': 'started',
+            'job_id': job.job_id,
+            'run_id': job.run_id,
+            'attached': attached,
+            'message': '已加入进行中的相同筛选' if attached else '筛选已启动'
         })
         
     except Exception as e:
@@ -129,81 +106,131 @@ def start_screening():
             'message': f'启动筛选失败: {str(e)}'
         })
 
+@app.route('/screen/stream')
+def stream_screening_events():
+    """以 server-sent events 推送一次完整筛选的进度和结果"""
+    target_date = request.args.get('date')
+    if not target_date:
+        return jsonify({
+            'success': False,
+            'message': '请提供筛选日期'
+        }), 400
+    
+    # 逐股保存检查点；连接中断后以同一 run_id 重新连接即从中断处继续
+    run_id = request.args.get('run_id') or (new_run_id() if get_shared_run_store() is not None else None)
+    screener = StockScreener()
+    return Response(
+        stream_with_context(stream_screening(screener, target_date, request.args.get('snapshot_version'),
+                                             result_store=get_shared_result_store(), run_id=run_id)),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
+@app.route('/screen/live')
+def stream_live_screening():
+    """盘中增量筛选：推送命中集合的 add / update / remove 事件和每轮刷新的 tick 统计"""
+    return Response(
+        stream_with_context(stream_live(get_live_screener())),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
 @app.route('/progress')
 def get_progress():
-    """获取筛选进度"""
-    global screening_status
-    
-    response_data = {
-        'status': screening_status['status'],
-        'progress': screening_status['progress'],
-        'message': screening_status['message']
-    }
-    
-    if screening_status['status'] == 'error':
-        response_data['message'] = screening_status.get('error_message', '未知错误')
+    """获取筛选任务进度"""
+    job = resolve_job(request.args.get('job_id'))
+    if job is None:
+        return jsonify({
+            'status': 'idle',
+            'progress': 0,
+            'message': '请点击开始筛选'
+        })
     
-    return jsonify(response_data)
+    return jsonify(job.to_dict())
 
 @app.route('/results')
 def get_results():
-    """获取筛选结果"""
-    global screening_status
-    
-    if screening_status['status'] != 'completed':
+    """获取筛选任务结果"""
+    job = resolve_job(request.args.get('job_id'))
+    if job is None or job.status != 'completed':
         return jsonify({
             'success': False,
             'message': '筛选尚未完成或发生错误'
         })
     
+    data = job.to_dict(include_results=True)
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'results': data['results'],
+        'summary': data['summary']
+    })
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """查询单个筛选任务"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': '任务不存在或已过期'
+        }), 404
+    return jsonify({'success': True, **job.to_dict(include_results=True)})
+
+@app.route('/runs/<run_id>')
+def get_run(run_id):
+    """查询断点续跑的运行：进度及已判定的结果"""
+    store = get_shared_run_store()
+    run = store.get(run_id) if store is not None else None
+    if run is None:
+        return jsonify({
+            'success': False,
+            'message': '运行不存在或已过期'
+        }), 404
     return jsonify({
         'success': True,
-        'results': screening_status['results'],
-        'summary': screening_status['summary']
+        **run,
+        'results': store.results(run_id),
+        'unevaluated': store.unevaluated(run_id)
     })
 
-@app.route('/export/<format>', methods=['POST'])
+@app.route('/results/<handle>')
+def get_result_handle(handle):
+    """查询服务端保存的结果集"""
+    store = get_shared_result_store()
+    info = store.info(handle) if store is not None else None
+    if info is None:
+        return jsonify({
+            'success': False,
+            'message': '结果不存在或已过期'
+        }), 404
+    return jsonify({'success': True, **info, 'formats': available_formats()})
+
+@app.route('/export/<format>', methods=['GET', 'POST'])
 def export_results(format):
-    """导出筛选结果"""
-    global screener, screening_status
-    
-    if screening_status['status'] != 'completed' or not screener:
+    """流式导出筛选结果（csv、excel、parquet、arrow）
+
+    GET 按 result_handle 或 job_id 从服务端读取结果，不需要上传；POST 兼容旧版前端。
+    """
+    data = dict(request.args.items())
+    data.update(request.get_json(silent=True) or {})
+    chunks = export_chunks(data)
+    if chunks is None:
         return jsonify({
             'success': False,
             'message': '没有可导出的结果'
         }), 400
     
     try:
-        if format.lower() == 'excel':
-            filename = screener.export_results_to_excel()
-            if filename:
-                return send_file(
-                    filename,
-                    as_attachment=True,
-                    download_name=os.path.basename(filename),
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
-        elif format.lower() == 'csv':
-            filename = screener.export_results_to_csv()
-            if filename:
-                return send_file(
-                    filename,
-                    as_attachment=True,
-                    download_name=os.path.basename(filename),
-                    mimetype='text/csv'
-                )
-        
+        stream, filename, mimetype = open_export(format, chunks)
+    except ExportUnavailableError as e:
         return jsonify({
             'success': False,
-            'message': '导出失败'
-        }), 500
-        
-    except Exception as e:
-        logger.error(f"导出失败: {e}")
-        return jsonify({
-            'success': False,
-            'message': f'导出失败: {str(e)}'
-        }), 500
+            'message': str(e)
+        }), 501
+    
+    logger.info(f"📤 开始导出 {filename}")
+    return Response(stream_with_context(stream), mimetype=mimetype, headers=export_headers(filename))
 
 @app.route('/status')
 def get_status():
@@ -211,9 +238,15 @@ def get_status():
     return jsonify({
         'status': 'running',
         'timestamp': datetime.now().isoformat(),
-        'screening_status': screening_status['status']
+        'jobs': job_manager.statistics(),
+        'live': live_screener.statistics() if live_screener is not None else None
     })
 
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found_error(error):
     """404错误处理"""
@@ -0,0 +1,82 @@
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+
+# A股交易时段（含集合竞价），盘中数据持续变化
+MARKET_OPEN_TIME = time(9, 15)
+MARKET_CLOSE_TIME = time(15, 0)
+# 收盘后多久认为当日K线已定型
+MARKET_SETTLE_TIME = time(15, 30)
+
+
+def to_date_int(value):
+    """将日期转换为 yyyymmdd 整数"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        return int(value.replace('-', '')[:8])
+    if isinstance(value, (datetime, date)):
+        return value.year * 10000 + value.month * 100 + value.day
+    if isinstance(value, np.datetime64):
+        return int(str(value.astype('datetime64[D]')).replace('-', ''))
+    raise TypeError(f"无法识别的日期: {value!r}")
+
+
+def from_date_int(value):
+    """将 yyyymmdd 整数转换为 date"""
+    value = int(value)
+    return date(value // 10000, value // 100 % 100, value % 100)
+
+
+def shift_date_int(value, days):
+    """日期整数按自然日偏移"""
+    return to_date_int(from_date_int(value) + timedelta(days=days))
+
+
+def is_trading_day(day):
+    """是否为交易日（按周一至周五近似，不含节假日日历）"""
+    return day.weekday() < 5
+
+
+def is_intraday(now=None):
+    """当前是否处于交易时段内"""
+    now = now or datetime.now()
+    return is_trading_day(now.date()) and MARKET_OPEN_TIME <= now.time() < MARKET_CLOSE_TIME
+
+
+def next_market_open(now=None):
+    """下一次开盘时间"""
+    now = now or datetime.now()
+    day = now.date()
+    if now.time() >= MARKET_OPEN_TIME:
+        day += timedelta(days=1)
+    while not is_trading_day(day):
+        day += timedelta(days=1)
+    return datetime.combine(day, MARKET_OPEN_TIME)
+
+
+def snapshot_expiry(now=None, intraday_ttl=30):
+    """行情快照的失效时间：盘中短时间有效，收盘后一直有效到下次开盘"""
+    now = now or datetime.now()
+    if is_intraday(now):
+        return now + timedelta(seconds=intraday_ttl)
+    return next_market_open(now)
+
+
+def session_date(now=None):
+    """行情快照对应的交易日（yyyymmdd）：开盘后为当天，开盘前及非交易日为上一个交易日"""
+    now = now or datetime.now()
+    day = now.date()
+    if now.time() < MARKET_OPEN_TIME:
+        day -= timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return to_date_int(day)
+
+
+def last_closed_date(now=None):
+    """返回K线已定型的最后一个自然日（yyyymmdd）"""
+    now = now or datetime.now()
+    if now.time() >= MARKET_SETTLE_TIME:
+        return to_date_int(now)
+    return to_date_int(now - timedelta(days=1))
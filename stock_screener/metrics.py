@@ -0,0 +1,226 @@
+import math
+import threading
+
+from api_log import LATENCY_BUCKETS
+from rate_limiter import SHARED_RATE_CONTROLLER, SHARED_RATE_LIMITER
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 单只股票检查耗时的桶上界（秒）
+CHECK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf'))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric:
+    """带标签的指标，各标签组合的值保存在 values 中
+
+    指定 function 时改为在导出时调用它取值（返回 {标签值元组: 数值}，无标签时返回单个
+    数值），用于导出其他模块已经维护的计数。
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, description, labelnames=(), function=None):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """返回 [(名称后缀, 标签值, 附加标签, 数值)]"""
+        if self.function is not None:
+            result = self.function()
+            if not isinstance(result, dict):
+                result = {(): result}
+            return [('', key, (), value) for key, value in sorted(result.items()) if value is not None]
+        with self.lock:
+            return [('', key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """只增不减的计数"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0.0)
+
+
+class Gauge(Metric):
+    """可增可减的当前值"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """分桶累计的耗时分布，导出 _bucket / _sum / _count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+        if self.buckets[-1] != float('inf'):
+            self.buckets += (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), total))
+                samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """进程内的指标集合，按注册顺序导出为 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"指标 {metric.name} 已注册")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, description, labelnames=(), function=None):
+    return REGISTRY.register(Counter(name, description, labelnames, function))
+
+
+def gauge(name, description, labelnames=(), function=None):
+    return REGISTRY.register(Gauge(name, description, labelnames, function))
+
+
+def histogram(name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, description, labelnames, buckets))
+
+
+# 上游数据接口（api 为 akshare 函数名，如 stock_zh_a_spot_em、stock_zh_a_hist）
+UPSTREAM_LATENCY = histogram(
+    'stock_upstream_request_seconds', '上游接口单次请求耗时（秒），含失败的请求', ('api',))
+UPSTREAM_REQUESTS = counter(
+    'stock_upstream_requests_total', '上游接口请求次数，outcome 为 success/error', ('api', 'outcome'))
+UPSTREAM_RETRIES = counter('stock_upstream_retries_total', '上游接口失败后的重试次数', ('api',))
+THROTTLE_WAITS = counter('stock_rate_limiter_waits_total', '因令牌不足而等待的请求数')
+THROTTLE_WAIT_SECONDS = counter('stock_rate_limiter_wait_seconds_total', '令牌桶累计等待时间（秒）')
+RATE_LIMIT = gauge('stock_rate_limit_per_second', '共享令牌桶当前的请求速率上限', function=lambda: SHARED_RATE_LIMITER.rate)
+RATE_DECREASES = counter(
+    'stock_rate_limit_decreases_total', '因上游出错或延迟突增而降速的次数',
+    function=lambda: SHARED_RATE_CONTROLLER.decreases)
+
+# 缓存（cache 为 history/history_store/snapshot/result，result 为 hit/miss）
+CACHE_REQUESTS = counter('stock_cache_requests_total', '缓存查询次数', ('cache', 'result'))
+
+
+def _cache_hit_ratios():
+    with CACHE_REQUESTS.lock:
+        values = dict(CACHE_REQUESTS.values)
+    ratios = {}
+    for cache in sorted({key[0] for key in values}):
+        hits = values.get((cache, 'hit'), 0.0)
+        total = hits + values.get((cache, 'miss'), 0.0)
+        ratios[(cache,)] = hits / total if total else None
+    return ratios
+
+
+CACHE_HIT_RATIO = gauge('stock_cache_hit_ratio', '进程启动以来的缓存命中率', ('cache',), _cache_hit_ratios)
+
+# 筛选
+STOCKS_SCREENED = counter(
+    'stock_screened_total', '已检查的股票数，outcome 为 matched/rejected/unevaluated', ('outcome',))
+STOCK_CHECK_LATENCY = histogram(
+    'stock_screening_check_seconds', '单只股票检查耗时（秒），含获取历史数据', buckets=CHECK_BUCKETS)
+SCREENING_RUNS_IN_PROGRESS = gauge('stock_screening_runs_in_progress', '正在检查股票的筛选轮次数')
+SCREENING_THROUGHPUT = gauge('stock_screening_stocks_per_second', '最近一轮筛选每秒检查的股票数')
+JOBS = gauge('stock_screening_jobs', '筛选任务数，status 为 queued/running', ('status',))
+
+
+def render():
+    """导出全部指标"""
+    return REGISTRY.render()
@@ -0,0 +1,225 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# 性能分析模式：stages 只统计分阶段/逐股耗时，cprofile 另存 pstats 文件，
+# stacks 另存可直接生成火焰图的折叠栈采样（flamegraph.pl / speedscope）
+PROFILE_MODES = ('stages', 'cprofile', 'stacks')
+
+# 未显式指定时由环境变量开启，便于在 Web 服务中临时打开
+PROFILE_ENV = 'STOCK_PROFILE'
+
+DEFAULT_PROFILE_DIR = os.environ.get(
+    'STOCK_PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'profiles')
+)
+
+# 栈采样间隔（秒）
+SAMPLE_INTERVAL = 0.005
+# 摘要中列出的最慢股票数
+SLOWEST_STOCKS = 5
+
+
+def resolve_mode(profile):
+    """把 profile 参数（None/True/模式名）转换为模式名，None 表示不分析"""
+    if profile is None:
+        profile = os.environ.get(PROFILE_ENV) or None
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return 'stages'
+    if profile not in PROFILE_MODES:
+        raise ValueError(f"未知的性能分析模式 {profile}，可选 {PROFILE_MODES}")
+    return profile
+
+
+class StackSampler:
+    """后台线程定期采样所有线程的调用栈，按折叠栈格式计数"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread').split('_')[0])
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RunProfiler:
+    """一轮筛选的性能分析
+
+    stage() 累计各阶段的墙钟时间（在工作线程中调用时为各线程耗时之和），
+    record_stock() 记录每只股票的检查耗时；cprofile/stacks 模式在 stop() 时写出文件。
+    分批筛选时同一个 RunProfiler 跨批次累计。
+    """
+
+    def __init__(self, mode='stages', output_dir=DEFAULT_PROFILE_DIR, label='screening'):
+        self.mode = mode
+        self.output_dir = output_dir
+        self.label = label
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.stocks = {}
+        self.wall_seconds = 0.0
+        self.runs = 0
+        self.artifacts = {}
+        self.artifact_name = None
+        self.started_at = None
+        self.profiles = []
+        self.thread_profile = threading.local()
+        self.sampler = StackSampler() if mode == 'stacks' else None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.runs += 1
+        if self.mode == 'cprofile':
+            self._enable_thread_profile()
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def stop(self):
+        """结束一段分析，返回摘要"""
+        if self.started_at is None:
+            return self.summary()
+        self.wall_seconds += time.perf_counter() - self.started_at
+        self.started_at = None
+        if self.mode == 'cprofile':
+            profile = getattr(self.thread_profile, 'profile', None)
+            if profile is not None:
+                profile.disable()
+            self._dump_cprofile()
+        if self.sampler is not None:
+            self.sampler.stop()
+            self._dump_stacks()
+        return self.summary()
+
+    def _enable_thread_profile(self):
+        """cProfile 只分析调用 enable 的线程，每个工作线程各用一个 Profile，结束时合并"""
+        profile = getattr(self.thread_profile, 'profile', None)
+        if profile is None:
+            profile = cProfile.Profile()
+            self.thread_profile.profile = profile
+            with self.lock:
+                self.profiles.append(profile)
+        profile.enable()
+
+    def wrap(self, func):
+        """包装在工作线程中执行的函数，使其计入 cProfile"""
+        if self.mode != 'cprofile':
+            return func
+
+        def profiled(*args, **kwargs):
+            self._enable_thread_profile()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.thread_profile.profile.disable()
+        return profiled
+
+    def _artifact_path(self, suffix):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.artifact_name is None:
+            self.artifact_name = f"{self.label}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        return os.path.join(self.output_dir, f"{self.artifact_name}{suffix}")
+
+    def _dump_cprofile(self):
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = self._artifact_path('.pstats')
+        stats.dump_stats(path)
+        self.artifacts['pstats'] = path
+
+    def _dump_stacks(self):
+        path = self._artifact_path('.folded')
+        self.sampler.dump(path)
+        self.artifacts['folded_stacks'] = path
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def add_stage(self, name, seconds, count=1):
+        with self.lock:
+            total = self.stages.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += count
+
+    def record_stock(self, code, seconds):
+        with self.lock:
+            self.stocks[code] = self.stocks.get(code, 0.0) + seconds
+
+    def summary(self):
+        with self.lock:
+            stages = {
+                name: {'seconds': round(seconds, 4), 'count': count}
+                for name, (seconds, count) in sorted(self.stages.items(), key=lambda item: -item[1][0])
+            }
+            timings = sorted(self.stocks.items(), key=lambda item: -item[1])
+        seconds = sorted(value for _, value in timings)
+
+        def quantile(q):
+            return round(seconds[min(len(seconds) - 1, int(q * len(seconds)))] * 1000, 2) if seconds else None
+
+        return {
+            'mode': self.mode,
+            'runs': self.runs,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'stages': stages,
+            'stocks': {
+                'count': len(seconds),
+                'total_seconds': round(sum(seconds), 4),
+                'p50_ms': quantile(0.5),
+                'p95_ms': quantile(0.95),
+                'max_ms': round(seconds[-1] * 1000, 2) if seconds else None,
+                'slowest': [
+                    {'code': code, 'ms': round(value * 1000, 2)} for code, value in timings[:SLOWEST_STOCKS]
+                ],
+            },
+            'artifacts': dict(self.artifacts),
+        }
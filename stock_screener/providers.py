@@ -0,0 +1,274 @@
+"""
+行情数据源
+StockDataFetcher 通过 provider 获取行情快照和日线，接口与 akshare 的 stock_zh_a_spot_em /
+stock_zh_a_hist 一致。除 akshare 外还有本地存储、合成行情，以及录制/回放：录制把一次真实运行的
+全部上游响应写入 gzip 压缩的 cassette 文件，回放按原顺序返回这些响应，不联网、不限速，
+便于离线复现问题和二分定位性能回退。
+"""
+import atexit
+import gzip
+import logging
+import os
+import pickle
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from market_session import shift_date_int, to_date_int
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认数据源，可通过环境变量 STOCK_DATA_PROVIDER 指定：
+# akshare | local | synthetic[:股票数] | record:<cassette 路径> | replay:<cassette 路径>
+PROVIDER_ENV = 'STOCK_DATA_PROVIDER'
+DEFAULT_PROVIDER_SPEC = 'akshare'
+
+CASSETTE_VERSION = 1
+# 回放时精确匹配失败后忽略这些参数再匹配，使录制于某天的 cassette 在其他日期也能回放
+CASSETTE_DATE_ARGS = ('start_date', 'end_date')
+# 本地存储构造行情快照时回看的自然日数
+LOCAL_SNAPSHOT_LOOKBACK_DAYS = 15
+
+
+class CassetteMissError(LookupError):
+    """回放时 cassette 中没有对应请求的录制"""
+
+
+class MarketDataProvider:
+    """行情数据源接口
+
+    remote 为 True 的数据源经全局令牌桶限流、失败后退避重试；本地数据源（本地存储、回放）
+    不限速，重试也不等待。
+    """
+
+    name = ''
+    remote = True
+
+    def stock_zh_a_spot_em(self):
+        """全市场实时行情快照，列名与 akshare 一致"""
+        raise NotImplementedError
+
+    def stock_zh_a_hist(self, symbol, period='daily', start_date='19700101', end_date='20500101', adjust=''):
+        """单只股票区间内的日线，列名与 akshare 一致"""
+        raise NotImplementedError
+
+
+class AkshareProvider(MarketDataProvider):
+    """akshare 数据源，首次请求时才导入 akshare"""
+
+    name = 'akshare'
+
+    def stock_zh_a_spot_em(self):
+        import akshare as ak
+        return ak.stock_zh_a_spot_em()
+
+    def stock_zh_a_hist(self, symbol, period='daily', start_date='19700101', end_date='20500101', adjust=''):
+        import akshare as ak
+        return ak.stock_zh_a_hist(symbol=symbol, period=period, start_date=start_date,
+                                  end_date=end_date, adjust=adjust)
+
+
+class LocalStoreProvider(MarketDataProvider):
+    """本地历史数据存储（history_store）作为数据源，完全离线
+
+    行情快照由保存的股票列表和存储中最近一个交易日的K线构造；存储只保存一种复权方式，
+    adjust 参数被忽略。
+    """
+
+    name = 'local'
+    remote = False
+
+    def __init__(self, history_store=None):
+        if history_store is None:
+            from history_store import get_shared_history_store
+            history_store = get_shared_history_store()
+            if history_store is None:
+                raise RuntimeError("本地历史数据存储不可用")
+        self.history_store = history_store
+
+    def stock_zh_a_spot_em(self):
+        store = self.history_store
+        universe = store.load_universe()
+        if universe is None:
+            return pd.DataFrame(columns=['代码', '名称'])
+        codes = universe['代码'].tolist()
+        today = to_date_int(datetime.now())
+        dates, panel = store.read_panel(codes, shift_date_int(today, -LOCAL_SNAPSHOT_LOOKBACK_DAYS), today)
+        closes = panel['close']
+        traded = [i for i in range(len(dates)) if not np.isnan(closes[:, i]).all()]
+        if not traded:
+            return universe.iloc[0:0]
+
+        day = traded[-1]
+        prev_close = np.full(len(codes), np.nan)
+        for i in range(day):
+            prev_close = np.where(np.isnan(closes[:, i]), prev_close, closes[:, i])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = closes[:, day] - prev_close
+            change_pct = np.round(change / prev_close * 100, 2)
+        return universe.reset_index(drop=True).assign(**{
+            '最新价': closes[:, day],
+            '涨跌幅': change_pct,
+            '涨跌额': np.round(change, 2),
+            '成交量': panel['volume'][:, day],
+            '成交额': panel['amount'][:, day],
+            '最高': panel['high'][:, day],
+            '最低': panel['low'][:, day],
+            '今开': panel['open'][:, day],
+            '昨收': prev_close,
+            '总市值': np.nan,
+        })
+
+    def stock_zh_a_hist(self, symbol, period='daily', start_date='19700101', end_date='20500101', adjust=''):
+        return self.history_store.read(symbol, int(start_date), int(end_date))
+
+
+def _request_key(api, kwargs, ignore=()):
+    return (api, tuple(sorted((key, str(value)) for key, value in kwargs.items() if key not in ignore)))
+
+
+class RecordingProvider(MarketDataProvider):
+    """包装另一个数据源，按调用顺序记录每次请求的参数和响应（含异常），save() 写入 cassette"""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.name = f"record:{inner.name}"
+        self.remote = inner.remote
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def _record(self, api, kwargs):
+        try:
+            result = getattr(self.inner, api)(**kwargs)
+        except Exception as e:
+            with self.lock:
+                self.calls.append({'api': api, 'kwargs': kwargs, 'error': e})
+            raise
+        with self.lock:
+            self.calls.append({'api': api, 'kwargs': kwargs,
+                               'result': result.copy() if isinstance(result, pd.DataFrame) else result})
+        return result
+
+    def stock_zh_a_spot_em(self):
+        return self._record('stock_zh_a_spot_em', {})
+
+    def stock_zh_a_hist(self, symbol, period='daily', start_date='19700101', end_date='20500101', adjust=''):
+        return self._record('stock_zh_a_hist', {
+            'symbol': symbol, 'period': period, 'start_date': start_date, 'end_date': end_date, 'adjust': adjust,
+        })
+
+    def save(self):
+        """写入 cassette（先写临时文件再替换），返回记录的请求数"""
+        with self.lock:
+            calls = list(self.calls)
+        cassette = {
+            'version': CASSETTE_VERSION,
+            'source': self.inner.name,
+            'recorded_at': datetime.now().isoformat(),
+            'calls': [self._picklable(call) for call in calls],
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, 'wb') as f:
+            pickle.dump(cassette, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        logger.info(f"📼 已录制 {len(calls)} 次上游请求到 {self.path}")
+        return len(calls)
+
+    @staticmethod
+    def _picklable(call):
+        """异常对象不一定能序列化，无法序列化时改记为 ConnectionError"""
+        if 'error' in call:
+            try:
+                pickle.loads(pickle.dumps(call['error']))
+            except Exception:
+                call = dict(call, error=ConnectionError(f"{type(call['error']).__name__}: {call['error']}"))
+        return call
+
+
+class ReplayProvider(MarketDataProvider):
+    """按录制顺序回放 cassette 中的响应
+
+    同一请求被录制多次（如失败后重试）时依次返回；回放次数超过录制次数时重复最后一次的响应。
+    参数完全一致的录制优先，找不到时忽略日期参数再匹配。没有录制的请求抛出 CassetteMissError。
+    """
+
+    name = 'replay'
+    remote = False
+
+    def __init__(self, path):
+        self.path = path
+        with gzip.open(path, 'rb') as f:
+            cassette = pickle.load(f)
+        if cassette.get('version') != CASSETTE_VERSION:
+            raise ValueError(f"不支持的 cassette 版本 {cassette.get('version')}: {path}")
+        self.source = cassette['source']
+        self.recorded_at = cassette['recorded_at']
+        self.lock = threading.Lock()
+        self.exact = {}
+        self.loose = {}
+        for call in cassette['calls']:
+            self.exact.setdefault(_request_key(call['api'], call['kwargs']), deque()).append(call)
+            self.loose.setdefault(_request_key(call['api'], call['kwargs'], CASSETTE_DATE_ARGS), deque()).append(call)
+        self.replayed = 0
+        self.misses = 0
+
+    def _replay(self, api, kwargs):
+        with self.lock:
+            calls = self.exact.get(_request_key(api, kwargs)) or self.loose.get(
+                _request_key(api, kwargs, CASSETTE_DATE_ARGS))
+            if not calls:
+                self.misses += 1
+                raise CassetteMissError(f"cassette 中没有 {api}({kwargs}) 的录制")
+            call = calls.popleft() if len(calls) > 1 else calls[0]
+            self.replayed += 1
+        if 'error' in call:
+            raise call['error']
+        result = call['result']
+        return result.copy() if isinstance(result, pd.DataFrame) else result
+
+    def stock_zh_a_spot_em(self):
+        return self._replay('stock_zh_a_spot_em', {})
+
+    def stock_zh_a_hist(self, symbol, period='daily', start_date='19700101', end_date='20500101', adjust=''):
+        return self._replay('stock_zh_a_hist', {
+            'symbol': symbol, 'period': period, 'start_date': start_date, 'end_date': end_date, 'adjust': adjust,
+        })
+
+
+def provider_from_spec(spec):
+    """由 STOCK_DATA_PROVIDER 格式的字符串创建数据源"""
+    kind, _, argument = (spec or DEFAULT_PROVIDER_SPEC).partition(':')
+    if kind == 'akshare':
+        return AkshareProvider()
+    if kind == 'local':
+        return LocalStoreProvider()
+    if kind == 'synthetic':
+        from synthetic_market import SyntheticMarket
+        return SyntheticMarket(int(argument) if argument else 5000)
+    if kind == 'replay':
+        return ReplayProvider(argument)
+    if kind == 'record':
+        recorder = RecordingProvider(AkshareProvider(), argument)
+        atexit.register(recorder.save)
+        return recorder
+    raise ValueError(f"未知的数据源 {spec}")
+
+
+_default_provider = None
+_default_provider_lock = threading.Lock()
+
+
+def get_default_provider():
+    """进程内共享的默认数据源，由环境变量 STOCK_DATA_PROVIDER 决定（默认 akshare）"""
+    global _default_provider
+    with _default_provider_lock:
+        if _default_provider is None:
+            _default_provider = provider_from_spec(os.environ.get(PROVIDER_ENV))
+        return _default_provider
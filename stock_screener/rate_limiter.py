@@ -0,0 +1,213 @@
+import sqlite3
+import threading
+import time
+
+# 默认的全局请求速率上限（次/秒），所有筛选线程共享
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+
+
+class TokenBucket:
+    """令牌桶限流器，线程安全
+
+    以 rate 次/秒的速度补充令牌，最多积攒 capacity 个；acquire 在令牌不足时阻塞，
+    让并发线程整体不超过设定速率，而不是每个循环各自固定 sleep。
+    """
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def acquire(self, tokens=1.0):
+        """获取令牌，必要时等待，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    self.waited_seconds += waited
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate):
+        """调整补充速率"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+    def statistics(self):
+        with self.lock:
+            return {
+                'rate_per_second': self.rate,
+                'capacity': self.capacity,
+                'total_wait_seconds': round(self.waited_seconds, 3),
+            }
+
+
+# 进程内共享的限流器
+SHARED_RATE_LIMITER = TokenBucket(DEFAULT_REQUESTS_PER_SECOND)
+
+
+class SqliteTokenBucket:
+    """多个进程共享的令牌桶，状态保存在 SQLite 文件中
+
+    接口与 TokenBucket 相同。每次 acquire 在一个写事务内补充并扣减令牌，同一文件上的
+    所有进程（分片筛选的各个 worker）整体不超过设定速率。数据库使用 WAL 模式，只能由
+    同一台主机上的进程共用，文件须在本地磁盘上，不能放在网络文件系统上跨主机共享。
+    """
+
+    def __init__(self, path, rate=DEFAULT_REQUESTS_PER_SECOND, capacity=None, name='upstream'):
+        self.path = path
+        self.name = name
+        self.lock = threading.Lock()
+        self.waited_seconds = 0.0
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS token_buckets (
+                name TEXT PRIMARY KEY,
+                rate REAL NOT NULL,
+                capacity REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        capacity = float(capacity if capacity is not None else max(1.0, rate))
+        # 最后打开的进程设定速率，已积攒的令牌保留
+        self.conn.execute(
+            'INSERT INTO token_buckets (name, rate, capacity, tokens, updated_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET rate = excluded.rate, capacity = excluded.capacity',
+            (name, float(rate), capacity, capacity, time.time())
+        )
+
+    def _transaction(self, update):
+        """在写事务内补充令牌后交给 update(速率, 令牌数) -> (返回值, 新令牌数, 新速率)"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                rate, capacity, tokens, updated_at = self.conn.execute(
+                    'SELECT rate, capacity, tokens, updated_at FROM token_buckets WHERE name = ?', (self.name,)
+                ).fetchone()
+                now = time.time()
+                tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+                result, tokens, rate = update(rate, tokens)
+                self.conn.execute('UPDATE token_buckets SET rate = ?, tokens = ?, updated_at = ? WHERE name = ?',
+                                  (rate, tokens, now, self.name))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def acquire(self, tokens=1.0):
+        """获取令牌，必要时等待，返回等待的秒数"""
+        def take(rate, available):
+            if available >= tokens:
+                return 0.0, available - tokens, rate
+            return (tokens - available) / rate, available, rate
+
+        waited = 0.0
+        while True:
+            wait = self._transaction(take)
+            if not wait:
+                with self.lock:
+                    self.waited_seconds += waited
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    @property
+    def rate(self):
+        return self._transaction(lambda rate, tokens: (rate, tokens, rate))
+
+    def set_rate(self, rate):
+        """调整补充速率，对共用该文件的所有进程生效"""
+        self._transaction(lambda _, tokens: (None, tokens, float(rate)))
+
+    def statistics(self):
+        with self.lock:
+            rate, capacity = self.conn.execute(
+                'SELECT rate, capacity FROM token_buckets WHERE name = ?', (self.name,)
+            ).fetchone()
+        return {
+            'rate_per_second': rate,
+            'capacity': capacity,
+            'total_wait_seconds': round(self.waited_seconds, 3),
+        }
+
+
+class AdaptiveRateController:
+    """AIMD 自适应限流：请求成功时线性提高速率，出错或延迟突增时按比例降低
+
+    调整结果直接写回共享令牌桶，所有线程立即生效。
+    """
+
+    def __init__(self, bucket, min_rate=1.0, max_rate=30.0, increase=0.5,
+                 decrease=0.5, latency_spike_factor=3.0, min_spike_seconds=2.0, cooldown=1.0):
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_spike_factor = latency_spike_factor
+        self.min_spike_seconds = min_spike_seconds
+        self.cooldown = cooldown
+        self.latency_ewma = None
+        self.last_decrease_at = 0.0
+        self.lock = threading.Lock()
+        self.errors = 0
+        self.latency_spikes = 0
+        self.decreases = 0
+
+    def on_success(self, latency):
+        """请求成功：延迟正常时每次成功加 increase/rate，约等于每秒加 increase"""
+        with self.lock:
+            baseline = self.latency_ewma
+            self.latency_ewma = latency if baseline is None else 0.8 * baseline + 0.2 * latency
+            if baseline is not None and latency > max(baseline * self.latency_spike_factor, self.min_spike_seconds):
+                self.latency_spikes += 1
+                self._decrease()
+                return
+            rate = self.bucket.rate
+            self.bucket.set_rate(min(self.max_rate, rate + self.increase / max(rate, 1.0)))
+
+    def on_error(self):
+        """请求失败（含限流）：乘性降低速率"""
+        with self.lock:
+            self.errors += 1
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        # 同一波失败只降一次，避免并发线程把速率连续砍到底
+        if now - self.last_decrease_at < self.cooldown:
+            return
+        self.last_decrease_at = now
+        self.decreases += 1
+        self.bucket.set_rate(max(self.min_rate, self.bucket.rate * self.decrease))
+
+    def statistics(self):
+        with self.lock:
+            return {
+                'current_rate': round(self.bucket.rate, 3),
+                'latency_ewma_seconds': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+                'errors': self.errors,
+                'latency_spikes': self.latency_spikes,
+                'rate_decreases': self.decreases,
+            }
+
+
+SHARED_RATE_CONTROLLER = AdaptiveRateController(SHARED_RATE_LIMITER)
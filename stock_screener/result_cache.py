@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认数据库位置，可通过环境变量 STOCK_RESULT_CACHE_PATH 覆盖（如 Vercel 上指向 /tmp）
+DEFAULT_RESULT_CACHE_PATH = os.environ.get(
+    'STOCK_RESULT_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'result_cache.sqlite')
+)
+
+
+def json_default(value):
+    """numpy 标量等转换为 Python 原生类型"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def criteria_key(criteria):
+    """筛选条件参数的稳定哈希"""
+    payload = json.dumps(criteria, sort_keys=True, ensure_ascii=False, default=json_default)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """已收盘交易日的筛选结果缓存（SQLite）
+
+    以 (交易日, 条件参数) 为键；同时记录计算时所用K线的指纹，条件参数或K线变化
+    （如复权数据更新）后旧结果失效。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_RESULT_CACHE_PATH
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS screening_results (
+                trade_date INTEGER NOT NULL,
+                criteria_key TEXT NOT NULL,
+                criteria TEXT NOT NULL,
+                bars_fingerprint TEXT NOT NULL,
+                results TEXT NOT NULL,
+                total_stocks INTEGER,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (trade_date, criteria_key)
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, trade_date, criteria, bars_fingerprint):
+        """命中时返回 {'results', 'total_stocks', 'created_at'}，否则返回 None"""
+        key = criteria_key(criteria)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT bars_fingerprint, results, total_stocks, created_at FROM screening_results '
+                'WHERE trade_date = ? AND criteria_key = ?',
+                (trade_date, key)
+            ).fetchone()
+            if row is not None and row[0] != bars_fingerprint:
+                logger.info(f"♻️ {trade_date} 的K线数据已变化，缓存的筛选结果失效")
+                self.conn.execute(
+                    'DELETE FROM screening_results WHERE trade_date = ? AND criteria_key = ?',
+                    (trade_date, key)
+                )
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {
+            'results': json.loads(row[1]),
+            'total_stocks': row[2],
+            'created_at': row[3],
+        }
+
+    def put(self, trade_date, criteria, bars_fingerprint, results, total_stocks=None):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO screening_results '
+                '(trade_date, criteria_key, criteria, bars_fingerprint, results, total_stocks, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    trade_date,
+                    criteria_key(criteria),
+                    json.dumps(criteria, sort_keys=True, ensure_ascii=False, default=json_default),
+                    bars_fingerprint,
+                    json.dumps(results, ensure_ascii=False, default=json_default),
+                    total_stocks,
+                    datetime.now().isoformat(),
+                )
+            )
+            self.conn.commit()
+
+    def invalidate(self, trade_date=None):
+        """删除某个交易日（不指定时为全部）的缓存结果"""
+        with self.lock:
+            if trade_date is None:
+                self.conn.execute('DELETE FROM screening_results')
+            else:
+                self.conn.execute('DELETE FROM screening_results WHERE trade_date = ?', (trade_date,))
+            self.conn.commit()
+
+    def statistics(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM screening_results').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups * 100) if lookups > 0 else 0,
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_result_cache():
+    """进程内共享的结果缓存，数据库不可用（如只读文件系统）时返回 None"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            try:
+                _shared_cache = ResultCache()
+            except Exception as e:
+                logger.warning(f"筛选结果缓存不可用: {e}")
+                return None
+        return _shared_cache
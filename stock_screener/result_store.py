@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from result_cache import json_default
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认数据库位置，可通过环境变量 STOCK_RESULT_STORE_PATH 覆盖（如 Vercel 上指向 /tmp）
+DEFAULT_RESULT_STORE_PATH = os.environ.get(
+    'STOCK_RESULT_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'result_store.sqlite')
+)
+# 结果保留时长，超过后在新建结果集时清理
+DEFAULT_RESULT_TTL = timedelta(hours=24)
+# 导出时每次从数据库读取的行数
+DEFAULT_CHUNK_ROWS = 500
+
+
+class ResultStore:
+    """服务端保存的筛选结果（SQLite）
+
+    每次筛选的结果保存在一个句柄（handle）下，分批筛选的各批依次追加；同一只股票只保留
+    一行，重试的批次不会产生重复。导出时按块读取，内存占用与结果数量无关。
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_RESULT_TTL):
+        self.path = path or DEFAULT_RESULT_STORE_PATH
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_sets (
+                handle TEXT PRIMARY KEY,
+                target_date TEXT,
+                meta TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS result_rows (
+                handle TEXT NOT NULL,
+                code TEXT NOT NULL,
+                row TEXT NOT NULL,
+                PRIMARY KEY (handle, code)
+            )
+        ''')
+        self.conn.commit()
+
+    def create(self, target_date=None, handle=None, meta=None):
+        """新建结果集并返回句柄，同时清理过期的结果集"""
+        handle = handle or uuid.uuid4().hex[:16]
+        now = datetime.now()
+        with self.lock:
+            self._purge(now - self.ttl)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO result_sets (handle, target_date, meta, created_at) VALUES (?, ?, ?, ?)',
+                (handle, target_date, json.dumps(meta or {}, ensure_ascii=False, default=json_default),
+                 now.isoformat())
+            )
+            self.conn.commit()
+        return handle
+
+    def append(self, handle, rows):
+        """追加筛选结果，句柄不存在时返回 False"""
+        with self.lock:
+            if self.conn.execute('SELECT 1 FROM result_sets WHERE handle = ?', (handle,)).fetchone() is None:
+                return False
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO result_rows (handle, code, row) VALUES (?, ?, ?)',
+                [(handle, str(row['code']), json.dumps(row, ensure_ascii=False, default=json_default))
+                 for row in rows]
+            )
+            self.conn.commit()
+        return True
+
+    def info(self, handle):
+        """结果集的日期、行数和创建时间，不存在时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT target_date, meta, created_at FROM result_sets WHERE handle = ?', (handle,)
+            ).fetchone()
+            if row is None:
+                return None
+            count = self.conn.execute('SELECT COUNT(*) FROM result_rows WHERE handle = ?', (handle,)).fetchone()[0]
+        return {
+            'handle': handle,
+            'date': row[0],
+            'meta': json.loads(row[1]),
+            'rows': count,
+            'created_at': row[2],
+        }
+
+    def iter_chunks(self, handle, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """按插入顺序逐块返回结果（每块为 dict 列表）
+
+        按 rowid 分页读取，每块单独加锁，导出期间不阻塞其他请求写入。
+        """
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    'SELECT rowid, row FROM result_rows WHERE handle = ? AND rowid > ? ORDER BY rowid LIMIT ?',
+                    (handle, last_rowid, chunk_rows)
+                ).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield [json.loads(row) for _, row in rows]
+
+    def delete(self, handle):
+        with self.lock:
+            self.conn.execute('DELETE FROM result_rows WHERE handle = ?', (handle,))
+            self.conn.execute('DELETE FROM result_sets WHERE handle = ?', (handle,))
+            self.conn.commit()
+
+    def _purge(self, before):
+        expired = [row[0] for row in self.conn.execute(
+            'SELECT handle FROM result_sets WHERE created_at < ?', (before.isoformat(),)
+        ).fetchall()]
+        for handle in expired:
+            self.conn.execute('DELETE FROM result_rows WHERE handle = ?', (handle,))
+            self.conn.execute('DELETE FROM result_sets WHERE handle = ?', (handle,))
+        if expired:
+            logger.info(f"🧹 清理 {len(expired)} 个过期的结果集")
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_shared_result_store():
+    """进程内共享的结果存储，数据库不可用（如只读文件系统）时返回 None"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            try:
+                _shared_store = ResultStore()
+            except Exception as e:
+                logger.warning(f"筛选结果存储不可用: {e}")
+                return None
+        return _shared_store
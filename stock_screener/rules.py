@@ -0,0 +1,257 @@
+import logging
+import threading
+
+import numpy as np
+
+from data_fetcher import (
+    SMALL_POSITIVE_MAX_PCT,
+    SMALL_POSITIVE_MIN_BODY_RATIO,
+    SMALL_POSITIVE_MIN_PCT,
+)
+from limit_prices import at_limit_down, at_limit_up, limit_prices, previous_close, stock_limit_ratio
+from vectorized_screener import EXTENDED_DAYS, RECENT_DAYS, small_positive_mask
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 观察到的通过率达到该样本数后替代预估值参与排序
+MIN_OBSERVATIONS = 50
+# 每判定多少次重新计算一次规则顺序
+REPLAN_INTERVAL = 256
+
+
+class CriteriaConfig:
+    """可配置的筛选阈值，默认值与 data_fetcher 中的常量一致
+
+    涨跌停按交易所规则由前收盘价精确计算（见 limit_prices），不属于可配置阈值。
+    """
+
+    def __init__(self, small_positive_min_pct=SMALL_POSITIVE_MIN_PCT,
+                 small_positive_max_pct=SMALL_POSITIVE_MAX_PCT,
+                 small_positive_min_body_ratio=SMALL_POSITIVE_MIN_BODY_RATIO):
+        self.small_positive_min_pct = float(small_positive_min_pct)
+        self.small_positive_max_pct = float(small_positive_max_pct)
+        self.small_positive_min_body_ratio = float(small_positive_min_body_ratio)
+
+    def to_dict(self):
+        return {
+            'small_positive_min_pct': self.small_positive_min_pct,
+            'small_positive_max_pct': self.small_positive_max_pct,
+            'small_positive_min_body_ratio': self.small_positive_min_body_ratio,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """由请求参数构造，忽略未知字段"""
+        known = cls().to_dict()
+        return cls(**{key: value for key, value in (data or {}).items() if key in known})
+
+
+class Rule:
+    """一条筛选条件
+
+    mask 对最后一维为时间轴、已右对齐的K线数组计算（标量判定时形状为 (K线数,)），
+    bars 含 PANEL_FIELDS、prev_close（前收盘价）及每根K线的涨停价 limit_up、跌停价
+    limit_down（预先按当日涨跌停价表的比例计算，不设限制时为 NaN）；
+    lookback 为用到的最近K线数，min_bars 为数据不足时直接判为不符合的K线数下限；
+    cost 与 selectivity（预估通过率）供规划器排序。
+    """
+
+    name = ''
+    description = ''
+    lookback = 1
+    min_bars = RECENT_DAYS
+    cost = 1.0
+    selectivity = 0.5
+
+    def mask(self, bars, config):
+        raise NotImplementedError
+
+
+class TodayNotLimitUp(Rule):
+    name = 'today_not_limit_up'
+    description = '条件1: 当天非涨停'
+    cost = 1.0
+    selectivity = 0.97
+
+    def mask(self, bars, config):
+        return ~at_limit_up(bars['close'][..., -1], bars['limit_up'][..., -1])
+
+
+class TodaySmallPositive(Rule):
+    name = 'today_small_positive'
+    description = '条件2: 当天为小阳线'
+    cost = 1.5
+    selectivity = 0.3
+
+    def mask(self, bars, config):
+        return small_positive_mask(
+            bars['open'][..., -1], bars['close'][..., -1],
+            bars['high'][..., -1], bars['low'][..., -1], config
+        )
+
+
+class VolumeShrink(Rule):
+    name = 'volume_shrink'
+    description = '条件3: 当天成交量小于昨日成交量'
+    lookback = 2
+    cost = 0.5
+    selectivity = 0.5
+
+    def mask(self, bars, config):
+        volume = bars['volume']
+        with np.errstate(invalid='ignore'):
+            return ~(volume[..., -1] >= volume[..., -2])
+
+
+class YesterdayNormal(Rule):
+    name = 'yesterday_normal'
+    description = '条件4: 昨日非跌停，昨日非涨停'
+    lookback = 2
+    cost = 1.0
+    selectivity = 0.95
+
+    def mask(self, bars, config):
+        c = bars['close'][..., -2]
+        return ~(at_limit_up(c, bars['limit_up'][..., -2]) | at_limit_down(c, bars['limit_down'][..., -2]))
+
+
+class FirstLimitUpIn3Days(Rule):
+    name = 'first_limit_up_in_3_days'
+    description = '条件5: 近3日内首次涨停（首板）'
+    lookback = 3
+    min_bars = EXTENDED_DAYS
+    cost = 2.0
+    selectivity = 0.03
+
+    def mask(self, bars, config):
+        c, up = bars['close'], bars['limit_up']
+        return (
+            at_limit_up(c[..., -1], up[..., -1])
+            & ~at_limit_up(c[..., -2], up[..., -2])
+            & ~at_limit_up(c[..., -3], up[..., -3])
+        )
+
+
+# 条件6（主板）、条件7（非ST）在获取股票列表时已过滤
+DEFAULT_RULES = (
+    TodayNotLimitUp(),
+    TodaySmallPositive(),
+    VolumeShrink(),
+    YesterdayNormal(),
+    FirstLimitUpIn3Days(),
+)
+
+
+class RulePlan:
+    """规则的执行计划
+
+    所有规则为"且"关系，按 代价 / (1 - 通过率) 从小到大执行：便宜且能排除最多股票的
+    规则先执行，任一规则不通过立即停止。通过率先用预估值，样本足够后改用实际观察值。
+    只看当天K线的规则（lookback == 1）还可以直接作用于行情快照，在请求历史数据之前
+    排除股票。
+    """
+
+    def __init__(self, rules=None, config=None):
+        self.rules = tuple(rules or DEFAULT_RULES)
+        self.config = config or CriteriaConfig()
+        self.lock = threading.Lock()
+        self.evaluated = {rule.name: 0 for rule in self.rules}
+        self.passed = {rule.name: 0 for rule in self.rules}
+        self.evaluations = 0
+        self.ordered = self._plan()
+
+    @property
+    def max_bars(self):
+        """判定所需的最多K线数，一次请求即可满足全部规则"""
+        return max(max(rule.min_bars, rule.lookback) for rule in self.rules)
+
+    @property
+    def min_bars(self):
+        return min(max(rule.min_bars, rule.lookback) for rule in self.rules)
+
+    def selectivity(self, rule):
+        evaluated = self.evaluated[rule.name]
+        if evaluated < MIN_OBSERVATIONS:
+            return rule.selectivity
+        # 拉普拉斯平滑，避免通过率为 0 或 1 时排序失效
+        return (self.passed[rule.name] + 1) / (evaluated + 2)
+
+    def _plan(self):
+        def rank(rule):
+            return rule.cost / max(1e-6, 1.0 - self.selectivity(rule))
+        return sorted(self.rules, key=rank)
+
+    def criteria(self):
+        """规则集合与阈值，作为结果缓存键的一部分"""
+        return {
+            'rules': sorted(rule.name for rule in self.rules),
+            **self.config.to_dict(),
+        }
+
+    def snapshot_mask(self, today):
+        """用当天行情对只看当天K线的规则做预筛选
+
+        today 为 PANEL_FIELDS、prev_close（昨收）及 limit_up / limit_down（取自当日
+        LimitPriceTable 的涨跌停价）的一维数组。
+        """
+        bars = {field: np.asarray(values, dtype=float)[:, None] for field, values in today.items()}
+        keep = np.ones(len(today['close']), dtype=bool)
+        for rule in self.ordered:
+            if rule.lookback == 1:
+                keep &= rule.mask(bars, self.config)
+        return keep
+
+    def evaluate(self, bars, code, ratio=None):
+        """判定单只股票，bars 为按时间排序的各字段一维数组，返回是否符合全部规则
+
+        ratio 为涨跌幅限制比例（通常取自当日 LimitPriceTable，不设限制时为 NaN），
+        省略时按代码计算；各根K线的涨跌停价只计算一次，供全部规则比较。
+        """
+        if ratio is None:
+            ratio = stock_limit_ratio(code)
+        n_bars = len(bars['close'])
+        prev_close = previous_close(bars['close'])
+        limit_up, limit_down = limit_prices(prev_close, ratio)
+        bars = dict(bars, prev_close=prev_close, limit_up=limit_up, limit_down=limit_down)
+        with self.lock:
+            ordered = self.ordered
+
+        outcomes = []
+        matched = True
+        for rule in ordered:
+            if n_bars < max(rule.min_bars, rule.lookback):
+                passed = False
+            else:
+                window = {field: values[-rule.lookback:] for field, values in bars.items()}
+                passed = bool(rule.mask(window, self.config))
+            outcomes.append((rule.name, passed))
+            if not passed:
+                matched = False
+                break
+
+        with self.lock:
+            for name, passed in outcomes:
+                self.evaluated[name] += 1
+                self.passed[name] += passed
+            self.evaluations += 1
+            if self.evaluations % REPLAN_INTERVAL == 0:
+                self.ordered = self._plan()
+        return matched
+
+    def statistics(self):
+        with self.lock:
+            return {
+                'order': [rule.name for rule in self.ordered],
+                'rules': {
+                    rule.name: {
+                        'description': rule.description,
+                        'evaluated': self.evaluated[rule.name],
+                        'passed': self.passed[rule.name],
+                        'estimated_selectivity': rule.selectivity,
+                        'selectivity': round(self.selectivity(rule), 4),
+                        'cost': rule.cost,
+                    }
+                    for rule in self.rules
+                },
+            }
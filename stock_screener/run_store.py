@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from bars import StockRow
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认数据库位置，可通过环境变量 STOCK_RUN_STORE_PATH 覆盖（多个进程共用同一文件即可互相接续）
+DEFAULT_RUN_STORE_PATH = os.environ.get(
+    'STOCK_RUN_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'run_store.sqlite')
+)
+# 运行最后一次更新后保留的时长，超过后在新建运行时清理
+DEFAULT_RUN_TTL = timedelta(days=7)
+# 其他进程持有写锁时等待的秒数
+BUSY_TIMEOUT = 30
+
+# 每只股票的判定结果 -> 数据库中的取值（NULL 表示尚未判定）
+OUTCOME_VALUES = {True: 1, False: 0, None: -1}
+STOCK_FIELDS = ('code', 'name', 'price', 'change_pct', 'volume', 'turnover', 'market_cap')
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+class RunStore:
+    """可断点续跑的筛选运行（SQLite）
+
+    新建运行时固定本次筛选的股票列表（经快照预筛选后的股票及其快照行情）、判定日期、
+    快照版本和筛选阈值；之后每判定一只股票立即写入结果。进程、实例或浏览器中断后，
+    任何能访问同一数据库的进程都可以按运行 ID 只检查尚未判定的股票，不会重新获取
+    快照，也不会重新请求已判定股票的历史数据。
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_RUN_TTL):
+        self.path = path or DEFAULT_RUN_STORE_PATH
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # WAL 模式下每次提交不必等待 fsync，逐股写入的开销可以忽略
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                target_date TEXT,
+                end_date INTEGER NOT NULL,
+                snapshot_version TEXT,
+                criteria TEXT NOT NULL,
+                max_stocks INTEGER,
+                universe_size INTEGER NOT NULL,
+                total_stocks INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS run_stocks (
+                run_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                code TEXT NOT NULL,
+                name TEXT,
+                price REAL,
+                change_pct REAL,
+                volume REAL,
+                turnover REAL,
+                market_cap REAL,
+                outcome INTEGER,
+                error TEXT,
+                checked_at TEXT,
+                PRIMARY KEY (run_id, code)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS run_stocks_position ON run_stocks (run_id, position)')
+        self.conn.commit()
+
+    def create(self, run_id, target_date, end_date, snapshot_version, criteria, stocks, universe_size,
+               max_stocks=None):
+        """新建运行并固定待检查的股票（StockRow 列表，按检查顺序），同时清理过期的运行"""
+        now = datetime.now()
+        with self.lock:
+            self._purge(now - self.ttl)
+            self.conn.execute(
+                'INSERT INTO runs (run_id, target_date, end_date, snapshot_version, criteria, max_stocks, '
+                'universe_size, total_stocks, status, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, target_date, end_date, snapshot_version, json.dumps(criteria), max_stocks,
+                 universe_size, len(stocks), 'running', now.isoformat(), now.isoformat())
+            )
+            self.conn.executemany(
+                f"INSERT INTO run_stocks (run_id, position, {', '.join(STOCK_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, position, *(getattr(stock, field) for field in STOCK_FIELDS))
+                 for position, stock in enumerate(stocks)]
+            )
+            self.conn.commit()
+        logger.info(f"📌 新建筛选运行 {run_id}: 固定 {len(stocks)}/{universe_size} 只股票")
+        return run_id
+
+    def get(self, run_id):
+        """运行的参数和进度，不存在时返回 None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT target_date, end_date, snapshot_version, criteria, max_stocks, universe_size, '
+                'total_stocks, status, created_at, updated_at FROM runs WHERE run_id = ?', (run_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = self.conn.execute(
+                'SELECT COUNT(outcome), COALESCE(SUM(outcome = 1), 0), COALESCE(SUM(outcome = -1), 0) '
+                'FROM run_stocks WHERE run_id = ?', (run_id,)
+            ).fetchone()
+        return {
+            'run_id': run_id,
+            'target_date': row[0],
+            'end_date': row[1],
+            'snapshot_version': row[2],
+            'criteria': json.loads(row[3]),
+            'max_stocks': row[4],
+            'universe_size': row[5],
+            'total_stocks': row[6],
+            'status': row[7],
+            'created_at': row[8],
+            'updated_at': row[9],
+            'processed_count': counts[0],
+            'matched_count': counts[1],
+            'unevaluated_count': counts[2],
+        }
+
+    def pending(self, run_id, limit=None, positions=None):
+        """按检查顺序返回尚未判定的股票（StockRow 列表），positions 为 (起, 止) 时只看该区间"""
+        start, end = positions or (0, -1)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(STOCK_FIELDS)} FROM run_stocks "
+                'WHERE run_id = ? AND outcome IS NULL AND position >= ? AND (? < 0 OR position < ?) '
+                'ORDER BY position LIMIT ?',
+                (run_id, start, end, end, -1 if limit is None else limit)
+            ).fetchall()
+        return [StockRow(*row) for row in rows]
+
+    def record(self, run_id, code, outcome, error=None):
+        """写入一只股票的判定结果：True 符合、False 不符合、None 未能评估"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute(
+                'UPDATE run_stocks SET outcome = ?, error = ?, checked_at = ? WHERE run_id = ? AND code = ?',
+                (OUTCOME_VALUES[outcome], error, now, run_id, code)
+            )
+            self.conn.execute('UPDATE runs SET updated_at = ? WHERE run_id = ?', (now, run_id))
+            self.conn.commit()
+
+    def results(self, run_id):
+        """已判定为符合条件的股票（结果记录），按检查顺序"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(STOCK_FIELDS)} FROM run_stocks "
+                'WHERE run_id = ? AND outcome = 1 ORDER BY position', (run_id,)
+            ).fetchall()
+        return [StockRow(*row).to_result() for row in rows]
+
+    def unevaluated(self, run_id):
+        """因数据获取失败未能评估的股票"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT code, name, error FROM run_stocks WHERE run_id = ? AND outcome = -1 ORDER BY position',
+                (run_id,)
+            ).fetchall()
+        return [{'code': code, 'name': name, 'error': error} for code, name, error in rows]
+
+    def finish(self, run_id):
+        with self.lock:
+            self.conn.execute("UPDATE runs SET status = 'completed', updated_at = ? WHERE run_id = ?",
+                              (datetime.now().isoformat(), run_id))
+            self.conn.commit()
+
+    def delete(self, run_id):
+        with self.lock:
+            self.conn.execute('DELETE FROM run_stocks WHERE run_id = ?', (run_id,))
+            self.conn.execute('DELETE FROM runs WHERE run_id = ?', (run_id,))
+            self.conn.commit()
+
+    def _purge(self, before):
+        expired = [row[0] for row in self.conn.execute(
+            'SELECT run_id FROM runs WHERE updated_at < ?', (before.isoformat(),)
+        ).fetchall()]
+        for run_id in expired:
+            self.conn.execute('DELETE FROM run_stocks WHERE run_id = ?', (run_id,))
+            self.conn.execute('DELETE FROM runs WHERE run_id = ?', (run_id,))
+        if expired:
+            logger.info(f"🧹 清理 {len(expired)} 个过期的筛选运行")
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_shared_run_store():
+    """进程内共享的运行存储，数据库不可用（如只读文件系统）时返回 None"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            try:
+                _shared_store = RunStore()
+            except Exception as e:
+                logger.warning(f"筛选运行存储不可用: {e}")
+                return None
+        return _shared_store
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+预构建的股票列表与行情快照
+部署前（或收盘后定时）运行本脚本，把主板非ST股票列表和当天行情快照写入一个未压缩的
+.npz 文件；冷启动的实例直接从磁盘读取，几毫秒即可得到快照，不必先下载全市场行情。
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from market_session import snapshot_expiry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 默认位置，可通过环境变量 STOCK_SNAPSHOT_ARTIFACT 覆盖
+DEFAULT_ARTIFACT_PATH = os.environ.get(
+    'STOCK_SNAPSHOT_ARTIFACT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'snapshot_artifact.npz')
+)
+
+ARTIFACT_VERSION = 1
+# 保存的文本列与数值列（与 stock_zh_a_spot_em 列名一致）
+TEXT_COLUMNS = ('代码', '名称')
+NUMERIC_COLUMNS = ('最新价', '涨跌幅', '涨跌额', '成交量', '成交额', '振幅', '最高', '最低', '今开', '昨收', '总市值')
+
+
+class SnapshotArtifact:
+    """从磁盘读取的快照：data 为与 get_all_stocks 格式一致的 DataFrame"""
+
+    def __init__(self, data, fetched_at, source):
+        self.data = data
+        self.fetched_at = fetched_at
+        self.source = source
+
+    @property
+    def version(self):
+        """由获取时间决定的快照版本号，不同实例读取同一份文件得到相同的版本"""
+        return f"artifact-{self.fetched_at.strftime('%Y%m%d%H%M%S')}"
+
+    def expires_at(self, intraday_ttl=30):
+        return snapshot_expiry(self.fetched_at, intraday_ttl)
+
+    def is_current(self, now=None, intraday_ttl=30):
+        """快照仍可作为实时行情使用（收盘后获取的快照有效到下次开盘）"""
+        return (now or datetime.now()) < self.expires_at(intraday_ttl)
+
+    def universe(self):
+        return self.data[list(TEXT_COLUMNS)]
+
+
+def save_artifact(snapshot, path=DEFAULT_ARTIFACT_PATH, fetched_at=None, source='akshare'):
+    """写入快照文件（先写临时文件再替换），返回写入的股票数"""
+    fetched_at = fetched_at or datetime.now()
+    arrays = {
+        f"text:{name}": np.asarray(snapshot[name].astype(str).to_numpy(), dtype=str)
+        for name in TEXT_COLUMNS
+    }
+    for name in NUMERIC_COLUMNS:
+        if name in snapshot.columns:
+            arrays[f"num:{name}"] = snapshot[name].to_numpy(dtype=np.float64, na_value=np.nan)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(
+        tmp_path,
+        meta_version=np.array(ARTIFACT_VERSION),
+        meta_fetched_at=np.array(fetched_at.isoformat()),
+        meta_source=np.array(source),
+        **arrays,
+    )
+    os.replace(tmp_path, path)
+    return len(snapshot)
+
+
+def load_artifact(path=DEFAULT_ARTIFACT_PATH):
+    """读取快照文件，不存在或版本不符时返回 None"""
+    if not path or not os.path.exists(path):
+        return None
+    import pandas as pd
+
+    with np.load(path, allow_pickle=False) as archive:
+        if int(archive['meta_version']) != ARTIFACT_VERSION:
+            logger.warning(f"快照文件版本不符，忽略: {path}")
+            return None
+        columns = {}
+        for key in archive.files:
+            kind, _, name = key.partition(':')
+            if kind in ('text', 'num'):
+                columns[name] = archive[key]
+        fetched_at = datetime.fromisoformat(str(archive['meta_fetched_at']))
+        source = str(archive['meta_source'])
+    order = [name for name in TEXT_COLUMNS + NUMERIC_COLUMNS if name in columns]
+    return SnapshotArtifact(pd.DataFrame({name: columns[name] for name in order}), fetched_at, source)
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def get_artifact(path=DEFAULT_ARTIFACT_PATH):
+    """进程内只读取一次的快照文件，读取失败时返回 None"""
+    with _loaded_lock:
+        if path not in _loaded:
+            try:
+                _loaded[path] = load_artifact(path)
+            except Exception as e:
+                logger.warning(f"读取快照文件失败: {e}")
+                _loaded[path] = None
+        return _loaded[path]
+
+
+def build_artifact(path=DEFAULT_ARTIFACT_PATH, provider=None):
+    """从数据源获取主板非ST股票列表及行情快照并写入文件"""
+    from cache import SnapshotCache
+    from data_fetcher import StockDataFetcher
+
+    fetcher = StockDataFetcher(use_history_store=False, snapshot_cache=SnapshotCache(),
+                               provider=provider, snapshot_artifact=None)
+    snapshot = fetcher.get_all_stocks()
+    if snapshot is None or len(snapshot) == 0:
+        raise RuntimeError("无法获取股票列表")
+    return save_artifact(snapshot, path, source=fetcher.provider.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='预构建股票列表与行情快照文件')
+    parser.add_argument('--output', default=DEFAULT_ARTIFACT_PATH, help='输出路径')
+    args = parser.parse_args()
+    count = build_artifact(args.output)
+    logger.info(f"✅ 已写入 {count} 只股票的快照: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
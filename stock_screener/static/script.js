@@ -1,9 +1,15 @@
 // 全局变量
 let screeningInProgress = false;
 let screeningInterval = null;
+let screeningEventSource = null;
+let currentJobId = null;  // 服务端筛选任务ID（任务模式）
+let liveEventSource = null;  // 盘中实时跟踪的连接
+let runId = null;  // 服务端逐股保存检查点的运行ID，中断后按此ID续跑
+const RUN_STORAGE_KEY = 'screeningRun';
 
 // DOM元素
 const startBtn = document.getElementById('start-screening');
+const liveBtn = document.getElementById('live-screening');
 const progressSection = document.getElementById('progress-section');
 const progressFill = document.getElementById('progress-fill');
 const progressText = document.getElementById('progress-text');
@@ -15,6 +21,7 @@ const apiStatsInfo = document.getElementById('api-stats-info');
 const resultsTableBody = document.querySelector('#results-table tbody');
 const exportExcelBtn = document.getElementById('export-excel');
 const exportCsvBtn = document.getElementById('export-csv');
+const exportParquetBtn = document.getElementById('export-parquet');
 
 // 页面加载完成后的初始化
 document.addEventListener('DOMContentLoaded', function() {
@@ -24,8 +31,10 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 绑定事件
     startBtn.addEventListener('click', startScreening);
+    liveBtn.addEventListener('click', toggleLiveScreening);
     exportExcelBtn.addEventListener('click', () => exportResults('excel'));
     exportCsvBtn.addEventListener('click', () => exportResults('csv'));
+    exportParquetBtn.addEventListener('click', () => exportResults('parquet'));
     
     // 隐藏所有结果区域
     hideAllSections();
@@ -56,6 +65,31 @@ function resetUI() {
         clearInterval(screeningInterval);
         screeningInterval = null;
     }
+    
+    if (screeningEventSource) {
+        screeningEventSource.close();
+        screeningEventSource = null;
+    }
+}
+
+// 未完成的运行保存在 localStorage 中，页面刷新或连接中断后再次筛选同一日期时续跑
+function savedRun(screeningDate) {
+    try {
+        const saved = JSON.parse(localStorage.getItem(RUN_STORAGE_KEY) || 'null');
+        return saved && saved.date === screeningDate ? saved.runId : null;
+    } catch (error) {
+        return null;
+    }
+}
+
+function rememberRun(id, screeningDate) {
+    if (id) {
+        localStorage.setItem(RUN_STORAGE_KEY, JSON.stringify({ runId: id, date: screeningDate }));
+    }
+}
+
+function forgetRun() {
+    localStorage.removeItem(RUN_STORAGE_KEY);
 }
 
 // 处理分批结果
@@ -63,9 +97,20 @@ async function handleBatchResult(result) {
     // 更新全局状态
     totalStocks = result.total_stocks;
     currentBatch++;
+    // 固定本轮筛选使用的快照版本
+    snapshotVersion = result.snapshot_version || snapshotVersion;
+    // 服务端保存本轮结果的句柄，各批追加到同一句柄下
+    resultHandle = result.result_handle || resultHandle;
+    runId = result.run_id || runId;
+    if (result.has_more) {
+        rememberRun(runId, document.getElementById('screening-date').value);
+    } else {
+        forgetRun();
+    }
     
     // 累积结果
     allResultsData = allResultsData.concat(result.results);
+    allUnevaluatedData = allUnevaluatedData.concat(result.unevaluated || []);
     
     // 更新进度
     const progress = Math.floor((result.processed_count / result.total_stocks) * 100);
@@ -110,7 +155,10 @@ async function continueNextBatch(screeningDate) {
             body: JSON.stringify({
                 date: screeningDate,
                 batch_start: currentBatch * 20,
-                batch_size: 20
+                batch_size: 20,
+                snapshot_version: snapshotVersion,
+                result_handle: resultHandle,
+                run_id: runId
             })
         });
         
@@ -123,6 +171,10 @@ async function continueNextBatch(screeningDate) {
         if (result.success && result.status === 'batch_completed') {
             handleBatchResult(result);
         } else {
+            if (result.status === 'snapshot_expired') {
+                // 固定的快照已被淘汰，下次筛选从头开始
+                forgetRun();
+            }
             showError(result.message || '批次处理失败');
             resetUI();
         }
@@ -221,6 +273,10 @@ function displayApiStats(result) {
                     <span class="api-value">🏭 AkShare</span>
                     <span class="api-label">数据提供商</span>
                 </div>
+                <div class="api-stat-item">
+                    <span class="api-value">⚠️ ${allUnevaluatedData.length}</span>
+                    <span class="api-label">未能评估股票</span>
+                </div>
             </div>
         `;
     } else {
@@ -271,6 +327,11 @@ async function startScreening() {
     allResultsData = [];
     currentBatch = 0;
     totalStocks = 0;
+    snapshotVersion = null;
+    resultHandle = null;
+    allUnevaluatedData = [];
+    currentJobId = null;
+    runId = savedRun(screeningDate);
     
     // 更新UI状态
     screeningInProgress = true;
@@ -280,9 +341,190 @@ async function startScreening() {
     // 隐藏其他区域，显示进度条
     hideAllSections();
     progressSection.style.display = 'block';
-    updateProgress(0, '正在初始化...');
+    updateProgress(0, runId ? '继续上次中断的筛选...' : '正在初始化...');
+    
+    // 优先使用流式接口，不支持时回退到分批请求
+    if (window.EventSource) {
+        startStreamScreening(screeningDate);
+    } else {
+        startBatchScreening(screeningDate);
+    }
+}
+
+// 流式筛选：一个连接内接收全部进度和结果
+function startStreamScreening(screeningDate) {
+    let started = false;
+    let processedCount = 0;
+    let lastRender = 0;
+    const runParam = runId ? `&run_id=${encodeURIComponent(runId)}` : '';
+    const source = new EventSource(`/screen/stream?date=${encodeURIComponent(screeningDate)}${runParam}`);
+    screeningEventSource = source;
+    
+    source.addEventListener('start', (e) => {
+        const data = JSON.parse(e.data);
+        started = true;
+        totalStocks = data.total_stocks;
+        snapshotVersion = data.snapshot_version;
+        resultHandle = data.result_handle || null;
+        // 续跑时服务端随后重放已判定的结果
+        processedCount = data.processed_count || 0;
+        runId = data.run_id || null;
+        rememberRun(runId, screeningDate);
+        hideAllSections();
+        resultsSection.style.display = 'block';
+        progressSection.style.display = 'block';
+        displayBatchResults(allResultsData, {
+            total_count: 0,
+            processed_stocks: processedCount,
+            total_stocks: totalStocks
+        });
+    });
+    
+    source.addEventListener('match', (e) => {
+        allResultsData.push(JSON.parse(e.data));
+        displayBatchResults(allResultsData, {
+            total_count: allResultsData.length,
+            processed_stocks: processedCount,
+            total_stocks: totalStocks
+        });
+    });
+    
+    source.addEventListener('unevaluated', (e) => {
+        allUnevaluatedData.push(JSON.parse(e.data));
+    });
+    
+    source.addEventListener('progress', (e) => {
+        const data = JSON.parse(e.data);
+        processedCount = data.processed_count;
+        const progress = data.total_stocks > 0 ? Math.floor((processedCount / data.total_stocks) * 100) : 100;
+        updateProgress(progress, `正在分析: ${data.current} - ${processedCount}/${data.total_stocks}，找到 ${data.matched_count} 只`);
+        
+        // 摘要区域限制刷新频率，避免每只股票都重绘
+        const now = Date.now();
+        if (now - lastRender > 500) {
+            lastRender = now;
+            displayBatchSummary({
+                total_count: allResultsData.length,
+                processed_stocks: processedCount,
+                total_stocks: data.total_stocks
+            });
+        }
+    });
+    
+    source.addEventListener('done', (e) => {
+        const data = JSON.parse(e.data);
+        source.close();
+        screeningEventSource = null;
+        forgetRun();
+        updateProgress(100, `筛选完成！共查询 ${data.processed_count} 只股票，找到 ${allResultsData.length} 只符合条件的股票`);
+        hideAllSections();
+        resultsSection.style.display = 'block';
+        displayBatchResults(allResultsData, calculateFinalSummary(allResultsData), data);
+        resetUI();
+    });
+    
+    source.addEventListener('error', (e) => {
+        source.close();
+        screeningEventSource = null;
+        if (e.data) {
+            showError(JSON.parse(e.data).message || '筛选失败');
+        } else if (!started) {
+            // 服务端不支持流式接口（如部署平台不支持长连接），回退到分批请求
+            console.warn('流式接口不可用，改用分批筛选');
+            startBatchScreening(screeningDate);
+        } else {
+            showError(runId ? '连接中断，再次点击开始筛选将从中断处继续' : '连接中断，请重试');
+        }
+    });
+}
+
+// 盘中实时跟踪：服务端按快照变化增量判定，推送命中集合的增减
+function toggleLiveScreening() {
+    if (liveEventSource) {
+        liveEventSource.close();
+        liveEventSource = null;
+        liveBtn.textContent = '盘中实时跟踪';
+        return;
+    }
+    if (!window.EventSource) {
+        showNotification('浏览器不支持实时推送', 'error');
+        return;
+    }
+    
+    const liveMatches = new Map();
+    const render = (tick) => {
+        allResultsData = Array.from(liveMatches.values());
+        displayBatchResults(allResultsData, {
+            total_count: allResultsData.length,
+            processed_stocks: tick ? tick.changed : 0,
+            total_stocks: totalStocks
+        });
+    };
+    
+    resultHandle = null;
+    liveBtn.textContent = '停止实时跟踪';
+    hideAllSections();
+    resultsSection.style.display = 'block';
+    progressSection.style.display = 'block';
+    updateProgress(0, '正在连接实时跟踪...');
+    
+    const source = new EventSource('/screen/live');
+    liveEventSource = source;
     
+    source.addEventListener('start', (e) => {
+        const data = JSON.parse(e.data);
+        liveMatches.clear();
+        data.matches.forEach(stock => liveMatches.set(stock.code, stock));
+        render(null);
+    });
+    source.addEventListener('add', (e) => {
+        const stock = JSON.parse(e.data);
+        liveMatches.set(stock.code, stock);
+    });
+    source.addEventListener('update', (e) => {
+        const stock = JSON.parse(e.data);
+        liveMatches.set(stock.code, stock);
+    });
+    source.addEventListener('remove', (e) => {
+        liveMatches.delete(JSON.parse(e.data).code);
+    });
+    // 每轮刷新以 tick 结束，此时统一重绘
+    source.addEventListener('tick', (e) => {
+        const tick = JSON.parse(e.data);
+        updateProgress(100, `实时跟踪中: ${new Date(tick.timestamp).toLocaleTimeString()} 刷新，${tick.changed} 只股票变化，当前 ${tick.matched_count} 只符合条件`);
+        render(tick);
+    });
+    source.addEventListener('error', (e) => {
+        if (e.data) {
+            updateProgress(100, JSON.parse(e.data).message || '实时跟踪出错，等待下一轮刷新');
+        }
+    });
+}
+
+// 续跑时先取回运行中已判定的结果，运行不存在或已完成时重新开始
+async function loadRunProgress() {
     try {
+        const response = await fetch(`/runs/${encodeURIComponent(runId)}`);
+        const data = await response.json();
+        if (data.success && data.status !== 'completed') {
+            allResultsData = data.results;
+            allUnevaluatedData = data.unevaluated;
+            return;
+        }
+    } catch (error) {
+        console.warn('获取运行进度失败，重新开始筛选:', error);
+    }
+    runId = null;
+    forgetRun();
+}
+
+// 分批筛选：每批一个请求
+async function startBatchScreening(screeningDate) {
+    try {
+        if (runId) {
+            await loadRunProgress();
+        }
+        
         // 发送筛选请求
         const response = await fetch('/screen', {
             method: 'POST',
@@ -292,7 +534,8 @@ async function startScreening() {
             body: JSON.stringify({
                 date: screeningDate,
                 batch_start: currentBatch * 20,
-                batch_size: 20
+                batch_size: 20,
+                run_id: runId
             })
         });
         
@@ -306,8 +549,16 @@ async function startScreening() {
             if (result.status === 'batch_completed') {
                 // 处理分批结果
                 handleBatchResult(result);
+            } else if (result.status === 'started') {
+                // 服务端后台任务，按任务ID轮询进度
+                currentJobId = result.job_id;
+                runId = result.run_id || null;
+                rememberRun(runId, screeningDate);
+                updateProgress(0, result.message);
+                pollProgress();
             } else if (result.status === 'completed') {
                 // 兼容旧版本完整结果
+                resultHandle = result.result_handle || null;
                 updateProgress(100, result.message);
                 displayResults(result.results, result.summary);
                 hideAllSections();
@@ -330,13 +581,15 @@ async function startScreening() {
 function pollProgress() {
     screeningInterval = setInterval(async () => {
         try {
-            const response = await fetch('/progress');
+            const response = await fetch(`/progress?job_id=${encodeURIComponent(currentJobId || '')}`);
             const data = await response.json();
             
             if (data.status === 'running') {
                 updateProgress(data.progress, data.message);
             } else if (data.status === 'completed') {
                 // 筛选完成，获取结果
+                resultHandle = data.result_handle || null;
+                forgetRun();
                 clearInterval(screeningInterval);
                 screeningInterval = null;
                 await loadResults();
@@ -361,7 +614,7 @@ function updateProgress(percentage, message) {
 // 加载筛选结果
 async function loadResults() {
     try {
-        const response = await fetch('/results');
+        const response = await fetch(`/results?job_id=${encodeURIComponent(currentJobId || '')}`);
         const data = await response.json();
         
         if (data.success) {
@@ -385,6 +638,9 @@ let currentResultsData = [];
 let allResultsData = [];  // 存储所有批次的结果
 let currentBatch = 0;
 let totalStocks = 0;
+let snapshotVersion = null;  // 本轮筛选固定的快照版本
+let resultHandle = null;  // 服务端保存本轮结果的句柄，导出时使用
+let allUnevaluatedData = [];  // 数据获取失败、未能评估的股票
 
 // 显示筛选结果
 function displayResults(results, summary) {
@@ -462,19 +718,54 @@ function createResultRow(stock) {
     return row;
 }
 
+// 文件扩展名
+const EXPORT_EXTENSIONS = { excel: 'xlsx', csv: 'csv', parquet: 'parquet', arrow: 'arrow' };
+
+// 查询服务端保存的结果：完整（行数不少于页面上的结果）时返回可用的导出格式，否则返回 null
+async function serverExportFormats(handle, expectedRows) {
+    try {
+        const response = await fetch(`/results/${encodeURIComponent(handle)}`);
+        if (!response.ok) return null;
+        const info = await response.json();
+        return info.success && info.rows >= expectedRows ? (info.formats || []) : null;
+    } catch (error) {
+        return null;
+    }
+}
+
 // 导出结果
 async function exportResults(format) {
     try {
         // 获取当前显示的结果数据
         const currentResults = getCurrentResults();
         
+        // 服务端保存了完整结果时直接由浏览器下载流式导出的文件，不必上传结果
+        if (resultHandle) {
+            const formats = await serverExportFormats(resultHandle, currentResults.length);
+            if (formats && !formats.includes(format)) {
+                showNotification(`服务器不支持导出${format.toUpperCase()}`, 'error');
+                return;
+            }
+            if (formats) {
+                const a = document.createElement('a');
+                a.style.display = 'none';
+                a.href = `/export/${format}?result_handle=${encodeURIComponent(resultHandle)}`;
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
+                showNotification(`${format.toUpperCase()}文件开始下载`);
+                return;
+            }
+        }
+        
         const response = await fetch(`/export/${format}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                results: currentResults
+                results: currentResults,
+                job_id: currentJobId
             })
         });
         
@@ -487,7 +778,7 @@ async function exportResults(format) {
             
             // 设置文件名
             const timestamp = new Date().toISOString().slice(0, 19).replace(/[-:]/g, '').replace('T', '_');
-            const extension = format === 'excel' ? 'xlsx' : 'csv';
+            const extension = EXPORT_EXTENSIONS[format] || format;
             a.download = `rescue_stocks_${timestamp}.${extension}`;
             
             document.body.appendChild(a);
@@ -1,98 +1,275 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
+import threading
 import time
-from data_fetcher import StockDataFetcher
+import queue
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from bars import StockRow
+from data_fetcher import DataFetchError, SnapshotExpiredError, StockDataFetcher
+from exporters import write_export
+from limit_prices import stock_limit_ratio, table_for_snapshot
+from metrics import (
+    CACHE_REQUESTS,
+    SCREENING_RUNS_IN_PROGRESS,
+    SCREENING_THROUGHPUT,
+    STOCK_CHECK_LATENCY,
+    STOCKS_SCREENED,
+)
+from market_session import last_closed_date, shift_date_int, to_date_int
+from profiler import RunProfiler, resolve_mode
+from result_cache import get_shared_result_cache, json_default
+from rules import CriteriaConfig, RulePlan
+from run_store import get_shared_run_store
+from vectorized_screener import screen_panel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 并发检查股票的线程数，实际请求速率由 data_fetcher 的全局令牌桶控制
+DEFAULT_MAX_WORKERS = 8
+
+# 筛选判定逻辑的版本，逻辑变化时递增以使缓存的结果失效
+CRITERIA_VERSION = 4
+
+# 规则使用的当天K线字段：规则字段 -> 行情快照列名
+SNAPSHOT_COLUMNS = {
+    'open': '今开', 'high': '最高', 'low': '最低', 'close': '最新价', 'volume': '成交量', 'prev_close': '昨收',
+}
+
+def snapshot_today_bars(all_stocks, table=None):
+    """行情快照中的当天K线：规则字段 -> float64 数组（缺失的列为 NaN）
+
+    指定 table（与快照逐行对应的 LimitPriceTable）时另附当天的涨停价 limit_up、跌停价 limit_down。
+    """
+    def column(name):
+        if name not in all_stocks.columns:
+            return np.full(len(all_stocks), np.nan)
+        return pd.to_numeric(all_stocks[name], errors='coerce').to_numpy(dtype=float)
+    today = {field: column(name) for field, name in SNAPSHOT_COLUMNS.items()}
+    if table is not None:
+        today['limit_up'], today['limit_down'] = table.up, table.down
+    return today
+
+def screening_criteria(rule_plan=None, **params):
+    """当前的筛选条件参数（规则、阈值 + 调用参数），作为结果缓存键的一部分"""
+    rule_plan = rule_plan or RulePlan()
+    return {
+        'version': CRITERIA_VERSION,
+        **rule_plan.criteria(),
+        **params,
+    }
+
 class StockScreener:
-    def __init__(self):
-        self.data_fetcher = StockDataFetcher()
+    def __init__(self, use_snapshot_prefilter=True, max_workers=DEFAULT_MAX_WORKERS,
+                 result_cache=None, use_result_cache=True, criteria_config=None, rules=None,
+                 profile=None, provider=None, run_store=None):
+        # provider 为行情数据源（见 providers），默认由环境变量 STOCK_DATA_PROVIDER 决定
+        self.data_fetcher = StockDataFetcher(provider=provider)
+        self.use_snapshot_prefilter = use_snapshot_prefilter
+        # 本轮筛选所用快照的涨跌停价表，判定历史K线时按代码查涨跌幅限制比例
+        self.limit_table = None
+        self.max_workers = max_workers
+        self.rule_plan = RulePlan(rules, criteria_config)
+        self.result_cache = result_cache
+        if self.result_cache is None and use_result_cache:
+            self.result_cache = get_shared_result_cache()
+        # 断点续跑的运行存储（见 run_store），未指定时在首次使用时打开共享存储
+        self.run_store = run_store
+        self.last_result_cached = False
+        self.batch_next_start = None
+        self.counter_lock = threading.Lock()
         self.screening_results = []
+        self.unevaluated_stocks = []
         self.processed_stocks_count = 0
         self.screening_start_time = None
         self.screening_end_time = None
+        # 性能分析：profile 为默认模式（None 时由环境变量 STOCK_PROFILE 决定）
+        self.profile = profile
+        self.profiler = None
+        self.last_profile = None
         
-    def screen_rescue_stocks(self, target_date=None, progress_callback=None, max_stocks=100):
-        """筛选可以自救的股票"""
+    @contextmanager
+    def _profiling(self, profile, label, resume=False):
+        """按需开启一段性能分析，结束后摘要保存在 self.last_profile
+
+        resume 为 True 时沿用上一段的 RunProfiler（分批筛选的后续批次）。
+        """
+        mode = resolve_mode(self.profile if profile is None else profile)
+        if mode is None:
+            self.profiler = None
+            yield None
+            return
+        if not resume or self.profiler is None or self.profiler.mode != mode:
+            self.profiler = RunProfiler(mode, label=label)
+        rate_limiter = self.data_fetcher.rate_limiter
+        waited_before = rate_limiter.waited_seconds
+        self.profiler.start()
+        try:
+            yield self.profiler
+        finally:
+            # 令牌桶为进程共享，并发筛选时等待时间会互相计入
+            self.profiler.add_stage('throttle_wait', rate_limiter.waited_seconds - waited_before, count=0)
+            self.last_profile = self.profiler.stop()
+            stages = ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in self.last_profile['stages'].items())
+            logger.info(f"⏱️ 性能分析 ({mode}): 总计 {self.last_profile['wall_seconds']:.2f}s，{stages}")
+    
+    def _stage(self, name):
+        """性能分析开启时计时的代码段"""
+        profiler = self.profiler
+        return profiler.stage(name) if profiler is not None else nullcontext()
+        
+    def screen_rescue_stocks(self, target_date=None, progress_callback=None, max_stocks=100, profile=None,
+                             run_id=None):
+        """筛选可以自救的股票
+
+        profile 为 True 或 profiler.PROFILE_MODES 中的模式时记录分阶段和逐股耗时。
+        指定 run_id 时逐股保存检查点：运行已存在则只检查其中尚未判定的股票（断点续跑）。
+        """
+        with self._profiling(profile, 'screen') as profiler:
+            results = self._screen_rescue_stocks(target_date, progress_callback, max_stocks, run_id)
+            if profiler is not None:
+                with profiler.stage('json_serialize'):
+                    json.dumps(results, ensure_ascii=False, default=json_default)
+        return results
+    
+    def _screen_rescue_stocks(self, target_date, progress_callback, max_stocks, run_id=None):
         if target_date is None:
             target_date = datetime.now().strftime("%Y-%m-%d")
             
         logger.info(f"开始筛选 {target_date} 的自救股票...")
+        self.unevaluated_stocks = []
+        run_store = self._get_run_store() if run_id else None
         
-        # 获取所有股票
-        all_stocks = self.data_fetcher.get_all_stocks()
+        if run_store is None or run_store.get(run_id) is None:
+            with self._stage('result_cache'):
+                cached = self.get_cached_results(target_date, max_stocks=max_stocks)
+            if cached is not None:
+                if progress_callback:
+                    progress_callback(100, "使用已缓存的筛选结果")
+                return cached['results']
+        if run_store is not None:
+            return self._screen_run(run_id, target_date, progress_callback, max_stocks)
+        
+        # 获取所有股票（历史日期使用由本地数据构造的当日快照）
+        as_of = self._resolve_as_of(target_date)
+        with self._stage('snapshot'):
+            all_stocks = self._get_universe(as_of)
         if all_stocks is None or len(all_stocks) == 0:
             logger.error("无法获取股票数据")
             return []
+        with self._stage('prefilter'):
+            all_stocks = self.prefilter_snapshot(all_stocks, as_of)
             
-        total_stocks = min(len(all_stocks), max_stocks)
-        logger.info(f"共需要筛选 {total_stocks} 只股票 (限制为前{max_stocks}只)")
-        
-        rescue_stocks = []
-        processed_count = 0
-        
-        # 限制处理的股票数量以避免超时
-        limited_stocks = all_stocks.head(max_stocks)
+        # 限制处理的股票数量以避免超时，max_stocks 为 None 时筛选全部股票
+        if max_stocks is None:
+            limited_stocks = all_stocks
+            logger.info(f"共需要筛选 {len(all_stocks)} 只股票 (不限数量)")
+        else:
+            limited_stocks = all_stocks.head(max_stocks)
+            logger.info(f"共需要筛选 {len(limited_stocks)} 只股票 (限制为前{max_stocks}只)")
+        total_stocks = len(limited_stocks)
         
-        for index, stock in limited_stocks.iterrows():
-            processed_count += 1
-            stock_code = stock['代码']
-            stock_name = stock['名称']
-            
+        def on_checked(processed_count, stock, matched_count, outcome):
             # 报告进度
             if progress_callback:
                 progress = int((processed_count / total_stocks) * 100)
-                progress_callback(progress, f"正在分析: {stock_name}({stock_code})")
-            
-            # 执行筛选逻辑
-            if self.check_rescue_criteria(stock, stock_code):
-                rescue_stocks.append({
-                    'code': stock_code,
-                    'name': stock_name,
-                    'current_price': stock.get('最新价', 0),
-                    'change_pct': stock.get('涨跌幅', 0),
-                    'volume': stock.get('成交量', 0),
-                    'turnover': stock.get('成交额', 0),
-                    'market_cap': stock.get('总市值', 0)
-                })
+                progress_callback(progress, f"正在分析: {stock.name}({stock.code})")
             
-            # 每处理5只股票增加小延迟，降低请求频率
-            if processed_count % 5 == 0:
-                time.sleep(0.1)  # 100ms延迟
-                
             # 每处理10只股票记录一次进度
             if processed_count % 10 == 0:
-                logger.info(f"已处理 {processed_count}/{total_stocks} 只股票，找到 {len(rescue_stocks)} 只符合条件的股票")
+                logger.info(f"已处理 {processed_count}/{total_stocks} 只股票，找到 {matched_count} 只符合条件的股票")
         
-        logger.info(f"筛选完成！共找到 {len(rescue_stocks)} 只符合自救条件的股票")
+        rescue_stocks = [
+            self._build_result_row(stock)
+            for stock, matched in self._check_stocks(limited_stocks, on_checked, as_of) if matched
+        ]
+        
+        with self._stage('flush_history'):
+            self.data_fetcher.flush_history_store()
+        logger.info(f"筛选完成！共找到 {len(rescue_stocks)} 只符合自救条件的股票，{len(self.unevaluated_stocks)} 只因数据获取失败未能评估")
         self.screening_results = rescue_stocks
+        with self._stage('save_result_cache'):
+            self._save_cached_results(target_date, rescue_stocks, total_stocks, max_stocks=max_stocks)
         return rescue_stocks
     
-    def screen_rescue_stocks_batch(self, target_date=None, batch_start=0, batch_size=20):
-        """分批筛选可以自救的股票"""
+    def screen_rescue_stocks_batch(self, target_date=None, batch_start=0, batch_size=20, snapshot_version=None,
+                                   profile=None, run_id=None):
+        """分批筛选可以自救的股票
+
+        第一批返回的 snapshot_version 需在后续批次中传回，保证整轮筛选使用同一份股票列表；
+        该版本已被淘汰时返回的响应带有 error 和 snapshot_expired，需从第0批重新开始。
+        开启 profile 时各批次的耗时累计到同一份分析中，摘要随每批结果返回。
+        指定 run_id 时股票列表和每只股票的结果保存在运行存储中，batch_start 被忽略：每批
+        检查该运行中尚未判定的前 batch_size 只股票，任何实例都可以接着处理下一批。
+        """
+        with self._profiling(profile, 'batch', resume=batch_start > 0 or run_id is not None) as profiler:
+            try:
+                if run_id and self._get_run_store() is not None:
+                    response = self._screen_run_batch(run_id, target_date, batch_size, snapshot_version)
+                else:
+                    response = self._screen_rescue_stocks_batch(target_date, batch_start, batch_size, snapshot_version)
+            except SnapshotExpiredError as e:
+                response = {
+                    'results': [],
+                    'total_stocks': 0,
+                    'processed_count': 0,
+                    'has_more': False,
+                    'unevaluated': [],
+                    'snapshot_version': None,
+                    'run_id': None,
+                    'error': str(e),
+                    'snapshot_expired': True
+                }
+            if profiler is not None:
+                with profiler.stage('json_serialize'):
+                    json.dumps(response, ensure_ascii=False, default=json_default)
+        if profiler is not None:
+            response['profile'] = self.last_profile
+        return response
+    
+    def _screen_rescue_stocks_batch(self, target_date, batch_start, batch_size, snapshot_version):
         if target_date is None:
             target_date = datetime.now().strftime("%Y-%m-%d")
         
         # 记录筛选开始时间
         if batch_start == 0:
             self.screening_start_time = datetime.now()
+            self.unevaluated_stocks = []
+            self.screening_results = []
+            self.batch_next_start = 0
+            
+            with self._stage('result_cache'):
+                cached = self.get_cached_results(target_date, max_stocks=None) if snapshot_version is None else None
+            if cached is not None:
+                return self._cached_batch_response(cached)
+        # 只有从第0批起连续处理的整轮筛选才会写入结果缓存
+        if batch_start != self.batch_next_start:
+            self.batch_next_start = None
+        unevaluated_before = len(self.unevaluated_stocks)
             
         logger.info(f"🚀 开始分批筛选 {target_date} 的自救股票，批次 {batch_start}-{batch_start + batch_size}...")
         logger.info(f"📊 当前API统计: {self.data_fetcher.get_api_statistics()}")
         
-        # 获取所有股票
-        all_stocks = self.data_fetcher.get_all_stocks()
+        # 获取所有股票（固定在本轮筛选的快照版本上）
+        as_of = self._resolve_as_of(target_date)
+        with self._stage('snapshot'):
+            all_stocks = self._get_universe(as_of, snapshot_version)
         if all_stocks is None or len(all_stocks) == 0:
             logger.error("无法获取股票数据")
             return {
                 'results': [],
                 'total_stocks': 0,
                 'processed_count': 0,
-                'has_more': False
+                'has_more': False,
+                'unevaluated': [],
+                'snapshot_version': None
             }
+        with self._stage('prefilter'):
+            all_stocks = self.prefilter_snapshot(all_stocks, as_of)
             
         total_stocks = len(all_stocks)
         logger.info(f"总共有 {total_stocks} 只股票需要筛选")
@@ -103,116 +280,613 @@ class StockScreener:
         
         logger.info(f"当前批次处理 {len(batch_stocks)} 只股票 ({batch_start}-{batch_end})")
         
-        rescue_stocks = []
-        processed_count = batch_start
+        def on_checked(checked_count, stock, matched_count, outcome):
+            logger.info(f"已分析: {stock.name}({stock.code}) - {batch_start + checked_count}/{total_stocks}")
         
-        for index, stock in batch_stocks.iterrows():
-            processed_count += 1
-            stock_code = stock['代码']
-            stock_name = stock['名称']
-            
-            logger.info(f"正在分析: {stock_name}({stock_code}) - {processed_count}/{total_stocks}")
-            
-            # 执行筛选逻辑
-            self.processed_stocks_count += 1
-            if self.check_rescue_criteria(stock, stock_code):
-                rescue_stocks.append({
-                    'code': stock_code,
-                    'name': stock_name,
-                    'current_price': stock.get('最新价', 0),
-                    'change_pct': stock.get('涨跌幅', 0),
-                    'volume': stock.get('成交量', 0),
-                    'turnover': stock.get('成交额', 0),
-                    'market_cap': stock.get('总市值', 0)
-                })
-            
-            # 每处理2只股票增加延迟，降低请求频率
-            if (processed_count - batch_start) % 2 == 0:
-                time.sleep(0.2)  # 200ms延迟
+        rescue_stocks = [
+            self._build_result_row(stock)
+            for stock, matched in self._check_stocks(batch_stocks, on_checked, as_of) if matched
+        ]
+        processed_count = batch_end
+        self.screening_results.extend(rescue_stocks)
+        if self.batch_next_start is not None:
+            self.batch_next_start = batch_end
         
         has_more = batch_end < total_stocks
+        with self._stage('flush_history'):
+            self.data_fetcher.flush_history_store()
         
         # 记录筛选结束时间
         if not has_more:
             self.screening_end_time = datetime.now()
+            if self.batch_next_start == total_stocks:
+                with self._stage('save_result_cache'):
+                    self._save_cached_results(target_date, self.screening_results, total_stocks, max_stocks=None)
         
         # 获取API统计信息
         api_stats = self.data_fetcher.get_api_statistics()
         
-        logger.info(f"✅ 批次筛选完成！本批次找到 {len(rescue_stocks)} 只符合自救条件的股票")
+        batch_unevaluated = self.unevaluated_stocks[unevaluated_before:]
+        logger.info(f"✅ 批次筛选完成！本批次找到 {len(rescue_stocks)} 只符合自救条件的股票，{len(batch_unevaluated)} 只未能评估")
         logger.info(f"📊 API调用统计: 总计{api_stats['total_calls']}次，成功{api_stats['successful_calls']}次，失败{api_stats['failed_calls']}次")
         
         return {
             'results': rescue_stocks,
+            'unevaluated': batch_unevaluated,
+            'total_stocks': total_stocks,
+            'processed_count': processed_count,
+            'has_more': has_more,
+            'snapshot_version': self.data_fetcher.snapshot_version,
+            'cached': False,
+            'api_calls_made': api_stats['total_calls'],
+            'api_success_rate': api_stats['success_rate'],
+            'verification_info': {
+                'data_source': self.data_fetcher.provider.name,
+                'real_data_confirmed': api_stats['data_source_verified'],
+                'processing_timestamp': datetime.now().isoformat(),
+                'api_statistics': api_stats
+            }
+        }
+    
+    def _get_run_store(self):
+        if self.run_store is None:
+            self.run_store = get_shared_run_store()
+        return self.run_store
+    
+    def open_run(self, run_id, target_date, snapshot_version=None, max_stocks=None):
+        """打开断点续跑的运行，不存在时获取股票列表、预筛选后固定下来新建
+
+        已有的运行沿用其固定的阈值（可能由其他进程以不同的阈值新建）。
+        无法获取股票数据或运行存储不可用时返回 None。
+        """
+        if self._get_run_store() is None:
+            return None
+        run = self.run_store.get(run_id)
+        if run is not None:
+            # 续跑不重新获取快照，涨跌幅限制比例按股票代码和名称计算
+            self.limit_table = None
+            if run['criteria'] != self.rule_plan.config.to_dict():
+                self.rule_plan = RulePlan(self.rule_plan.rules, CriteriaConfig.from_dict(run['criteria']))
+            logger.info(f"▶️ 继续筛选运行 {run_id}: 已判定 {run['processed_count']}/{run['total_stocks']} 只股票")
+            return run
+        
+        as_of = self._resolve_as_of(target_date)
+        with self._stage('snapshot'):
+            all_stocks = self._get_universe(as_of, snapshot_version)
+        if all_stocks is None or len(all_stocks) == 0:
+            logger.error("无法获取股票数据")
+            return None
+        universe_size = len(all_stocks)
+        with self._stage('prefilter'):
+            all_stocks = self.prefilter_snapshot(all_stocks, as_of)
+        if max_stocks is not None:
+            all_stocks = all_stocks.head(max_stocks)
+        with self._stage('rows'):
+            stocks = StockRow.from_snapshot(all_stocks)
+        # 实时筛选也固定判定日期，次日续跑时仍使用同一个K线窗口
+        self.run_store.create(
+            run_id, target_date, as_of or to_date_int(datetime.now()),
+            self.data_fetcher.snapshot_version if as_of is None else None,
+            self.rule_plan.config.to_dict(), stocks, universe_size, max_stocks
+        )
+        return self.run_store.get(run_id)
+    
+    def check_run_stocks(self, run, stocks, on_checked=None, stop_event=None):
+        """检查运行中尚未判定的股票，每只股票判定后立即写入运行存储"""
+        def record(checked_count, stock, matched_count, outcome):
+            error = self.unevaluated_stocks[-1]['error'] if outcome is None else None
+            self.run_store.record(run['run_id'], stock.code, outcome, error)
+            if on_checked:
+                on_checked(checked_count, stock, matched_count, outcome)
+        return self._check_stocks(stocks, record, run['end_date'], stop_event)
+    
+    def finish_run(self, run):
+        """全部股票判定完成：结束运行，完整结果（含之前各次判定的股票）取自运行存储"""
+        run_id = run['run_id']
+        with self._stage('flush_history'):
+            self.data_fetcher.flush_history_store()
+        self.run_store.finish(run_id)
+        self.screening_results = self.run_store.results(run_id)
+        self.unevaluated_stocks = self.run_store.unevaluated(run_id)
+        self.screening_end_time = datetime.now()
+        with self._stage('save_result_cache'):
+            self._save_cached_results(run['target_date'], self.screening_results, run['total_stocks'],
+                                      max_stocks=run['max_stocks'])
+        logger.info(f"✅ 筛选运行 {run_id} 完成！共找到 {len(self.screening_results)} 只符合自救条件的股票，"
+                    f"{len(self.unevaluated_stocks)} 只未能评估")
+        return self.screening_results
+    
+    def _screen_run(self, run_id, target_date, progress_callback, max_stocks):
+        run = self.open_run(run_id, target_date, max_stocks=max_stocks)
+        if run is None:
+            return []
+        stocks = self.run_store.pending(run_id)
+        total_stocks = run['total_stocks']
+        logger.info(f"共需要筛选 {len(stocks)}/{total_stocks} 只股票 (运行 {run_id})")
+        
+        def on_checked(checked_count, stock, matched_count, outcome):
+            processed_count = run['processed_count'] + checked_count
+            if progress_callback:
+                progress_callback(int(processed_count / total_stocks * 100), f"正在分析: {stock.name}({stock.code})")
+            if processed_count % 10 == 0:
+                logger.info(f"已处理 {processed_count}/{total_stocks} 只股票")
+        
+        self.check_run_stocks(run, stocks, on_checked)
+        return self.finish_run(run)
+    
+    def _screen_run_batch(self, run_id, target_date, batch_size, snapshot_version):
+        if target_date is None:
+            target_date = datetime.now().strftime("%Y-%m-%d")
+        self.unevaluated_stocks = []
+        
+        if self.run_store.get(run_id) is None:
+            self.screening_start_time = datetime.now()
+            self.screening_results = []
+            if snapshot_version is None:
+                with self._stage('result_cache'):
+                    cached = self.get_cached_results(target_date, max_stocks=None)
+                if cached is not None:
+                    return self._cached_batch_response(cached)
+        run = self.open_run(run_id, target_date, snapshot_version)
+        if run is None:
+            return {
+                'results': [],
+                'total_stocks': 0,
+                'processed_count': 0,
+                'has_more': False,
+                'unevaluated': [],
+                'snapshot_version': None,
+                'run_id': None
+            }
+        
+        total_stocks = run['total_stocks']
+        stocks = self.run_store.pending(run_id, batch_size)
+        logger.info(f"🚀 筛选运行 {run_id} 的下一批 {len(stocks)} 只股票（已判定 {run['processed_count']}/{total_stocks}）")
+        
+        def on_checked(checked_count, stock, matched_count, outcome):
+            logger.info(f"已分析: {stock.name}({stock.code}) - {run['processed_count'] + checked_count}/{total_stocks}")
+        
+        rescue_stocks = [
+            self._build_result_row(stock)
+            for stock, matched in self.check_run_stocks(run, stocks, on_checked) if matched
+        ]
+        self.screening_results.extend(rescue_stocks)
+        batch_unevaluated = list(self.unevaluated_stocks)
+        processed_count = self.run_store.get(run_id)['processed_count']
+        has_more = processed_count < total_stocks
+        if has_more:
+            with self._stage('flush_history'):
+                self.data_fetcher.flush_history_store()
+        else:
+            self.finish_run(run)
+        
+        api_stats = self.data_fetcher.get_api_statistics()
+        return {
+            'results': rescue_stocks,
+            'unevaluated': batch_unevaluated,
             'total_stocks': total_stocks,
             'processed_count': processed_count,
             'has_more': has_more,
+            'snapshot_version': run['snapshot_version'],
+            'run_id': run_id,
+            'cached': False,
             'api_calls_made': api_stats['total_calls'],
             'api_success_rate': api_stats['success_rate'],
             'verification_info': {
-                'data_source': 'akshare',
+                'data_source': self.data_fetcher.provider.name,
                 'real_data_confirmed': api_stats['data_source_verified'],
                 'processing_timestamp': datetime.now().isoformat(),
                 'api_statistics': api_stats
             }
         }
     
-    def check_rescue_criteria(self, stock_data, stock_code):
-        """检查股票是否符合自救标准"""
+    def _cached_batch_response(self, cached):
+        """命中结果缓存时一次返回全部结果的批次响应"""
+        self.screening_end_time = datetime.now()
+        return {
+            'results': cached['results'],
+            'unevaluated': [],
+            'total_stocks': cached['total_stocks'],
+            'processed_count': cached['total_stocks'],
+            'has_more': False,
+            'snapshot_version': None,
+            'run_id': None,
+            'cached': True,
+            'api_calls_made': 0,
+            'api_success_rate': 0,
+            'verification_info': {
+                'data_source': 'result_cache',
+                'real_data_confirmed': True,
+                'processing_timestamp': datetime.now().isoformat(),
+                'cached_at': cached['created_at']
+            }
+        }
+    
+    def screen_rescue_stocks_stream(self, target_date=None, snapshot_version=None, stop_event=None, run_id=None):
+        """流式筛选：一次筛选全部股票，逐个产出 (事件类型, 数据)
+
+        事件依次为 start、若干 progress / match / unevaluated、最后 done 或 error。
+        stop_event 被设置后（如客户端断开）不再提交新的检查。
+        指定 run_id 时逐股保存检查点；续跑已有的运行时，start 之后先重放已判定的
+        match / unevaluated，progress 中的计数包含之前已判定的股票。
+        """
+        if target_date is None:
+            target_date = datetime.now().strftime("%Y-%m-%d")
+        
+        self.screening_start_time = datetime.now()
+        self.screening_end_time = None
+        self.unevaluated_stocks = []
+        stop_event = stop_event or threading.Event()
+        run_store = self._get_run_store() if run_id else None
+        run = run_store.get(run_id) if run_store is not None else None
+        
+        cached = self.get_cached_results(target_date, max_stocks=None) if run is None else None
+        if cached is not None:
+            yield 'start', {'total_stocks': cached['total_stocks'], 'snapshot_version': None, 'cached': True}
+            for row in cached['results']:
+                yield 'match', row
+            self.screening_end_time = datetime.now()
+            yield 'done', {
+                'total_stocks': cached['total_stocks'],
+                'processed_count': cached['total_stocks'],
+                'results_count': len(cached['results']),
+                'unevaluated_count': 0,
+                'summary': self.get_screening_summary(),
+                'cached': True,
+                'cached_at': cached['created_at'],
+            }
+            return
+        
+        logger.info(f"🚀 开始流式筛选 {target_date} 的自救股票...")
+        if run_store is not None:
+            run = self.open_run(run_id, target_date, snapshot_version)
+            stocks = run_store.pending(run_id) if run is not None else None
+        else:
+            as_of = self._resolve_as_of(target_date)
+            stocks = self._get_universe(as_of, snapshot_version)
+            if stocks is not None and len(stocks) == 0:
+                stocks = None
+        if stocks is None:
+            logger.error("无法获取股票数据")
+            yield 'error', {'message': '无法获取股票数据'}
+            return
+        if run is None:
+            # 没有股票通过预筛选是正常的空结果，按完成处理
+            stocks = self.prefilter_snapshot(stocks, as_of)
+        
+        if run is not None:
+            total_stocks = run['total_stocks']
+            processed_before = run['processed_count']
+            rescue_stocks = run_store.results(run_id)
+            self.unevaluated_stocks = run_store.unevaluated(run_id)
+            yield 'start', {
+                'total_stocks': total_stocks,
+                'processed_count': processed_before,
+                'snapshot_version': run['snapshot_version'],
+                'run_id': run_id,
+                'cached': False,
+            }
+            for row in rescue_stocks:
+                yield 'match', row
+            for stock in self.unevaluated_stocks:
+                yield 'unevaluated', stock
+        else:
+            total_stocks = len(stocks)
+            processed_before = 0
+            rescue_stocks = []
+            yield 'start', {
+                'total_stocks': total_stocks,
+                'snapshot_version': self.data_fetcher.snapshot_version,
+                'cached': False,
+            }
+        
+        events = queue.Queue()
+        checked = [0]
+        
+        def on_checked(checked_count, stock, matched_count, outcome):
+            checked[0] = checked_count
+            if outcome:
+                row = self._build_result_row(stock)
+                rescue_stocks.append(row)
+                events.put(('match', row))
+            elif outcome is None:
+                events.put(('unevaluated', self.unevaluated_stocks[-1]))
+            events.put(('progress', {
+                'processed_count': processed_before + checked_count,
+                'total_stocks': total_stocks,
+                'matched_count': len(rescue_stocks),
+                'current': f"{stock.name}({stock.code})",
+            }))
+        
+        def check():
+            try:
+                if run is not None:
+                    self.check_run_stocks(run, stocks, on_checked, stop_event)
+                else:
+                    self._check_stocks(stocks, on_checked, as_of, stop_event)
+                events.put(('finished', None))
+            except Exception as e:
+                logger.error(f"流式筛选失败: {e}")
+                events.put(('error', {'message': f'筛选失败: {str(e)}'}))
+        
+        worker = threading.Thread(target=check, daemon=True)
+        worker.start()
+        try:
+            while True:
+                event, data = events.get()
+                if event == 'finished':
+                    break
+                yield event, data
+                if event == 'error':
+                    return
+        finally:
+            # 生成器被提前关闭（客户端断开）时停止提交剩余股票
+            stop_event.set()
+        if checked[0] < len(stocks):
+            logger.info(f"流式筛选已停止，已检查 {processed_before + checked[0]}/{total_stocks} 只股票")
+            if run is not None:
+                self.data_fetcher.flush_history_store()
+            return
+        
+        if run is not None:
+            rescue_stocks = self.finish_run(run)
+        else:
+            self.data_fetcher.flush_history_store()
+            self.screening_end_time = datetime.now()
+            self.screening_results = rescue_stocks
+            self._save_cached_results(target_date, rescue_stocks, total_stocks, max_stocks=None)
+        api_stats = self.data_fetcher.get_api_statistics()
+        logger.info(f"✅ 流式筛选完成！共找到 {len(rescue_stocks)} 只符合自救条件的股票，{len(self.unevaluated_stocks)} 只未能评估")
+        yield 'done', {
+            'total_stocks': total_stocks,
+            'processed_count': total_stocks,
+            'results_count': len(rescue_stocks),
+            'unevaluated_count': len(self.unevaluated_stocks),
+            'summary': self.get_screening_summary(),
+            'run_id': run_id if run is not None else None,
+            'cached': False,
+            'api_calls_made': api_stats['total_calls'],
+            'api_success_rate': api_stats['success_rate'],
+            'verification_info': {
+                'data_source': self.data_fetcher.provider.name,
+                'real_data_confirmed': api_stats['data_source_verified'],
+                'processing_timestamp': datetime.now().isoformat(),
+            },
+        }
+    
+    def screen_rescue_stocks_vectorized(self, target_date=None):
+        """全市场向量化筛选：先取 (股票 × 交易日) 面板，再一次性计算全部条件"""
+        if target_date is None:
+            target_date = datetime.now().strftime("%Y-%m-%d")
+            
+        logger.info(f"开始向量化筛选 {target_date} 的自救股票...")
+        
+        cached = self.get_cached_results(target_date, max_stocks=None)
+        if cached is not None:
+            return cached['results']
+        
+        as_of = self._resolve_as_of(target_date)
+        all_stocks = self._get_universe(as_of)
+        if all_stocks is None or len(all_stocks) == 0:
+            logger.error("无法获取股票数据")
+            return []
+        all_stocks = self.prefilter_snapshot(all_stocks, as_of)
+        
+        # 与 get_stock_history 相同的10个自然日窗口
+        codes = all_stocks['代码'].tolist()
+        end_date = as_of or to_date_int(datetime.now())
+        start_date = shift_date_int(end_date, -10)
+        _, panel, failed_codes = self.data_fetcher.get_history_panel(
+            codes, start_date, end_date, max_workers=self.max_workers
+        )
+        self.data_fetcher.flush_history_store()
+        
+        start = time.perf_counter()
+        failed_codes = set(failed_codes)
+        ratios = self.limit_table.ratios_for(codes)
+        matched_codes = set(screen_panel(codes, panel, self.rule_plan.config, ratios)) - failed_codes
+        logger.info(f"向量化筛选 {len(codes)} 只股票耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+        
+        rows = StockRow.from_snapshot(all_stocks)
+        rescue_stocks = [self._build_result_row(stock) for stock in rows if stock.code in matched_codes]
+        self.unevaluated_stocks = [
+            {'code': stock.code, 'name': stock.name, 'error': '历史数据获取失败'}
+            for stock in rows if stock.code in failed_codes
+        ]
+        self.processed_stocks_count += len(codes)
+        
+        logger.info(f"筛选完成！共找到 {len(rescue_stocks)} 只符合自救条件的股票")
+        self.screening_results = rescue_stocks
+        self._save_cached_results(target_date, rescue_stocks, len(codes), max_stocks=None)
+        return rescue_stocks
+    
+    def _result_cache_context(self, target_date, params):
+        """返回 (交易日, 条件参数)；结果仍可能变化（未收盘）或无法计算K线指纹时返回 None"""
+        if self.result_cache is None or self.data_fetcher.history_store is None:
+            return None
+        trade_date = self._resolve_as_of(target_date) or to_date_int(datetime.now())
+        if trade_date > last_closed_date():
+            return None
+        return trade_date, screening_criteria(self.rule_plan, **params)
+    
+    def _bars_fingerprint(self, trade_date):
+        """与 get_stock_history 相同的10个自然日窗口内本地K线的指纹"""
+        return self.data_fetcher.history_store.fingerprint(shift_date_int(trade_date, -10), trade_date)
+    
+    def get_cached_results(self, target_date, **params):
+        """已收盘交易日的缓存结果，命中时返回 {'results', 'total_stocks', 'created_at'}"""
+        self.last_result_cached = False
+        context = self._result_cache_context(target_date, params)
+        if context is None:
+            return None
+        trade_date, criteria = context
+        cached = self.result_cache.get(trade_date, criteria, self._bars_fingerprint(trade_date))
+        CACHE_REQUESTS.inc(cache='result', result='miss' if cached is None else 'hit')
+        if cached is None:
+            return None
+        
+        logger.info(f"⚡ 命中 {trade_date} 的筛选结果缓存，{len(cached['results'])} 只符合条件的股票")
+        self.last_result_cached = True
+        self.screening_results = cached['results']
+        self.unevaluated_stocks = []
+        return cached
+    
+    def _save_cached_results(self, target_date, results, total_stocks, **params):
+        """保存已收盘交易日的完整结果；有未评估股票时结果不完整，不缓存"""
+        if self.unevaluated_stocks:
+            return
+        context = self._result_cache_context(target_date, params)
+        if context is None:
+            return
+        trade_date, criteria = context
+        try:
+            self.result_cache.put(trade_date, criteria, self._bars_fingerprint(trade_date), results, total_stocks)
+        except Exception as e:
+            logger.warning(f"保存筛选结果缓存失败: {e}")
+    
+    def _resolve_as_of(self, target_date):
+        """目标日期早于今天时返回 yyyymmdd 整数（历史筛选），否则返回 None（实时筛选）"""
+        if not target_date:
+            return None
+        try:
+            as_of = to_date_int(datetime.strptime(str(target_date)[:10], "%Y-%m-%d"))
+        except ValueError:
+            logger.warning(f"无法识别的筛选日期 {target_date}，按当天实时筛选")
+            return None
+        return as_of if as_of < to_date_int(datetime.now()) else None
+    
+    def _get_universe(self, as_of, snapshot_version=None):
+        """获取待筛选的股票及当天行情：实时筛选用行情快照，历史筛选用本地日线构造的快照"""
+        if as_of is None:
+            return self.data_fetcher.get_all_stocks(snapshot_version=snapshot_version)
+        logger.info(f"📅 按 {as_of} 的历史数据筛选")
+        return self.data_fetcher.get_snapshot_as_of(as_of, max_workers=self.max_workers)
+    
+    def _check_stocks(self, stocks, on_checked=None, as_of=None, stop_event=None):
+        """并发检查一组股票（行情快照 DataFrame 或 StockRow 列表），返回与输入顺序一致的 [(StockRow, 是否符合条件)]
+
+        数据获取失败的股票记入 self.unevaluated_stocks，不计入符合或不符合；
+        on_checked 的最后一个参数为 True/False，未能评估时为 None。
+        stop_event 被设置后取消尚未开始的检查。
+        """
+        with self._stage('rows'):
+            rows = stocks if isinstance(stocks, list) else StockRow.from_snapshot(stocks)
+        matches = [False] * len(rows)
+        matched_count = 0
+        checked_count = 0
+        started = time.perf_counter()
+        
+        profiler = self.profiler
+        check = profiler.wrap(self.check_rescue_criteria) if profiler is not None else self.check_rescue_criteria
+        SCREENING_RUNS_IN_PROGRESS.inc()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+                futures = {
+                    executor.submit(check, stock, stock.code, as_of): i
+                    for i, stock in enumerate(rows)
+                }
+                for checked_count, future in enumerate(as_completed(futures), 1):
+                    i = futures[future]
+                    outcome = None
+                    try:
+                        matches[i] = outcome = future.result()
+                    except DataFetchError as e:
+                        logger.warning(f"⚠️ 股票 {rows[i].code} 数据获取失败，记为未评估: {e}")
+                        with self.counter_lock:
+                            self.unevaluated_stocks.append({
+                                'code': rows[i].code,
+                                'name': rows[i].name,
+                                'error': str(e)
+                            })
+                    STOCKS_SCREENED.inc(outcome={True: 'matched', False: 'rejected', None: 'unevaluated'}[outcome])
+                    matched_count += matches[i]
+                    with self.counter_lock:
+                        self.processed_stocks_count += 1
+                    if on_checked:
+                        on_checked(checked_count, rows[i], matched_count, outcome)
+                    if stop_event is not None and stop_event.is_set():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+        finally:
+            SCREENING_RUNS_IN_PROGRESS.dec()
+        
+        elapsed = time.perf_counter() - started
+        if profiler is not None:
+            profiler.add_stage('check_stocks', elapsed)
+        if checked_count and elapsed > 0:
+            SCREENING_THROUGHPUT.set(checked_count / elapsed)
+        return list(zip(rows, matches))
+    
+    def prefilter_snapshot(self, all_stocks, as_of=None):
+        """用实时行情快照预筛选，只把可能符合条件的股票交给需要历史数据的检查
+
+        快照中的今开/最新价/最高/最低/成交量就是当天K线，只看当天K线的规则（条件1
+        当天非涨停、条件2 当天小阳线）无需请求历史数据即可判定；成交量为0的停牌股票一并剔除。
+        涨跌停价取自按交易日（及快照版本）缓存的涨跌停价表，同一天只计算一次；该表同时
+        保存在 self.limit_table 中，之后判定历史K线时按代码查涨跌幅限制比例（含 ST、新股豁免）。
+        """
+        if as_of is None:
+            table = table_for_snapshot(all_stocks, to_date_int(datetime.now()), self.data_fetcher.snapshot_version)
+        else:
+            table = table_for_snapshot(all_stocks, as_of)
+        self.limit_table = table
+        if not self.use_snapshot_prefilter or len(all_stocks) == 0:
+            return all_stocks
+        
+        survivors = all_stocks[self.snapshot_mask(snapshot_today_bars(all_stocks, table))]
+        logger.info(f"🔎 快照预筛选: {len(all_stocks)} → {len(survivors)} 只股票需要检查历史数据")
+        return survivors
+    
+    def snapshot_mask(self, today):
+        """只看当天K线的规则（及成交量为0的停牌股票）对当天K线的判定结果，today 需含当天涨跌停价"""
+        return (today['volume'] > 0) & self.rule_plan.snapshot_mask(today)
+    
+    def limit_ratio(self, stock_code, name=None):
+        """股票的涨跌幅限制比例：查本轮快照的涨跌停价表，没有时按代码和名称计算"""
+        if self.limit_table is not None:
+            return self.limit_table.ratio(stock_code, name)
+        return stock_limit_ratio(stock_code, name)
+    
+    def _build_result_row(self, stock):
+        """由行情快照记录（StockRow）生成结果记录"""
+        return stock.to_result()
+    
+    def check_rescue_criteria(self, stock_data, stock_code, as_of=None):
+        """检查股票是否符合自救标准，as_of 为 yyyymmdd 时只使用截至该日的K线
+
+        条件由 self.rule_plan 按代价和通过率排序执行；全部规则所需的K线一次获取。
+        """
+        started = time.perf_counter()
         try:
             # 获取历史数据（API调用统计已在data_fetcher中处理）
-            hist_data = self.data_fetcher.get_stock_history(stock_code, days=5)
-            if hist_data is None or len(hist_data) < 2:
+            with self._stage('history_fetch'):
+                hist_data = self.data_fetcher.get_stock_history(
+                    stock_code, days=self.rule_plan.max_bars, min_days=self.rule_plan.min_bars,
+                    raise_errors=True, end_date=as_of
+                )
+            if hist_data is None:
                 return False
-                
-            # 最新交易日数据
-            today_data = hist_data.iloc[-1]
-            yesterday_data = hist_data.iloc[-2] if len(hist_data) > 1 else None
-            
-            # 提取价格数据
-            today_open = today_data.get('开盘', 0)
-            today_close = today_data.get('收盘', 0)
-            today_high = today_data.get('最高', 0)
-            today_low = today_data.get('最低', 0)
-            today_volume = today_data.get('成交量', 0)
             
-            if yesterday_data is not None:
-                yesterday_open = yesterday_data.get('开盘', 0)
-                yesterday_close = yesterday_data.get('收盘', 0)
-                yesterday_volume = yesterday_data.get('成交量', 0)
-            else:
-                return False
-            
-            # 条件1: 当天非涨停
-            if self.data_fetcher.is_limit_up(today_open, today_close, stock_code):
-                return False
-                
-            # 条件2: 当天为小阳线
-            if not self.data_fetcher.is_small_positive_line(today_open, today_close, today_high, today_low):
-                return False
-                
-            # 条件3: 当天成交量小于昨日成交量
-            if today_volume >= yesterday_volume:
-                return False
-                
-            # 条件4: 昨日非跌停，昨日非涨停
-            if (self.data_fetcher.is_limit_up(yesterday_open, yesterday_close, stock_code) or 
-                self.data_fetcher.is_limit_down(yesterday_open, yesterday_close, stock_code)):
-                return False
-                
-            # 条件5: 近3日内首次涨停（首板）- 需要更多历史数据
-            extended_hist = self.data_fetcher.get_stock_history(stock_code, days=10)
-            if not self.data_fetcher.check_first_limit_up_in_3_days(extended_hist, stock_code):
-                return False
-                
+            with self._stage('to_arrays'):
+                bars = hist_data.rule_bars()
             # 条件6: 主板股票 - 已在data_fetcher中过滤
             # 条件7: 非ST股票 - 已在data_fetcher中过滤
+            with self._stage('rules'):
+                name = stock_data.name if isinstance(stock_data, StockRow) else None
+                return self.rule_plan.evaluate(bars, stock_code, self.limit_ratio(stock_code, name))
             
-            return True
-            
+        except DataFetchError:
+            # 数据获取失败不能当作"不符合条件"，交给调用方记为未评估
+            raise
         except Exception as e:
             logger.warning(f"检查股票 {stock_code} 失败: {e}")
             return False
+        finally:
+            elapsed = time.perf_counter() - started
+            STOCK_CHECK_LATENCY.observe(elapsed)
+            if self.profiler is not None:
+                self.profiler.record_stock(stock_code, elapsed)
     
     def get_screening_summary(self):
         """获取筛选结果摘要"""
@@ -248,14 +922,17 @@ class StockScreener:
             'screening_statistics': {
                 'total_processed': self.processed_stocks_count,
                 'results_found': len(self.screening_results),
+                'unevaluated_count': len(self.unevaluated_stocks),
                 'success_rate': (len(self.screening_results) / self.processed_stocks_count * 100) if self.processed_stocks_count > 0 else 0,
                 'processing_time_seconds': processing_time,
                 'start_time': self.screening_start_time.isoformat() if self.screening_start_time else None,
                 'end_time': self.screening_end_time.isoformat() if self.screening_end_time else None
             },
             'api_statistics': api_stats,
+            'rule_plan': self.rule_plan.statistics(),
+            'profile': self.last_profile,
             'data_verification': {
-                'data_source': 'akshare',
+                'data_source': self.data_fetcher.provider.name,
                 'real_data_confirmed': api_stats['data_source_verified'],
                 'api_calls_per_stock': api_stats['total_calls'] / self.processed_stocks_count if self.processed_stocks_count > 0 else 0
             }
@@ -263,60 +940,22 @@ class StockScreener:
     
     def export_results_to_excel(self, filename=None):
         """导出结果到Excel文件"""
-        if not self.screening_results:
-            logger.warning("没有筛选结果可导出")
-            return None
-            
-        if filename is None:
-            filename = f"rescue_stocks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            
-        try:
-            df = pd.DataFrame(self.screening_results)
-            
-            # 添加中文列名
-            df.columns = ['股票代码', '股票名称', '最新价', '涨跌幅(%)', '成交量', '成交额', '总市值']
-            
-            # 格式化数据
-            df['涨跌幅(%)'] = df['涨跌幅(%)'].round(2)
-            df['最新价'] = df['最新价'].round(2)
-            
-            # 保存到results目录
-            filepath = f"results/{filename}"
-            df.to_excel(filepath, index=False, engine='openpyxl')
-            
-            logger.info(f"结果已导出到: {filepath}")
-            return filepath
-            
-        except Exception as e:
-            logger.error(f"导出Excel失败: {e}")
-            return None
+        return self._export_results('excel', filename or f"rescue_stocks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
     
     def export_results_to_csv(self, filename=None):
         """导出结果到CSV文件"""
+        return self._export_results('csv', filename or f"rescue_stocks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    
+    def _export_results(self, format, filename):
         if not self.screening_results:
             logger.warning("没有筛选结果可导出")
             return None
-            
-        if filename is None:
-            filename = f"rescue_stocks_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
+        
         try:
-            df = pd.DataFrame(self.screening_results)
-            
-            # 添加中文列名
-            df.columns = ['股票代码', '股票名称', '最新价', '涨跌幅(%)', '成交量', '成交额', '总市值']
-            
-            # 格式化数据
-            df['涨跌幅(%)'] = df['涨跌幅(%)'].round(2)
-            df['最新价'] = df['最新价'].round(2)
-            
             # 保存到results目录
-            filepath = f"results/{filename}"
-            df.to_csv(filepath, index=False, encoding='utf-8-sig')
-            
+            filepath = write_export(format, self.screening_results, f"results/{filename}")
             logger.info(f"结果已导出到: {filepath}")
             return filepath
-            
         except Exception as e:
-            logger.error(f"导出CSV失败: {e}")
-            return None
\ No newline at end of file
+            logger.error(f"导出{format}失败: {e}")
+            return None
@@ -0,0 +1,101 @@
+import json
+import logging
+import queue
+import threading
+
+from result_cache import json_default
+
+logger = logging.getLogger(__name__)
+
+# 无事件时发送心跳注释的间隔（秒），防止代理断开空闲连接
+HEARTBEAT_INTERVAL = 15
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+
+def sse_event(event, data):
+    """格式化一条 server-sent event"""
+    payload = json.dumps(data, ensure_ascii=False, default=json_default)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class ResultRecorder:
+    """把流式事件中的命中结果保存到 result_store，并在 start / done 事件中附上句柄"""
+
+    def __init__(self, result_store, target_date):
+        self.result_store = result_store
+        self.target_date = target_date
+        self.handle = None
+
+    def __call__(self, event):
+        name, data = event
+        try:
+            if name == 'start':
+                self.handle = self.result_store.create(self.target_date)
+            elif name == 'match' and self.handle is not None:
+                self.result_store.append(self.handle, [data])
+        except Exception as e:
+            logger.warning(f"保存流式筛选结果失败: {e}")
+            self.handle = None
+        if name in ('start', 'done') and self.handle is not None:
+            data = dict(data, result_handle=self.handle)
+        return name, data
+
+
+def stream_screening(screener, target_date, snapshot_version=None, heartbeat=HEARTBEAT_INTERVAL,
+                     result_store=None, run_id=None):
+    """把 StockScreener.screen_rescue_stocks_stream 的事件转换为 SSE 文本
+
+    筛选在后台线程执行，等待期间定期发送心跳；响应被关闭时通知筛选停止。
+    指定 result_store 时命中结果同时保存在服务端，导出时按句柄读取；
+    指定 run_id 时逐股保存检查点，见 StockScreener.screen_rescue_stocks_stream。
+    """
+    events = queue.Queue()
+    stop_event = threading.Event()
+    record = ResultRecorder(result_store, target_date) if result_store is not None else None
+
+    def run():
+        try:
+            for event in screener.screen_rescue_stocks_stream(target_date, snapshot_version, stop_event, run_id):
+                events.put(record(event) if record is not None else event)
+                if stop_event.is_set():
+                    break
+        except Exception as e:
+            events.put(('error', {'message': f'筛选失败: {str(e)}'}))
+        events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if event is None:
+                return
+            yield sse_event(*event)
+    finally:
+        stop_event.set()
+
+
+def stream_live(live, heartbeat=HEARTBEAT_INTERVAL):
+    """把 LiveScreener 推送的 start / add / update / remove / tick 事件转换为 SSE 文本"""
+    events = live.subscribe()
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = events.get(timeout=heartbeat)
+            except queue.Empty:
+                if not live.is_subscribed(events):
+                    return
+                yield ": heartbeat\n\n"
+                continue
+            yield sse_event(*event)
+    finally:
+        live.unsubscribe(events)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+合成行情
+确定性地生成全市场行情快照和日线数据，作为数据源（见 providers）替代 akshare 的
+stock_zh_a_spot_em / stock_zh_a_hist，用于离线测试和性能基准；可注入请求延迟和失败率。
+"""
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from limit_prices import BOARD_MAIN, board_of, limit_prices, limit_ratios, round_price
+from providers import MarketDataProvider
+
+# 代码前缀及权重：以主板为主，另有创业板、科创板（会被股票列表过滤掉）
+CODE_PREFIXES = (
+    ('600', 0.22), ('601', 0.12), ('603', 0.14), ('605', 0.03),
+    ('000', 0.12), ('001', 0.02), ('002', 0.15), ('300', 0.12), ('688', 0.08),
+)
+# ST 股票比例
+ST_RATIO = 0.04
+# 生成的交易日数，需覆盖筛选使用的10个自然日窗口
+DEFAULT_DAYS = 30
+# 日收益率标准差及随机涨停、跌停概率
+DAILY_VOLATILITY = 0.02
+LIMIT_UP_PROBABILITY = 0.02
+LIMIT_DOWN_PROBABILITY = 0.01
+SUSPEND_PROBABILITY = 0.005
+
+
+class SyntheticUpstreamError(ConnectionError):
+    """注入的上游请求失败"""
+
+
+class SyntheticMarket(MarketDataProvider):
+    """合成的全市场行情
+
+    同一组参数（股票数、交易日数、seed、结束日期）总是生成相同的数据。按比例 planted_ratio
+    在主板非ST股票中植入"首板后缩量小阳"形态：T-2 日首次涨停，T-1 日小幅上涨，当天为缩量
+    小阳线，满足条件1~4（条件5要求当天涨停，与条件1矛盾，见 rules.FirstLimitUpIn3Days）。
+
+    latency 为每次请求的平均延迟（秒，对数正态分布），error_rate 为请求失败概率；
+    作为模拟的远程数据源，与 akshare 一样经限流和退避重试。
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, n_stocks, n_days=DEFAULT_DAYS, seed=0, end_date=None,
+                 planted_ratio=0.02, latency=0.0, error_rate=0.0):
+        self.n_stocks = n_stocks
+        self.seed = seed
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = np.random.default_rng(seed + 1)
+        self.rng_lock = threading.Lock()
+        self.calls = {'stock_zh_a_spot_em': 0, 'stock_zh_a_hist': 0, 'errors': 0}
+
+        end_date = pd.Timestamp(end_date or datetime.now().date())
+        self.dates = pd.bdate_range(end=end_date, periods=n_days)
+        self.date_strings = self.dates.strftime('%Y-%m-%d').to_numpy()
+        self.date_ints = self.dates.strftime('%Y%m%d').astype(int).to_numpy()
+
+        rng = np.random.default_rng(seed)
+        self.codes, self.names = self._generate_universe(rng, n_stocks)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.ratios = limit_ratios(self.codes, self.names)
+        self.bars = self._generate_bars(rng, n_days)
+        self.planted = self._plant_rescue_pattern(rng, planted_ratio)
+
+    @staticmethod
+    def _generate_universe(rng, n_stocks):
+        prefixes = [prefix for prefix, _ in CODE_PREFIXES]
+        weights = np.array([weight for _, weight in CODE_PREFIXES])
+        chosen = rng.choice(len(prefixes), size=n_stocks, p=weights / weights.sum())
+        # 每个前缀最多 1000 个代码，用满后顺延到下一个前缀
+        used = [0] * len(prefixes)
+        codes = []
+        for p in chosen:
+            while used[p] >= 1000:
+                p = (p + 1) % len(prefixes)
+            codes.append(f"{prefixes[p]}{used[p]:03d}")
+            used[p] += 1
+        codes = np.array(codes)
+        names = np.array([f"合成{i:04d}" for i in range(n_stocks)], dtype=object)
+        st = rng.random(n_stocks) < ST_RATIO
+        names[st] = ['ST' + name for name in names[st]]
+        return codes, names.astype(str)
+
+    def _generate_bars(self, rng, n_days):
+        """按前收盘价随机游走，收盘价不超出涨跌停价，涨跌停日恰好收在涨跌停价"""
+        n = self.n_stocks
+        ratios = self.ratios[:, None]
+        returns = rng.normal(0.0005, DAILY_VOLATILITY, (n, n_days))
+        gaps = rng.normal(0, DAILY_VOLATILITY / 3, (n, n_days))
+        moves = rng.random((n, n_days))
+        suspended = rng.random((n, n_days)) < SUSPEND_PROBABILITY
+
+        open_price = np.empty((n, n_days))
+        close = np.empty((n, n_days))
+        prev = round_price(rng.uniform(3, 80, n))[:, None]
+        for day in range(n_days):
+            up, down = limit_prices(prev, ratios)
+            today_open = np.clip(round_price(prev * (1 + gaps[:, [day]])), down, up)
+            today_close = np.clip(round_price(prev * (1 + returns[:, [day]])), down, up)
+            today_close = np.where(moves[:, [day]] < LIMIT_UP_PROBABILITY, up, today_close)
+            today_close = np.where(moves[:, [day]] > 1 - LIMIT_DOWN_PROBABILITY, down, today_close)
+            open_price[:, [day]] = today_open
+            close[:, [day]] = today_close
+            prev = np.where(suspended[:, [day]], prev, today_close)
+
+        wick = rng.uniform(0, 0.015, (2, n, n_days))
+        high = round_price(np.maximum(open_price, close) * (1 + wick[0]))
+        low = round_price(np.minimum(open_price, close) * (1 - wick[1]))
+        volume = np.round(rng.lognormal(11, 0.8, (n, n_days)))
+        bars = {'open': open_price, 'high': high, 'low': low, 'close': close, 'volume': volume}
+        for values in bars.values():
+            values[suspended] = np.nan
+        return bars
+
+    def _plant_rescue_pattern(self, rng, planted_ratio):
+        """在部分主板非ST股票的最后三个交易日植入形态，返回植入的代码"""
+        main_board = board_of(self.codes) == BOARD_MAIN
+        eligible = np.flatnonzero(main_board & (np.char.find(self.names, 'ST') < 0))
+        n_planted = min(len(eligible), int(round(len(eligible) * planted_ratio)))
+        rows = np.sort(rng.choice(eligible, size=n_planted, replace=False)) if n_planted else eligible[:0]
+
+        b = self.bars
+        for i in rows:
+            if np.isnan(b['close'][i, -4]):
+                self._set_bar(i, -4, 10.0, 10.0, volume=1e5)
+            prev = b['close'][i, -4]
+            # T-2：首次涨停
+            up, _ = limit_prices(prev, 0.10)
+            self._set_bar(i, -3, prev, float(up), volume=b['volume'][i, -4] * 2.5)
+            # T-1：小幅上涨，非涨跌停
+            close = float(round_price(up * 1.012))
+            self._set_bar(i, -2, float(up), close, volume=b['volume'][i, -3] * 0.8)
+            # T：缩量小阳线
+            today_open = float(round_price(close * 1.002))
+            today_close = float(round_price(today_open * 1.025))
+            self._set_bar(i, -1, today_open, today_close, volume=b['volume'][i, -2] * 0.6)
+        return set(self.codes[rows])
+
+    def _set_bar(self, i, day, open_price, close, volume):
+        b = self.bars
+        b['open'][i, day] = open_price
+        b['close'][i, day] = close
+        b['high'][i, day] = float(round_price(max(open_price, close) * 1.002))
+        b['low'][i, day] = float(round_price(min(open_price, close) * 0.998))
+        b['volume'][i, day] = float(np.round(volume))
+
+    def _simulate_request(self, api_name):
+        with self.rng_lock:
+            self.calls[api_name] += 1
+            delay = self.rng.lognormal(np.log(self.latency), 0.5) if self.latency > 0 else 0.0
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.calls['errors'] += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise SyntheticUpstreamError(f"{api_name}: synthetic upstream error")
+
+    def previous_close(self):
+        """各股票在最新交易日之前最近一个交易日的收盘价"""
+        prev = np.full(self.n_stocks, np.nan)
+        for column in self.bars['close'][:, :-1].T:
+            prev = np.where(np.isnan(column), prev, column)
+        return prev
+
+    def stock_zh_a_spot_em(self):
+        """最新交易日的全市场行情快照，列名与 akshare 一致"""
+        self._simulate_request('stock_zh_a_spot_em')
+        b = self.bars
+        prev_close = self.previous_close()
+        close = b['close'][:, -1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = close - prev_close
+            change_pct = np.round(change / prev_close * 100, 2)
+            amplitude = np.round((b['high'][:, -1] - b['low'][:, -1]) / prev_close * 100, 2)
+        volume = np.nan_to_num(b['volume'][:, -1])
+        return pd.DataFrame({
+            '序号': np.arange(1, self.n_stocks + 1),
+            '代码': self.codes,
+            '名称': self.names,
+            '最新价': close,
+            '涨跌幅': change_pct,
+            '涨跌额': np.round(change, 2),
+            '成交量': volume,
+            '成交额': np.round(volume * np.nan_to_num(close) * 100, 2),
+            '振幅': amplitude,
+            '最高': b['high'][:, -1],
+            '最低': b['low'][:, -1],
+            '今开': b['open'][:, -1],
+            '昨收': prev_close,
+            '总市值': np.round(np.nan_to_num(close) * 1e8, 2),
+        })
+
+    def stock_zh_a_hist(self, symbol, period='daily', start_date='19700101', end_date='20500101', adjust='', **kwargs):
+        """单只股票区间内的日线，列名与 akshare 一致；停牌日无K线"""
+        self._simulate_request('stock_zh_a_hist')
+        i = self.code_index.get(symbol)
+        if i is None:
+            return pd.DataFrame()
+        in_range = (self.date_ints >= int(start_date)) & (self.date_ints <= int(end_date))
+        in_range &= ~np.isnan(self.bars['close'][i])
+        b = {field: values[i, in_range] for field, values in self.bars.items()}
+        prev_close = np.concatenate([[np.nan], self.bars['close'][i, :-1]])[in_range]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = b['close'] - prev_close
+            return pd.DataFrame({
+                '日期': self.date_strings[in_range],
+                '股票代码': symbol,
+                '开盘': b['open'],
+                '收盘': b['close'],
+                '最高': b['high'],
+                '最低': b['low'],
+                '成交量': b['volume'],
+                '成交额': np.round(b['volume'] * b['close'] * 100, 2),
+                '振幅': np.round((b['high'] - b['low']) / prev_close * 100, 2),
+                '涨跌幅': np.round(change / prev_close * 100, 2),
+                '涨跌额': np.round(change, 2),
+                '换手率': 1.0,
+            })
@@ -85,6 +85,879 @@ def test_screener():
         traceback.print_exc()
         return False
 
+def test_history_store():
+    """测试本地历史数据存储（离线）"""
+    print("测试本地历史数据存储...")
+    import tempfile
+    import pandas as pd
+    from bars import BarArray
+    from history_store import HistoryStore
+
+    root_dir = tempfile.mkdtemp()
+    store = HistoryStore(root_dir)
+    frame = pd.DataFrame({
+        '日期': ['2024-01-02', '2024-01-03', '2024-01-04'],
+        '开盘': [10.0, 10.5, 10.8],
+        '收盘': [10.4, 10.9, 11.2],
+        '最高': [10.6, 11.0, 11.3],
+        '最低': [9.9, 10.4, 10.7],
+        '成交量': [1000, 900, 800],
+        '成交额': [10000.0, 9500.0, 9000.0],
+    })
+    store.write('600000', BarArray.from_frame('600000', frame), 20240101, 20240104)
+    store.flush()
+
+    reopened = HistoryStore(root_dir)
+    hist_data = reopened.read('600000', 20240101, 20240104)
+    assert list(hist_data['收盘']) == [10.4, 10.9, 11.2]
+    bars = reopened.read_bars('600000', 20240103, 20240104)
+    assert list(bars.dates) == [20240103, 20240104] and list(bars.field('close')) == [10.9, 11.2]
+    assert bars.close.dtype == 'float32' and bars.volume.dtype == 'int64'
+    assert reopened.plan_fetch('600000', 20240101, 20240104, 20240104) is None
+    assert reopened.plan_fetch('600000', 20240101, 20240105, 20240105) == (20240104, 20240105)
+    print("✓ 本地历史数据读写及增量计划正确")
+    return True
+
+def test_history_store_sharing():
+    """测试多个实例和进程同时写入同一本地历史数据目录（离线）"""
+    print("测试本地历史数据多实例写入...")
+    import multiprocessing
+    import tempfile
+    from bars import BarArray
+    from history_store import HistoryStore
+
+    def bars(code, close):
+        dates = [20240102, 20240103]
+        return BarArray(code, dates, open=[close] * 2, close=[close] * 2, high=[close] * 2,
+                        low=[close] * 2, volume=[100, 100], amount=[1e4, 1e4])
+
+    def write_in_child(root_dir, code, close):
+        child = HistoryStore(root_dir)
+        child.write(code, bars(code, close), 20240101, 20240103)
+        child.flush()
+
+    root_dir = tempfile.mkdtemp()
+    first, second = HistoryStore(root_dir), HistoryStore(root_dir)
+    first.write('000001', bars('000001', 99.0), 20240101, 20240103)
+    second.write('600000', bars('600000', 10.0), 20240101, 20240103)
+    process = multiprocessing.Process(target=write_in_child, args=(root_dir, '300001', 5.0))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    first.flush()
+    second.flush()
+
+    for store in (first, second, HistoryStore(root_dir)):
+        closes = {code: list(store.read_bars(code, 20240101, 20240103).field('close'))
+                  for code in ('000001', '600000', '300001')}
+        assert closes == {'000001': [99.0, 99.0], '600000': [10.0, 10.0], '300001': [5.0, 5.0]}, closes
+        assert all(store.plan_fetch(code, 20240101, 20240103, 20240103) is None for code in closes)
+    print("✓ 各实例分配的槽位一致，覆盖区间合并后无数据丢失")
+    return True
+
+def test_api_log():
+    """测试API调用记录：环形缓冲区有界，计数随状态转移增量更新（离线）"""
+    print("测试API调用记录...")
+    from api_log import ApiCallLog
+
+    log = ApiCallLog(capacity=5)
+    for i in range(20):
+        call = log.start('get_stock_history', f'股票{i}')
+        log.complete(call, 'error' if i % 4 == 0 else 'success', 'result', 'ok')
+    # 已被挤出缓冲区的调用完成后仍计入统计：成功后被标记为警告
+    log.complete(call, 'warning', 'warning', '数据不足')
+    log.start('get_all_stocks', '进行中')
+
+    stats = log.statistics()
+    assert len(log.calls) == 5 and [c['call_id'] for c in log.recent(3)] == [19, 20, 21]
+    assert stats['total_calls'] == 21 and stats['in_flight_calls'] == 1
+    assert (stats['successful_calls'], stats['failed_calls'], stats['warning_calls']) == (14, 5, 1)
+    latency = log.latency_statistics()
+    assert latency['count'] == 20 and sum(latency['buckets'].values()) == 20
+    assert '_started' not in log.recent(1)[0]
+    print("✓ API调用记录有界，统计正确")
+    return True
+
+def test_limit_prices():
+    """测试按前收盘价计算的涨跌停价（离线）"""
+    print("测试涨跌停价...")
+    import numpy as np
+    import pandas as pd
+    from limit_prices import LimitPriceTable, limit_prices, limit_ratios, limit_up_mask, stock_limit_ratio
+    from rules import DEFAULT_RULES, RulePlan
+
+    # 四舍五入到分：10.05 × 1.1 = 11.055 → 11.06
+    up, down = limit_prices(np.array([10.05, 3.33]), 0.10)
+    assert np.allclose(up, [11.06, 3.66]) and np.allclose(down, [9.05, 3.0])
+    # 一字涨停（开盘即涨停）按前收盘价判定，半个报价单位内的误差视为触及
+    assert limit_up_mask(11.06, 10.05, 0.10) and limit_up_mask(11.0551, 10.05, 0.10)
+    assert not limit_up_mask(11.05, 10.05, 0.10)
+    assert not limit_up_mask(11.06, np.nan, 0.10)
+
+    # 主板 ST 5%，创业板/科创板 20%（ST 亦然），北交所 30%
+    codes = ['600000', '000001', '300750', '688981', '830799']
+    names = ['浦发银行', '*ST平安', 'ST宁德', '中芯国际', '艾融软件']
+    assert np.allclose(limit_ratios(codes, names), [0.10, 0.05, 0.20, 0.20, 0.30])
+
+    snapshot = pd.DataFrame({'代码': codes, '名称': names, '昨收': [10.0, 10.0, 10.0, 10.0, 10.0]})
+    table = LimitPriceTable.from_snapshot(snapshot, 20240105)
+    assert table.get('000001') == (10.5, 9.5) and table.get('830799') == (13.0, 7.0)
+    assert table.get('999999') is None
+    assert list(table.limit_up_mask(np.array([11.0, 10.49, 12.0, 11.99, 13.0]))) == [True, False, True, False, True]
+
+    # 上市初期不设涨跌幅限制：按上市天数，或按名称前缀（N 首日、C 限制期内）
+    table = LimitPriceTable(20240105, ['600000', '830799'], [10.0, 10.0], listing_days=[3, 3])
+    assert table.get('830799') == (13.0, 7.0) and np.isnan(table.get('600000')[0])
+    snapshot = pd.DataFrame({'代码': ['603001', '603002', '600000'], '名称': ['N华丰', 'C华丰', 'CBA银行'],
+                             '昨收': [10.0, 10.0, 10.0]})
+    table = LimitPriceTable.from_snapshot(snapshot, 20240105)
+    assert list(table.exempt) == [True, True, False] and table.get('600000') == (11.0, 9.0)
+    assert not table.limit_up_mask(np.array([14.4, 12.0, 11.0]))[:2].any()
+
+    # 历史K线判定按表中的比例计算涨跌停价，不在表中的股票按代码和名称计算
+    ratios = table.ratios_for(['603002', '600000', '300001'])
+    assert np.isnan(ratios[0]) and np.allclose(ratios[1:], [0.10, 0.20])
+    assert np.isnan(table.ratio('603002')) and np.isnan(stock_limit_ratio('603003', 'C新股'))
+    assert stock_limit_ratio('000001', '*ST平安') == 0.05
+    bars = {'open': np.full(5, 10.0), 'high': np.array([10.2, 10.3, 10.5, 10.7, 11.77]),
+            'low': np.full(5, 9.9), 'close': np.array([10.0, 10.1, 10.4, 10.7, 11.77]),
+            'volume': np.array([5.0, 4.0, 3.0, 2.0, 1.0])}
+    plan = RulePlan([rule for rule in DEFAULT_RULES if rule.name == 'today_not_limit_up'])
+    assert not plan.evaluate(bars, '603002', table.ratio('600000')), "按10%计算当天涨停"
+    assert plan.evaluate(bars, '603002', table.ratio('603002')), "新股不设涨跌幅限制"
+    print("✓ 涨跌停价计算正确")
+    return True
+
+def test_vectorized_screener():
+    """测试向量化筛选引擎与标量路径一致（离线）"""
+    print("测试向量化筛选引擎...")
+    import numpy as np
+    from bars import BarArray
+    from benchmark import random_panel, panel_to_frames, scalar_screen
+    from data_fetcher import StockDataFetcher
+    from limit_prices import limit_ratios
+    from vectorized_screener import rescue_criteria_masks, screen_panel
+
+    codes, panel = random_panel(500, n_days=12, seed=7)
+    assert screen_panel(codes, panel) == scalar_screen(codes, panel)
+
+    # 逐条件对照标量函数
+    fetcher = StockDataFetcher(use_history_store=False)
+    masks = rescue_criteria_masks(panel, limit_ratios(codes))
+    assert masks['today_not_limit_up'].sum() < len(codes) * 0.95, "随机面板应包含涨停"
+    for i, (code, frame) in enumerate(panel_to_frames(codes, panel).items()):
+        if len(frame) < 5:
+            assert not masks['today_small_positive'][i]
+            continue
+        frame = frame.assign(昨收=frame['收盘'].shift(1))
+        today, yesterday = frame.iloc[-1], frame.iloc[-2]
+        assert masks['today_not_limit_up'][i] == (not fetcher.is_limit_up(today['昨收'], today['收盘'], code))
+        assert masks['today_small_positive'][i] == fetcher.is_small_positive_line(
+            today['开盘'], today['收盘'], today['最高'], today['最低'])
+        assert masks['volume_shrink'][i] == (not today['成交量'] >= yesterday['成交量'])
+        assert masks['yesterday_normal'][i] == (not (
+            fetcher.is_limit_up(yesterday['昨收'], yesterday['收盘'], code)
+            or fetcher.is_limit_down(yesterday['昨收'], yesterday['收盘'], code)))
+        extended = BarArray.from_frame(code, frame).tail(10) if len(frame) >= 10 else None
+        assert masks['first_limit_up_in_3_days'][i] == fetcher.check_first_limit_up_in_3_days(extended, code)
+    print("✓ 向量化引擎与标量路径逐条件一致")
+    return True
+
+def test_backtest():
+    """测试回测引擎与逐日筛选一致（离线）"""
+    print("测试回测引擎...")
+    import numpy as np
+    from backtest import forward_returns, run_backtest
+    from benchmark import check_backtest_days, random_market
+
+    dates, codes, market = random_market(200, 60, seed=3)
+    check_backtest_days(dates, codes, market, np.arange(len(dates)))
+
+    result = run_backtest(dates, codes, market, start_date=dates[10], horizons=(1, 5))
+    assert result['trading_days'] == len(dates) - 10
+    returns = forward_returns(market['close'], (1,))[1]
+    assert np.allclose(returns[:-1], market['close'][1:] / market['close'][:-1] - 1, equal_nan=True)
+    assert np.isnan(returns[-1]).all()
+    print("✓ 回测结果与逐日筛选一致")
+    return True
+
+def test_rule_plan():
+    """测试规则引擎：自定义规则集与阈值下与向量化引擎一致（离线）"""
+    print("测试规则引擎...")
+    import numpy as np
+    from benchmark import random_panel, panel_to_frames
+    from rules import DEFAULT_RULES, CriteriaConfig, RulePlan
+    from limit_prices import limit_ratios
+    from vectorized_screener import rescue_criteria_masks
+
+    codes, panel = random_panel(500, n_days=12, seed=11)
+    config = CriteriaConfig(small_positive_min_pct=0.5, small_positive_max_pct=8.0)
+    # 去掉条件5后才会有股票通过，便于比较
+    rules = [rule for rule in DEFAULT_RULES if rule.name != 'first_limit_up_in_3_days']
+    plan = RulePlan(rules, config)
+    masks = rescue_criteria_masks(panel, limit_ratios(codes), config)
+    expected = np.logical_and.reduce([masks[rule.name] for rule in rules])
+
+    columns = {'open': '开盘', 'high': '最高', 'low': '最低', 'close': '收盘', 'volume': '成交量'}
+    matched = []
+    for code, frame in panel_to_frames(codes, panel).items():
+        frame = frame.tail(plan.max_bars)
+        bars = {field: frame[column].to_numpy(dtype=float) for field, column in columns.items()}
+        matched.append(plan.evaluate(bars, code))
+    assert expected.any() and np.array_equal(np.array(matched), expected)
+
+    # 规则按 代价 / (1 - 通过率) 排序，观察到的通过率参与重新排序
+    stats = plan.statistics()
+    assert stats['order'][0] == 'volume_shrink'
+    assert sum(rule['evaluated'] for rule in stats['rules'].values()) > len(codes)
+    print("✓ 规则引擎与向量化引擎一致，按代价和通过率排序")
+    return True
+
+def test_job_manager():
+    """测试筛选任务调度：并发相同请求复用任务、已结束任务按 LRU 淘汰（离线）"""
+    print("测试筛选任务调度...")
+    import os
+    import tempfile
+    import threading
+    from jobs import JobManager
+    from result_store import ResultStore
+
+    release = threading.Event()
+    created = []
+
+    class FakeScreener:
+        def __init__(self):
+            created.append(self)
+
+        def screen_rescue_stocks(self, target_date, progress_callback=None, **params):
+            progress_callback(50, '筛选中')
+            release.wait(5)
+            return [{'code': '600000', 'date': target_date}]
+
+        def get_screening_summary(self):
+            return {'total_count': 1}
+
+    # 结果写入临时目录，避免污染 results/ 下的正式结果存储
+    tmp_dir = tempfile.mkdtemp()
+    store = ResultStore(os.path.join(tmp_dir, 'result_store.sqlite'))
+    manager = JobManager(max_jobs=2, max_finished=1, screener_factory=FakeScreener, result_store=store)
+    first, attached = manager.submit('2024-01-05')
+    second, attached_again = manager.submit('2024-01-05')
+    other, _ = manager.submit('2024-01-04')
+    assert not attached and attached_again and second is first
+    assert other is not first
+
+    release.set()
+    manager.executor.shutdown(wait=True)
+    assert len(created) == 2
+    assert manager.get(other.job_id).to_dict(include_results=True)['results'][0]['date'] == '2024-01-04'
+    assert store.info(other.result_handle)['rows'] == 1
+    # 只保留1个已结束任务
+    assert manager.statistics()['jobs'] == 1
+    print("✓ 相同请求复用进行中任务，已结束任务按 LRU 淘汰")
+    return True
+
+def test_result_cache():
+    """测试筛选结果缓存：条件参数或K线变化后失效（离线）"""
+    print("测试筛选结果缓存...")
+    import os
+    import tempfile
+    import pandas as pd
+    from bars import BarArray
+    from history_store import HistoryStore
+    from result_cache import ResultCache
+    from stock_screener import screening_criteria
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = HistoryStore(root_dir=tmp_dir)
+        frame = pd.DataFrame({
+            '日期': ['2024-01-04', '2024-01-05'],
+            '开盘': [10.0, 10.5], '收盘': [10.4, 10.9], '最高': [10.5, 11.0],
+            '最低': [9.9, 10.4], '成交量': [1000.0, 900.0], '成交额': [1e4, 9e3],
+        })
+        store.write('600000', BarArray.from_frame('600000', frame), 20240101, 20240105)
+        fingerprint = store.fingerprint(20231226, 20240105)
+
+        cache = ResultCache(os.path.join(tmp_dir, 'results.sqlite'))
+        criteria = screening_criteria(max_stocks=None)
+        cache.put(20240105, criteria, fingerprint, [{'code': '600000'}], total_stocks=1)
+        assert cache.get(20240105, criteria, fingerprint)['results'] == [{'code': '600000'}]
+        assert cache.get(20240105, screening_criteria(max_stocks=100), fingerprint) is None
+
+        # 复权数据变化后K线指纹变化，旧结果失效
+        store.invalidate('600000')
+        assert store.fingerprint(20231226, 20240105) != fingerprint
+        assert cache.get(20240105, criteria, store.fingerprint(20231226, 20240105)) is None
+        assert cache.statistics()['entries'] == 0
+    print("✓ 结果缓存按条件参数和K线指纹失效")
+    return True
+
+def test_metrics():
+    """测试 Prometheus 文本格式指标及 /metrics 接口（离线）"""
+    print("测试运行指标...")
+    from metrics import Counter, Histogram, MetricsRegistry
+
+    registry = MetricsRegistry()
+    requests_total = registry.register(Counter('demo_requests_total', '请求数', ('api', 'outcome')))
+    latency = registry.register(Histogram('demo_seconds', '耗时', ('api',), buckets=(0.1, 1.0)))
+    requests_total.inc(api='stock_zh_a_hist', outcome='success')
+    requests_total.inc(2, api='stock_zh_a_hist', outcome='error')
+    for seconds in (0.05, 0.5, 3.0):
+        latency.observe(seconds, api='stock_zh_a_hist')
+    text = registry.render()
+    assert '# TYPE demo_requests_total counter' in text
+    assert 'demo_requests_total{api="stock_zh_a_hist",outcome="error"} 2' in text
+    assert 'demo_seconds_bucket{api="stock_zh_a_hist",le="1"} 2' in text
+    assert 'demo_seconds_bucket{api="stock_zh_a_hist",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{api="stock_zh_a_hist"} 3' in text
+
+    from main import app
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200 and response.content_type.startswith('text/plain; version=0.0.4')
+    assert '# TYPE stock_upstream_request_seconds histogram' in response.get_data(as_text=True)
+    print("✓ 指标导出格式正确")
+    return True
+
+def test_profiler():
+    """测试筛选性能分析：分阶段计时、逐股耗时、cProfile 与折叠栈输出（离线）"""
+    print("测试性能分析...")
+    import os
+    import pstats
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from profiler import RunProfiler
+
+    def check(code):
+        with profiler.stage('history_fetch'):
+            time.sleep(0.01)
+        profiler.record_stock(code, 0.01)
+
+    output_dir = tempfile.mkdtemp()
+    for mode in ('cprofile', 'stacks'):
+        profiler = RunProfiler(mode, output_dir=output_dir)
+        profiler.start()
+        with profiler.stage('snapshot'):
+            time.sleep(0.01)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(profiler.wrap(check), ['600000', '600001', '600002']))
+        summary = profiler.stop()
+        assert summary['stages']['history_fetch']['count'] == 3 and summary['stocks']['count'] == 3
+        assert summary['wall_seconds'] >= summary['stages']['snapshot']['seconds']
+
+    pstats_path = [path for path in os.listdir(output_dir) if path.endswith('.pstats')][0]
+    functions = pstats.Stats(os.path.join(output_dir, pstats_path)).stats
+    assert any(name == 'check' for _, _, name in functions), "工作线程应计入 cProfile"
+    folded = [path for path in os.listdir(output_dir) if path.endswith('.folded')][0]
+    with open(os.path.join(output_dir, folded), encoding='utf-8') as f:
+        assert all(line.rsplit(' ', 1)[1].strip().isdigit() for line in f)
+    print("✓ 性能分析输出正确")
+    return True
+
+def test_synthetic_market():
+    """测试合成行情：数据确定，植入的形态能被完整筛选流程找回（离线）"""
+    print("测试合成行情...")
+    import numpy as np
+    from benchmark import benchmark_screening, without_first_limit_up
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(200, seed=3)
+    again = SyntheticMarket(200, seed=3)
+    assert list(market.codes) == list(again.codes) and market.planted == again.planted
+    assert np.array_equal(market.bars['close'], again.bars['close'], equal_nan=True)
+    assert market.planted, "应植入形态股票"
+
+    screen = benchmark_screening(market, rules=without_first_limit_up())
+    batch = benchmark_screening(market, batch_size=50, rules=without_first_limit_up())
+    assert market.planted <= set(screen['matched']), "条件1~4应找回全部植入的股票"
+    assert screen['matched'] == batch['matched']
+    assert screen['upstream_calls']['stock_zh_a_spot_em'] == 1
+    assert screen['per_stock']['p99_ms'] >= screen['per_stock']['p50_ms']
+    print(f"✓ 合成行情筛选正确（植入 {len(market.planted)} 只，命中 {len(screen['matched'])} 只）")
+    return True
+
+def test_providers():
+    """测试数据源录制/回放：回放 cassette 得到与录制时相同的结果，且不再请求数据源（离线）"""
+    print("测试数据源录制与回放...")
+    import os
+    import tempfile
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    from providers import CassetteMissError, RecordingProvider, ReplayProvider
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(200, seed=7, error_rate=0.05)
+    path = os.path.join(tempfile.mkdtemp(), 'run.cassette.gz')
+    recorder = RecordingProvider(market, path)
+    today = datetime.now().strftime('%Y-%m-%d')
+    recorded, _ = run_screening(synthetic_screener(recorder, without_first_limit_up()), today, max_stocks=200)
+    recorded_calls = recorder.save()
+    upstream_calls = dict(market.calls)
+
+    replay = ReplayProvider(path)
+    replayed, _ = run_screening(synthetic_screener(replay, without_first_limit_up()), today, max_stocks=200)
+    assert [row['code'] for row in replayed] == [row['code'] for row in recorded], "回放结果应与录制时一致"
+    assert replay.replayed == recorded_calls and replay.misses == 0
+    assert market.calls == upstream_calls, "回放不应请求数据源"
+    try:
+        replay.stock_zh_a_hist('999999')
+        assert False, "未录制的请求应抛出 CassetteMissError"
+    except CassetteMissError:
+        pass
+    print(f"✓ 回放 {recorded_calls} 次请求，结果一致")
+    return True
+
+def test_snapshot_artifact():
+    """测试预构建快照：读写一致，新实例直接使用快照文件而不请求行情快照，分批筛选可按版本号恢复"""
+    print("测试预构建快照文件...")
+    import os
+    import tempfile
+    from cache import SnapshotCache
+    from data_fetcher import StockDataFetcher
+    from snapshot_artifact import build_artifact, load_artifact
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(300, seed=3)
+    path = os.path.join(tempfile.mkdtemp(), 'snapshot_artifact.npz')
+    count = build_artifact(path, provider=market)
+    artifact = load_artifact(path)
+    assert len(artifact.data) == count and artifact.source == 'synthetic'
+    assert artifact.is_current(), "刚构建的快照应仍有效"
+
+    calls = market.calls.get('stock_zh_a_spot_em', 0)
+    fetcher = StockDataFetcher(use_history_store=False, snapshot_cache=SnapshotCache(),
+                               provider=market, snapshot_artifact=path)
+    stocks = fetcher.get_all_stocks()
+    assert stocks['代码'].tolist() == artifact.data['代码'].tolist()
+    assert fetcher.snapshot_version == artifact.version
+    assert market.calls.get('stock_zh_a_spot_em', 0) == calls, "使用快照文件时不应请求行情快照"
+
+    other = StockDataFetcher(use_history_store=False, snapshot_cache=SnapshotCache(),
+                             provider=market, snapshot_artifact=path)
+    assert len(other.get_all_stocks(snapshot_version=artifact.version)) == count
+    assert other.snapshot_version == artifact.version, "新实例应按版本号恢复同一份快照"
+    print(f"✓ 快照文件 {count} 只股票，版本 {artifact.version}")
+    return True
+
+def test_snapshot_versions():
+    """测试分批筛选固定的快照版本：被读取的版本不被新快照挤出，淘汰后明确报错而不是改用最新快照"""
+    print("测试快照版本固定...")
+    from datetime import timedelta
+    from benchmark import synthetic_screener
+    from cache import SnapshotCache
+    from synthetic_market import SyntheticMarket
+
+    cache = SnapshotCache(intraday_ttl=30, max_versions=2, pin_ttl=600)
+    start = datetime(2024, 1, 5, 10, 0)
+    pinned = cache.put('pinned', now=start)
+    for minute in range(1, 30):
+        now = start + timedelta(minutes=minute)
+        assert cache.get(pinned, now=now) == 'pinned', f"第{minute}分钟被读取的版本不应被淘汰"
+        cache.put(f'live-{minute}', now=now)
+    assert len(cache.versions) <= 12, "未被读取的旧版本应按 pin_ttl 淘汰"
+    cache.put('later', now=start + timedelta(minutes=45))
+    assert cache.get(pinned) is None, "pin_ttl 内未被读取的版本超出数量后淘汰"
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    screener = synthetic_screener(SyntheticMarket(300, seed=4))
+    first = screener.screen_rescue_stocks_batch(today, batch_start=0, batch_size=10)
+    version = first['snapshot_version']
+    snapshots = screener.data_fetcher.snapshot_cache
+    later = datetime.now() + timedelta(hours=1)
+    for i in range(snapshots.max_versions + 1):
+        snapshots.put(f'live-{i}', now=later + timedelta(seconds=i))
+    response = screener.screen_rescue_stocks_batch(today, batch_start=10, batch_size=10, snapshot_version=version)
+    assert response['snapshot_expired'] and response['error'] and not response['has_more']
+    assert response['results'] == [] and response['processed_count'] == 0
+    print("✓ 使用中的快照版本保留，已淘汰的版本返回 snapshot_expired")
+    return True
+
+def test_snapshot_prefilter():
+    """测试快照预筛选：只有通过当天规则的股票请求历史数据，结果与不预筛选时一致（离线）"""
+    print("测试快照预筛选...")
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(300, seed=7)
+    today = datetime.now().strftime('%Y-%m-%d')
+    screener = synthetic_screener(market, without_first_limit_up())
+    snapshot = screener.data_fetcher.get_all_stocks()
+    survivors = screener.prefilter_snapshot(snapshot)
+    assert 0 < len(survivors) < len(snapshot)
+    assert (survivors['最新价'] > survivors['今开']).all() and (survivors['成交量'] > 0).all()
+
+    calls = market.calls['stock_zh_a_hist']
+    prefiltered, _ = run_screening(screener, today)
+    prefiltered_calls = market.calls['stock_zh_a_hist'] - calls
+
+    unfiltered_screener = synthetic_screener(market, without_first_limit_up())
+    unfiltered_screener.use_snapshot_prefilter = False
+    calls = market.calls['stock_zh_a_hist']
+    unfiltered, _ = run_screening(unfiltered_screener, today)
+    unfiltered_calls = market.calls['stock_zh_a_hist'] - calls
+
+    assert sorted(row['code'] for row in prefiltered) == sorted(row['code'] for row in unfiltered) and prefiltered
+    assert set(row['code'] for row in prefiltered) <= set(survivors['代码'])
+    assert prefiltered_calls == len(survivors) and unfiltered_calls == len(snapshot)
+    print(f"✓ 预筛选 {len(snapshot)} → {len(survivors)} 只，历史数据请求 {unfiltered_calls} → {prefiltered_calls} 次")
+    return True
+
+def test_history_cache():
+    """测试缓存：TTLCache 按 LRU 和过期时间淘汰，历史数据请求被已缓存的更宽窗口覆盖时直接截取"""
+    print("测试历史数据缓存...")
+    import time
+    from datetime import timedelta
+    import numpy as np
+    from benchmark import synthetic_screener
+    from cache import SnapshotCache, TTLCache
+    from market_session import shift_date_int
+    from synthetic_market import SyntheticMarket
+
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and cache.get('a') == 1 and cache.statistics()['evictions'] == 1
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get('a') is None and cache.statistics()['size'] == 1
+
+    snapshots = SnapshotCache(intraday_ttl=30)
+    opened = datetime(2024, 1, 5, 10, 0)
+    version = snapshots.put('snapshot', now=opened)
+    assert snapshots.current(now=opened + timedelta(seconds=10)) == (version, 'snapshot')
+    assert snapshots.current(now=opened + timedelta(seconds=31)) == (None, None), "盘中快照超过有效期后失效"
+    assert snapshots.get(version) == 'snapshot', "过期的快照仍可按版本读取"
+
+    market = SyntheticMarket(50, seed=3)
+    fetcher = synthetic_screener(market).data_fetcher
+    code, end = market.codes[0], int(market.date_ints[-1])
+    calls = market.calls['stock_zh_a_hist']
+    wide = fetcher._get_cached_history(code, shift_date_int(end, -30), end, 'qfq')
+    narrow = fetcher._get_cached_history(code, shift_date_int(end, -10), shift_date_int(end, -2), 'qfq')
+    assert market.calls['stock_zh_a_hist'] - calls == 1, "被已缓存窗口覆盖的请求不应再请求数据源"
+    expected = wide.between(shift_date_int(end, -10), shift_date_int(end, -2))
+    assert len(narrow) == len(expected) > 0 and np.array_equal(narrow.rule_bars(('close',))['close'],
+                                                                expected.rule_bars(('close',))['close'])
+    assert fetcher.history_cache.statistics()['hits'] == 1
+
+    fetcher.history_cache.clear()
+    fetcher._get_cached_history(code, shift_date_int(end, -10), end, 'qfq')
+    assert market.calls['stock_zh_a_hist'] - calls == 2, "缓存清空后的窗口需要重新请求"
+    print("✓ TTL/LRU 淘汰、快照有效期与历史窗口截取正确")
+    return True
+
+def test_as_of_screening():
+    """测试历史日期筛选：由本地日线构造当日快照，结果与当天实时筛选一致，再次筛选完全离线（离线）"""
+    print("测试历史日期筛选...")
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    from history_store import HistoryStore
+    from synthetic_market import SyntheticMarket
+
+    screener = synthetic_screener(SyntheticMarket(10))
+    today = datetime.now()
+    assert screener._resolve_as_of(today.strftime('%Y-%m-%d')) is None
+    assert screener._resolve_as_of('2024-01-05') == 20240105
+    assert screener._resolve_as_of('not-a-date') is None
+
+    # 行情截至上一个工作日：当时的实时筛选结果即为按该日期筛选的预期结果
+    last_day = (pd.Timestamp(today.date()) - pd.offsets.BDay(1)).date()
+    market = SyntheticMarket(300, seed=8, end_date=last_day)
+    expected, _ = run_screening(synthetic_screener(market, without_first_limit_up()), today.strftime('%Y-%m-%d'))
+    assert expected
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = HistoryStore(root_dir=tmp_dir)
+
+        def as_of_screener():
+            screener = synthetic_screener(market, without_first_limit_up())
+            screener.data_fetcher.history_store = store
+            return screener
+
+        target = last_day.strftime('%Y-%m-%d')
+        results, _ = run_screening(as_of_screener(), target)
+        assert sorted(row['code'] for row in results) == sorted(row['code'] for row in expected)
+
+        # 更早的日期只看到当日及之前的K线
+        earlier = as_of_screener()
+        snapshot = earlier.data_fetcher.get_snapshot_as_of(int(market.date_ints[-2]))
+        closes = market.bars['close'][[market.code_index[code] for code in snapshot['代码']], -2]
+        assert np.allclose(snapshot['最新价'].to_numpy(dtype=float), closes, equal_nan=True)
+
+        calls = market.calls['stock_zh_a_hist']
+        again, _ = run_screening(as_of_screener(), target)
+        assert market.calls['stock_zh_a_hist'] == calls, "本地已有数据时历史日期筛选不应再请求数据源"
+        assert sorted(row['code'] for row in again) == sorted(row['code'] for row in results)
+    print(f"✓ 按 {target} 筛选得到 {len(results)} 只，与当日实时筛选一致")
+    return True
+
+def test_result_export():
+    """测试服务端结果句柄与流式导出：分批追加不重复，CSV/XLSX 按块读取后内容完整"""
+    print("测试结果句柄与流式导出...")
+    import csv
+    import io
+    import os
+    import tempfile
+    from openpyxl import load_workbook
+    from exporters import ExportUnavailableError, available_formats, open_export
+    from result_store import ResultStore
+
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), 'result_store.sqlite'))
+    rows = [{'code': f"{600000 + i:06d}", 'name': f"股票{i}", 'current_price': 10 + i / 3,
+             'change_pct': 1.234, 'volume': 1000 + i, 'turnover': 1e6, 'market_cap': 1e9} for i in range(1200)]
+    handle = store.create('2024-01-05')
+    for start in range(0, len(rows), 400):
+        assert store.append(handle, rows[start:start + 400])
+    assert store.append(handle, rows[:10]), "重试的批次应覆盖而不是重复"
+    assert store.info(handle)['rows'] == len(rows)
+    assert not store.append('missing', rows[:1]), "不存在的句柄应返回 False"
+    assert [len(chunk) for chunk in store.iter_chunks(handle, chunk_rows=500)] == [500, 500, 200]
+
+    stream, filename, _ = open_export('csv', store.iter_chunks(handle, chunk_rows=500))
+    blocks = list(stream)
+    assert filename.endswith('.csv') and len(blocks) == 4, "CSV 应按块输出"
+    parsed = list(csv.reader(io.StringIO(b''.join(blocks).decode('utf-8-sig'))))
+    assert parsed[0][0] == '股票代码' and len(parsed) == len(rows) + 1
+    assert {row[0] for row in parsed[1:]} == {row['code'] for row in rows}
+    prices = {row[0]: row[2] for row in parsed[1:]}
+    assert prices['600001'] == str(round(rows[1]['current_price'], 2)), "价格应保留两位小数"
+
+    stream, filename, _ = open_export('excel', store.iter_chunks(handle))
+    sheet = load_workbook(io.BytesIO(b''.join(stream)), read_only=True).active
+    assert filename.endswith('.xlsx') and len(list(sheet.iter_rows(values_only=True))) == len(rows) + 1
+
+    if 'parquet' not in available_formats():
+        try:
+            open_export('parquet', store.iter_chunks(handle))
+            assert False, "缺少 pyarrow 时应抛出 ExportUnavailableError"
+        except ExportUnavailableError:
+            pass
+    store.delete(handle)
+    assert store.info(handle) is None
+    print(f"✓ 导出 {len(rows)} 行，可用格式 {available_formats()}")
+    return True
+
+def test_stream_screening():
+    """测试流式筛选：结果与完整筛选一致，没有股票通过预筛选时正常完成而不是报错（离线）"""
+    print("测试流式筛选...")
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    from rules import CriteriaConfig, RulePlan
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(300, seed=6)
+    today = datetime.now().strftime('%Y-%m-%d')
+    expected, _ = run_screening(synthetic_screener(market, without_first_limit_up()), today, max_stocks=None)
+    events = list(synthetic_screener(market, without_first_limit_up()).screen_rescue_stocks_stream(today))
+    assert [name for name, _ in events][0] == 'start' and events[-1][0] == 'done'
+    assert sorted(data['code'] for name, data in events if name == 'match') == sorted(row['code'] for row in expected)
+    assert events[-1][1]['results_count'] == len(expected) > 0
+
+    screener = synthetic_screener(market, without_first_limit_up())
+    screener.rule_plan = RulePlan(screener.rule_plan.rules, CriteriaConfig(small_positive_min_pct=50,
+                                                                           small_positive_max_pct=60))
+    events = list(screener.screen_rescue_stocks_stream(today))
+    assert [name for name, _ in events] == ['start', 'done'], events
+    assert events[-1][1]['total_stocks'] == 0 and events[-1][1]['results_count'] == 0
+    print(f"✓ 流式结果 {len(expected)} 只，预筛选为空时正常完成")
+    return True
+
+def test_live_screener():
+    """测试盘中增量筛选：首轮与完整筛选一致，快照未变时不重新判定，变化的股票推送 remove / add"""
+    print("测试盘中增量筛选...")
+    from datetime import time as clock_time
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    import numpy as np
+    from live_screener import LiveScreener
+    from market_session import session_date
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(300, seed=5)
+    today = datetime.now().strftime('%Y-%m-%d')
+    full, _ = run_screening(synthetic_screener(market, without_first_limit_up()), today, max_stocks=300)
+    screener = synthetic_screener(market, without_first_limit_up())
+    live = LiveScreener(screener)
+    now = datetime.combine(market.dates[-1].date(), clock_time(10, 0))
+
+    events = live.refresh(now)
+    added = {data['code'] for event, data in events if event == 'add'}
+    assert added == {row['code'] for row in full} and added, "首轮命中应与完整筛选一致"
+
+    def refresh():
+        screener.data_fetcher.snapshot_cache.clear()
+        calls = market.calls['stock_zh_a_hist']
+        events = live.refresh(now)
+        assert market.calls['stock_zh_a_hist'] == calls, "已跟踪的股票不应再请求历史数据"
+        return events
+
+    events = refresh()
+    assert [event for event, _ in events] == ['tick'] and events[0][1]['changed'] == 0
+
+    code = sorted(added)[0]
+    i = market.code_index[code]
+    close = market.bars['close'][i, -1]
+    market.bars['close'][i, -1] = market.bars['low'][i, -1]
+    events = refresh()
+    assert events[:-1] == [('remove', {'code': code, 'name': market.names[i]})] and events[-1][1]['changed'] == 1
+    assert code not in live.matches
+    market.bars['close'][i, -1] = close
+    assert [event for event, _ in refresh()] == ['add', 'tick'] and code in live.matches
+
+    # 成交量变化但未越过昨日成交量：不重新判定，命中股票只推送行情更新
+    volume = market.bars['volume'][:, -1].copy()
+    yesterday = market.bars['volume'][:, -2]
+    market.bars['volume'][:, -1] = np.where((volume >= yesterday) | (volume + 1 < yesterday), volume + 1, volume)
+    evaluations = screener.rule_plan.evaluations
+    events = refresh()
+    assert events[-1][1]['changed'] == 0 and screener.rule_plan.evaluations == evaluations
+    assert {event for event, _ in events[:-1]} <= {'update'} and set(live.matches) == added
+    market.bars['volume'][:, -1] = volume
+
+    # 进入新的交易日时清空命中集合，订阅者收到 remove
+    events = live.refresh(now + timedelta(days=7))
+    removed = {data['code'] for event, data in events if event == 'remove'}
+    assert removed == added and live.session != session_date(now)
+    print(f"✓ 增量筛选跟踪 {len(added)} 只命中股票，只在越过阈值时重新判定")
+    return True
+
+def test_checkpointed_run():
+    """测试断点续跑：中断的运行在另一个筛选器上只检查尚未判定的股票，结果与完整筛选一致"""
+    print("测试断点续跑...")
+    import os
+    import tempfile
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    from run_store import RunStore
+    from synthetic_market import SyntheticMarket
+
+    market = SyntheticMarket(300, seed=5)
+    today = datetime.now().strftime('%Y-%m-%d')
+    full, _ = run_screening(synthetic_screener(market, without_first_limit_up()), today, max_stocks=300)
+
+    def worker():
+        screener = synthetic_screener(market, without_first_limit_up())
+        screener.run_store = store
+        return screener
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = RunStore(os.path.join(tmp, 'runs.sqlite'))
+        first = worker()
+        for _ in range(2):
+            response = first.screen_rescue_stocks_batch(today, batch_size=10, run_id='run1')
+        assert response['processed_count'] == 20 and response['has_more'] and response['run_id'] == 'run1'
+
+        # 另一个筛选器（相当于重启后的进程）续跑：不重新获取快照，已判定的股票不再请求历史数据
+        pending = len(store.pending('run1'))
+        calls = dict(market.calls)
+        results = worker().screen_rescue_stocks(today, max_stocks=None, run_id='run1')
+        assert market.calls['stock_zh_a_spot_em'] == calls['stock_zh_a_spot_em']
+        assert market.calls['stock_zh_a_hist'] - calls['stock_zh_a_hist'] == pending
+        assert sorted(row['code'] for row in results) == sorted(row['code'] for row in full) and results
+        run = store.get('run1')
+        assert run['status'] == 'completed' and run['processed_count'] == run['total_stocks']
+
+        # 流式筛选续跑已完成的运行：重放已判定的结果
+        events = list(worker().screen_rescue_stocks_stream(today, run_id='run1'))
+        assert events[0][1]['processed_count'] == run['total_stocks']
+        assert [event for event, _ in events].count('match') == len(results) and events[-1][0] == 'done'
+        store.conn.close()
+    print(f"✓ 续跑 {pending} 只未判定的股票，共找到 {len(results)} 只")
+    return True
+
+def test_sharded_screening():
+    """测试分片筛选：worker 中断后租期到期的分片由其他 worker 接着处理，合并结果与完整筛选一致"""
+    print("测试分片筛选...")
+    import os
+    import tempfile
+    from benchmark import run_screening, synthetic_screener, without_first_limit_up
+    from synthetic_market import SyntheticMarket
+    from work_queue import ShardWorker, WorkQueue, enqueue_run, merge_run
+
+    market = SyntheticMarket(300, seed=5)
+    today = datetime.now().strftime('%Y-%m-%d')
+    full, _ = run_screening(synthetic_screener(market, without_first_limit_up()), today, max_stocks=300)
+
+    def factory():
+        return synthetic_screener(market, without_first_limit_up())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = WorkQueue(os.path.join(tmp, 'queue.sqlite'))
+        run = enqueue_run(today, shard_size=10, screener=factory(), queue=queue)
+        shards = queue.progress(run['run_id'])['total']
+        assert shards == (run['total_stocks'] + 9) // 10
+
+        # 领取分片后中断的 worker：租期到期后分片重新可领
+        crashed = ShardWorker(queue.path, 'crashed', factory, rate=None, lease=0)
+        assert crashed.queue.claim('crashed', lease=0) is not None
+        assert merge_run(run['run_id'], factory(), queue, wait=False) is None
+
+        calls = market.calls['stock_zh_a_hist']
+        workers = [ShardWorker(queue.path, f'worker-{i}', factory, rate=1000) for i in range(2)]
+        while any([worker.run_once() for worker in workers]):
+            pass
+        assert sum(worker.shards_done for worker in workers) == shards
+        assert market.calls['stock_zh_a_hist'] - calls == run['total_stocks'], "每只股票只应检查一次"
+        progress = queue.progress(run['run_id'])
+        assert progress['done'] == shards and progress['workers'] == 2
+
+        results = merge_run(run['run_id'], factory(), queue)
+        assert sorted(row['code'] for row in results) == sorted(row['code'] for row in full) and results
+        for worker in workers + [crashed]:
+            worker.queue.conn.close()
+            worker.run_store.conn.close()
+            worker.rate_limiter and worker.rate_limiter.conn.close()
+        queue.conn.close()
+    print(f"✓ 2 个 worker 处理 {shards} 个分片，合并得到 {len(results)} 只")
+    return True
+
+def test_shard_retry_limit():
+    """测试分片重试上限：总是失败的分片按退避重试，达到上限后标记为 failed，合并时报错而不是一直等待"""
+    print("测试分片重试上限...")
+    import os
+    import tempfile
+    from benchmark import synthetic_screener, without_first_limit_up
+    from synthetic_market import SyntheticMarket
+    from work_queue import ShardWorker, WorkQueue, enqueue_run, merge_run
+
+    market = SyntheticMarket(100, seed=5)
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    def factory():
+        return synthetic_screener(market, without_first_limit_up())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = WorkQueue(os.path.join(tmp, 'queue.sqlite'))
+        run = enqueue_run(today, shard_size=1000, screener=factory(), queue=queue)
+        worker = ShardWorker(queue.path, 'flaky', factory, rate=None, max_attempts=3, retry_backoff=0.01)
+        attempts = []
+
+        def process(shard):
+            attempts.append(shard['attempt'])
+            raise RuntimeError('上游数据异常')
+
+        worker.process = process
+        worker.run()
+        assert attempts == [1, 2, 3] and worker.shards_failed == 1
+        progress = queue.progress(run['run_id'])
+        assert progress['failed'] == 1 and progress['errors'] == {0: '上游数据异常'}
+        assert queue.claim('other') is None
+        try:
+            merge_run(run['run_id'], factory(), queue, wait=True, timeout=5)
+            assert False, "有失败分片时合并应报错"
+        except RuntimeError:
+            pass
+
+        # 手动放回后正常处理
+        assert queue.retry_failed(run['run_id']) == 1
+        del worker.process
+        worker.run()
+        assert merge_run(run['run_id'], factory(), queue, wait=False) is not None
+        for conn in (worker.queue.conn, worker.run_store.conn, queue.conn):
+            conn.close()
+    print("✓ 分片失败 3 次后标记为 failed，放回队列后可继续完成")
+    return True
+
 def test_flask_app():
     """测试Flask应用"""
     print("测试Flask应用...")
@@ -107,6 +980,30 @@ def main():
         ("AkShare连接测试", test_akshare_connection),
         ("数据获取模块测试", test_data_fetcher),
         ("筛选算法模块测试", test_screener),
+        ("本地历史数据存储测试", test_history_store),
+        ("本地历史数据多实例测试", test_history_store_sharing),
+        ("API调用记录测试", test_api_log),
+        ("涨跌停价测试", test_limit_prices),
+        ("向量化筛选引擎测试", test_vectorized_screener),
+        ("回测引擎测试", test_backtest),
+        ("规则引擎测试", test_rule_plan),
+        ("筛选任务调度测试", test_job_manager),
+        ("筛选结果缓存测试", test_result_cache),
+        ("运行指标测试", test_metrics),
+        ("性能分析测试", test_profiler),
+        ("合成行情测试", test_synthetic_market),
+        ("数据源录制回放测试", test_providers),
+        ("预构建快照测试", test_snapshot_artifact),
+        ("快照预筛选测试", test_snapshot_prefilter),
+        ("历史数据缓存测试", test_history_cache),
+        ("快照版本固定测试", test_snapshot_versions),
+        ("历史日期筛选测试", test_as_of_screening),
+        ("结果导出测试", test_result_export),
+        ("流式筛选测试", test_stream_screening),
+        ("盘中增量筛选测试", test_live_screener),
+        ("断点续跑测试", test_checkpointed_run),
+        ("分片筛选测试", test_sharded_screening),
+        ("分片重试上限测试", test_shard_retry_limit),
         ("Flask应用测试", test_flask_app)
     ]
     
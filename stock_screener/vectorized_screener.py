@@ -0,0 +1,129 @@
+import logging
+
+import numpy as np
+
+from data_fetcher import (
+    SMALL_POSITIVE_MAX_PCT,
+    SMALL_POSITIVE_MIN_BODY_RATIO,
+    SMALL_POSITIVE_MIN_PCT,
+)
+from limit_prices import at_limit_down, at_limit_up, limit_prices, limit_ratios, previous_close
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 面板字段，与 history_store 的列文件名一致
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+# 与 check_rescue_criteria 中 get_stock_history(days=5) / (days=10) 对应
+RECENT_DAYS = 5
+EXTENDED_DAYS = 10
+
+CONDITION_NAMES = (
+    'today_not_limit_up',
+    'today_small_positive',
+    'volume_shrink',
+    'yesterday_normal',
+    'first_limit_up_in_3_days',
+)
+
+
+def _pct_change(open_price, close_price):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (close_price - open_price) / open_price * 100
+
+
+def small_positive_mask(open_price, close_price, high_price, low_price, config=None):
+    """向量化的 is_small_positive_line，config 为 rules.CriteriaConfig"""
+    min_pct = getattr(config, 'small_positive_min_pct', SMALL_POSITIVE_MIN_PCT)
+    max_pct = getattr(config, 'small_positive_max_pct', SMALL_POSITIVE_MAX_PCT)
+    min_body_ratio = getattr(config, 'small_positive_min_body_ratio', SMALL_POSITIVE_MIN_BODY_RATIO)
+    valid = ~(np.isnan(open_price) | np.isnan(close_price) | np.isnan(high_price) | np.isnan(low_price))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_change = _pct_change(open_price, close_price)
+        total_range = high_price - low_price
+        body_ratio = (close_price - open_price) / total_range
+        return (
+            valid
+            & (close_price > open_price)
+            & (pct_change >= min_pct)
+            & (pct_change <= max_pct)
+            & (total_range > 0)
+            & (body_ratio >= min_body_ratio)
+        )
+
+
+def compact_bars(panel, ratios):
+    """把每只股票的有效K线右对齐（缺失K线移到左侧），返回对齐后的面板和有效K线数
+
+    标量路径中 hist_data.iloc[-1] 是该股票最后一根实际存在的K线，停牌日不会出现在
+    数据里；这里用稳定排序把 NaN 挪到前面，使 [..., -k] 与 iloc[-k] 一一对应。
+    对齐后另附 prev_close（上一根实际K线的收盘价）及由它和 ratios 一次算出的每根K线
+    涨停价 limit_up、跌停价 limit_down。
+    """
+    valid = ~np.isnan(panel['close'])
+    order = np.argsort(valid, axis=-1, kind='stable')
+    compacted = {
+        field: np.take_along_axis(panel[field], order, axis=-1)
+        for field in PANEL_FIELDS
+    }
+    compacted['prev_close'] = previous_close(compacted['close'])
+    compacted['limit_up'], compacted['limit_down'] = limit_prices(
+        compacted['prev_close'], np.asarray(ratios, dtype=float)[..., None]
+    )
+    return compacted, valid.sum(axis=-1)
+
+
+def rescue_criteria_masks(panel, ratios, config=None):
+    """对面板一次性计算全部自救条件，返回各条件及总体的布尔掩码
+
+    panel 的每个字段形状为 (..., 交易日)，最后一维为时间轴，ratios（涨跌幅限制比例，
+    取自当日 LimitPriceTable 或 limit_prices.limit_ratios，不设限制时为 NaN）的形状与
+    前面的维度一致。各条件与 rules.DEFAULT_RULES 逐条对应。
+    """
+    bars, bar_count = compact_bars(panel, ratios)
+    o, h, l, c, v = (bars[field] for field in PANEL_FIELDS)
+    up, down = bars['limit_up'], bars['limit_down']
+    if o.shape[-1] < 3:
+        empty = np.zeros(o.shape[:-1], dtype=bool)
+        return {name: empty for name in CONDITION_NAMES + ('all',)}
+
+    has_recent = bar_count >= RECENT_DAYS
+    has_extended = bar_count >= EXTENDED_DAYS
+
+    # 条件1: 当天非涨停
+    today_not_limit_up = ~at_limit_up(c[..., -1], up[..., -1])
+    # 条件2: 当天为小阳线
+    today_small_positive = small_positive_mask(o[..., -1], c[..., -1], h[..., -1], l[..., -1], config)
+    # 条件3: 当天成交量小于昨日成交量（与标量路径一致，NaN 不视为放量）
+    with np.errstate(invalid='ignore'):
+        volume_shrink = ~(v[..., -1] >= v[..., -2])
+    # 条件4: 昨日非跌停，昨日非涨停
+    yesterday_normal = ~(at_limit_up(c[..., -2], up[..., -2]) | at_limit_down(c[..., -2], down[..., -2]))
+    # 条件5: 近3日内首次涨停 —— 最近3根K线中第一根涨停恰好是最后一根
+    first_limit_up = (
+        has_extended
+        & at_limit_up(c[..., -1], up[..., -1])
+        & ~at_limit_up(c[..., -2], up[..., -2])
+        & ~at_limit_up(c[..., -3], up[..., -3])
+    )
+
+    masks = {
+        'today_not_limit_up': has_recent & today_not_limit_up,
+        'today_small_positive': has_recent & today_small_positive,
+        'volume_shrink': has_recent & volume_shrink,
+        'yesterday_normal': has_recent & yesterday_normal,
+        'first_limit_up_in_3_days': first_limit_up,
+    }
+    masks['all'] = np.logical_and.reduce([masks[name] for name in CONDITION_NAMES])
+    return masks
+
+
+def screen_panel(codes, panel, config=None, ratios=None):
+    """对 (股票 × 交易日) 面板执行全部自救条件，返回符合条件的股票代码（保持输入顺序）
+
+    ratios 为各股票的涨跌幅限制比例（通常取自当日 LimitPriceTable），省略时按板块计算。
+    """
+    codes = np.asarray(codes, dtype=str)
+    masks = rescue_criteria_masks(panel, limit_ratios(codes) if ratios is None else ratios, config)
+    return codes[masks['all']].tolist()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+分片筛选的本地工作队列
+协调者（enqueue_run）按 get_all_stocks 的股票列表新建一个断点续跑的运行（见 run_store），
+把预筛选后的股票按位置切分为分片写入队列；同一台主机上的 worker 进程领取分片、判定其中的
+股票，并逐股把结果写入运行存储；合并者（merge_run）在全部分片完成后结束运行，得到最终结果。
+所有 worker 共用一个 SQLite 令牌桶，整体请求速率不超过上游限制：在达到该限制之前，吞吐量
+随 worker 数近似线性增长。
+
+队列、运行存储和令牌桶都依赖 SQLite 的 WAL 模式与文件锁，只支持单台主机：数据库文件必须
+位于本地磁盘，不能放在 NFS、SMB 等网络文件系统上由多台主机共用（WAL 的共享内存索引无法
+跨主机工作，可能导致数据库损坏）。
+
+用法：
+    python work_queue.py enqueue --date 2024-01-15      # 协调者，输出运行 ID
+    python work_queue.py worker --processes 4           # 在本机启动 worker
+    python work_queue.py merge <运行ID>                  # 等待全部分片完成并输出结果
+    python work_queue.py retry <运行ID>                  # 把多次失败的分片重新放回队列
+    python work_queue.py run --date 2024-01-15 --workers 4   # 在本机一次完成以上三步
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from rate_limiter import DEFAULT_REQUESTS_PER_SECOND, SqliteTokenBucket
+from result_cache import json_default
+from run_store import DEFAULT_RUN_STORE_PATH, RunStore, new_run_id
+from stock_screener import StockScreener
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每个分片的股票数
+DEFAULT_SHARD_SIZE = 50
+# 领取分片后的租期（秒），worker 处理期间定期续租；超时未续租的分片可被其他 worker 重新领取
+DEFAULT_LEASE_SECONDS = 120
+# 队列为空时 worker 等待新分片的轮询间隔（秒）
+IDLE_POLL_INTERVAL = 1.0
+# 每个分片最多领取的次数，处理失败或租期到期达到该次数后分片标记为 failed，不再自动重试
+DEFAULT_MAX_ATTEMPTS = 3
+# 处理失败后重新可领前的等待时间（秒），第 n 次失败后等待 DEFAULT_RETRY_BACKOFF * 2^(n-1)
+DEFAULT_RETRY_BACKOFF = 5.0
+
+
+class WorkQueue:
+    """SQLite 实现的分片队列，与运行存储共用同一个数据库文件
+
+    分片状态为 pending → leased → done；领取在写事务内完成，多个进程不会领到同一个
+    分片。worker 异常退出后租期到期的分片重新可领，其中已判定的股票不会再检查。处理失败的
+    分片按指数退避放回队列，领取次数达到 max_attempts 后进入终止状态 failed，由
+    retry_failed 手动放回。数据库文件须在本地磁盘上，只供同一台主机上的进程共用。
+    """
+
+    def __init__(self, path=None, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_backoff=DEFAULT_RETRY_BACKOFF):
+        self.path = path or DEFAULT_RUN_STORE_PATH
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS shards (
+                run_id TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                leased_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                retry_at REAL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                claimed_at REAL,
+                finished_at REAL,
+                PRIMARY KEY (run_id, shard)
+            )
+        ''')
+        # 早期版本创建的表没有重试相关的列
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(shards)')}
+        for column, kind in (('retry_at', 'REAL'), ('error', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE shards ADD COLUMN {column} {kind}')
+
+    def enqueue(self, run_id, total_stocks, shard_size=DEFAULT_SHARD_SIZE):
+        """把运行的股票按位置 [start, end) 切分为分片入队，返回分片数（重复入队不产生新分片）"""
+        now = time.time()
+        shards = [(run_id, shard, start, min(start + shard_size, total_stocks), 'pending', now)
+                  for shard, start in enumerate(range(0, total_stocks, shard_size))]
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO shards (run_id, shard, start, end, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                shards
+            )
+        return len(shards)
+
+    def claim(self, worker, lease=DEFAULT_LEASE_SECONDS):
+        """领取最早入队、已过退避时间的待处理分片（或租期已过的分片），没有时返回 None
+
+        租期已过且领取次数达到上限的分片（如每次都让 worker 崩溃）标记为 failed，不再领取。
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                expired = self.conn.execute(
+                    "UPDATE shards SET status = 'failed', finished_at = ?, error = ? "
+                    "WHERE status = 'leased' AND leased_until < ? AND attempts >= ?",
+                    (now, '租期多次到期（worker 处理时退出）', now, self.max_attempts)
+                ).rowcount
+                row = self.conn.execute(
+                    "SELECT run_id, shard, start, end, attempts FROM shards "
+                    "WHERE (status = 'pending' AND (retry_at IS NULL OR retry_at <= ?)) "
+                    "OR (status = 'leased' AND leased_until < ?) "
+                    "ORDER BY created_at, run_id, shard LIMIT 1", (now, now)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE shards SET status = 'leased', worker = ?, leased_until = ?, attempts = attempts + 1, "
+                        "claimed_at = COALESCE(claimed_at, ?) WHERE run_id = ? AND shard = ?",
+                        (worker, now + lease, now, row[0], row[1])
+                    )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        if expired:
+            logger.error(f"❌ {expired} 个分片的租期已到期 {self.max_attempts} 次，标记为失败")
+        if row is None:
+            return None
+        return {'run_id': row[0], 'shard': row[1], 'start': row[2], 'end': row[3], 'attempt': row[4] + 1}
+
+    def renew(self, shard, worker, lease=DEFAULT_LEASE_SECONDS):
+        """续租，分片已被其他 worker 重新领取时返回 False"""
+        with self.lock:
+            updated = self.conn.execute(
+                "UPDATE shards SET leased_until = ? WHERE run_id = ? AND shard = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease, shard['run_id'], shard['shard'], worker)
+            ).rowcount
+        return updated > 0
+
+    def complete(self, shard, worker):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE shards SET status = 'done', worker = ?, finished_at = ? WHERE run_id = ? AND shard = ?",
+                (worker, time.time(), shard['run_id'], shard['shard'])
+            )
+
+    def release(self, shard, worker, error=None):
+        """处理失败：领取次数未达上限时按指数退避放回队列，否则标记为 failed
+
+        返回新的状态，分片已被其他 worker 重新领取时返回 None。
+        """
+        now = time.time()
+        if shard['attempt'] >= self.max_attempts:
+            status, retry_at, finished_at = 'failed', None, now
+        else:
+            status, retry_at, finished_at = 'pending', now + self.retry_backoff * 2 ** (shard['attempt'] - 1), None
+        with self.lock:
+            updated = self.conn.execute(
+                "UPDATE shards SET status = ?, leased_until = NULL, retry_at = ?, error = ?, finished_at = ? "
+                "WHERE run_id = ? AND shard = ? AND worker = ? AND status = 'leased'",
+                (status, retry_at, error, finished_at, shard['run_id'], shard['shard'], worker)
+            ).rowcount
+        return status if updated else None
+
+    def retry_failed(self, run_id):
+        """把运行中失败的分片重新放回队列（领取次数清零），返回分片数"""
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE shards SET status = 'pending', attempts = 0, retry_at = NULL, error = NULL, "
+                "finished_at = NULL WHERE run_id = ? AND status = 'failed'", (run_id,)
+            ).rowcount
+
+    def next_retry_at(self):
+        """退避中的待处理分片最早可领取的时间，没有时返回 None"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT MIN(retry_at) FROM shards WHERE status = 'pending' AND retry_at IS NOT NULL"
+            ).fetchone()[0]
+
+    def progress(self, run_id):
+        """运行的分片进度：各状态的分片数、参与的 worker 数及首次领取、最后完成的时间
+
+        errors 为失败分片的 {分片号: 最后一次的错误}。
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT status, COUNT(*) FROM shards WHERE run_id = ? GROUP BY status', (run_id,)
+            ).fetchall()
+            workers, claimed_at, finished_at = self.conn.execute(
+                'SELECT COUNT(DISTINCT worker), MIN(claimed_at), MAX(finished_at) FROM shards WHERE run_id = ?',
+                (run_id,)
+            ).fetchone()
+            errors = self.conn.execute(
+                "SELECT shard, error FROM shards WHERE run_id = ? AND status = 'failed' ORDER BY shard", (run_id,)
+            ).fetchall()
+        counts = dict(rows)
+        return {
+            'total': sum(counts.values()),
+            'pending': counts.get('pending', 0),
+            'leased': counts.get('leased', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'errors': dict(errors),
+            'workers': workers,
+            'claimed_at': claimed_at,
+            'finished_at': finished_at,
+        }
+
+
+def default_worker_screener():
+    """worker 使用的筛选器：结果缓存由合并者写入，worker 不打开"""
+    return StockScreener(use_result_cache=False)
+
+
+class ShardWorker:
+    """领取并处理分片的 worker
+
+    每个运行使用一个筛选器（按运行固定的阈值判定）；rate 不为 None 时改用与其他 worker
+    共享的 SQLite 令牌桶，固定为该速率（不做自适应调整）。筛选器的本地历史数据存储按目录
+    在进程内共享（见 history_store.get_shared_history_store），同一主机上的多个 worker
+    进程通过文件锁协调写入。
+    """
+
+    def __init__(self, path=None, worker_id=None, screener_factory=None, rate=DEFAULT_REQUESTS_PER_SECOND,
+                 lease=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_backoff=DEFAULT_RETRY_BACKOFF):
+        self.queue = WorkQueue(path, max_attempts, retry_backoff)
+        self.run_store = RunStore(self.queue.path)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.screener_factory = screener_factory or default_worker_screener
+        self.rate_limiter = SqliteTokenBucket(self.queue.path, rate) if rate is not None else None
+        self.lease = lease
+        self.screeners = {}
+        self.shards_done = 0
+        self.shards_failed = 0
+        self.stocks_checked = 0
+
+    def _screener(self, run_id):
+        screener = self.screeners.get(run_id)
+        if screener is None:
+            screener = self.screener_factory()
+            screener.run_store = self.run_store
+            if self.rate_limiter is not None:
+                screener.data_fetcher.rate_limiter = self.rate_limiter
+                screener.data_fetcher.rate_controller = None
+            self.screeners[run_id] = screener
+        return screener
+
+    def process(self, shard):
+        """判定分片中尚未判定的股票，每只股票的结果立即写入运行存储"""
+        run_id = shard['run_id']
+        if self.run_store.get(run_id) is None:
+            logger.warning(f"运行 {run_id} 不存在或已过期，跳过分片 {shard['shard']}")
+            return 0
+        screener = self._screener(run_id)
+        run = screener.open_run(run_id, None)
+        stocks = self.run_store.pending(run_id, positions=(shard['start'], shard['end']))
+        renewed_at = [time.monotonic()]
+
+        def on_checked(checked_count, stock, matched_count, outcome):
+            if time.monotonic() - renewed_at[0] > self.lease / 3:
+                renewed_at[0] = time.monotonic()
+                self.queue.renew(shard, self.worker_id, self.lease)
+
+        screener.check_run_stocks(run, stocks, on_checked)
+        screener.data_fetcher.flush_history_store()
+        return len(stocks)
+
+    def run_once(self):
+        """领取并处理一个分片，队列为空时返回 False"""
+        shard = self.queue.claim(self.worker_id, self.lease)
+        if shard is None:
+            return False
+        try:
+            checked = self.process(shard)
+        except Exception as e:
+            status = self.queue.release(shard, self.worker_id, str(e))
+            if status == 'failed':
+                self.shards_failed += 1
+                logger.error(f"❌ 分片 {shard['run_id']}/{shard['shard']} 第 {shard['attempt']} 次处理失败，"
+                             f"不再重试: {e}")
+            elif status == 'pending':
+                logger.error(f"分片 {shard['run_id']}/{shard['shard']} 第 {shard['attempt']} 次处理失败，"
+                             f"退避后放回队列: {e}")
+            else:
+                logger.error(f"分片 {shard['run_id']}/{shard['shard']} 处理失败，已由其他 worker 重新领取: {e}")
+            return True
+        self.queue.complete(shard, self.worker_id)
+        self.shards_done += 1
+        self.stocks_checked += checked
+        logger.info(f"✅ {self.worker_id} 完成分片 {shard['run_id']}/{shard['shard']}（{checked} 只股票）")
+        return True
+
+    def run(self, wait=False, stop_event=None):
+        """持续处理分片；wait 为 False 时队列中没有待处理（含退避中）的分片即退出，否则等待新的分片"""
+        while stop_event is None or not stop_event.is_set():
+            if self.run_once():
+                continue
+            retry_at = self.queue.next_retry_at()
+            if retry_at is None and not wait:
+                break
+            delay = IDLE_POLL_INTERVAL if retry_at is None else retry_at - time.time()
+            time.sleep(min(IDLE_POLL_INTERVAL, max(0.0, delay)))
+        return self.shards_done
+
+
+def worker_main(path, screener_factory=None, rate=DEFAULT_REQUESTS_PER_SECOND, worker_id=None, wait=False):
+    """worker 进程的入口"""
+    return ShardWorker(path, worker_id, screener_factory, rate).run(wait)
+
+
+def enqueue_run(target_date=None, shard_size=DEFAULT_SHARD_SIZE, run_id=None, screener=None, queue=None,
+                max_stocks=None):
+    """协调者：获取并固定股票列表，新建运行并切分为分片入队，返回运行信息"""
+    queue = queue or WorkQueue()
+    screener = screener or StockScreener(use_result_cache=False)
+    screener.run_store = RunStore(queue.path)
+    run = screener.open_run(run_id or new_run_id(), target_date or datetime.now().strftime('%Y-%m-%d'),
+                            max_stocks=max_stocks)
+    if run is None:
+        raise RuntimeError("无法获取股票数据")
+    shards = queue.enqueue(run['run_id'], run['total_stocks'], shard_size)
+    logger.info(f"📤 运行 {run['run_id']}: {run['total_stocks']} 只股票切分为 {shards} 个分片")
+    return run
+
+
+def merge_run(run_id, screener=None, queue=None, wait=True, timeout=None, result_store=None):
+    """合并者：等待全部分片完成后结束运行，返回最终结果；wait 为 False 且未完成时返回 None
+
+    其余分片都已结束而有分片失败时抛出 RuntimeError（可用 retry_failed 放回队列后重新启动
+    worker）。指定 result_store 时以运行 ID 为句柄保存结果，供导出接口使用。
+    """
+    queue = queue or WorkQueue()
+    run_store = RunStore(queue.path)
+    if run_store.get(run_id) is None:
+        raise KeyError(f"运行 {run_id} 不存在或已过期")
+    started = time.monotonic()
+    while True:
+        progress = queue.progress(run_id)
+        if progress['done'] == progress['total']:
+            break
+        if progress['failed'] and progress['done'] + progress['failed'] == progress['total']:
+            raise RuntimeError(f"运行 {run_id} 有 {progress['failed']} 个分片多次处理失败: {progress['errors']}，"
+                               f"可执行 python work_queue.py retry {run_id} 后重新启动 worker")
+        if not wait:
+            return None
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"运行 {run_id} 仍有 {progress['total'] - progress['done']} 个分片未完成")
+        time.sleep(IDLE_POLL_INTERVAL)
+
+    screener = screener or StockScreener()
+    screener.run_store = run_store
+    run = screener.open_run(run_id, None)
+    results = screener.finish_run(run)
+    if result_store is not None:
+        result_store.create(run['target_date'], handle=run_id, meta={'run_id': run_id})
+        result_store.append(run_id, results)
+    return results
+
+
+def run_local(target_date=None, workers=4, shard_size=DEFAULT_SHARD_SIZE, rate=DEFAULT_REQUESTS_PER_SECOND,
+              screener_factory=None, path=None, max_stocks=None):
+    """在本机依次执行协调者、workers 个 worker 进程和合并者，返回 (结果, 统计)
+
+    吞吐量按第一个分片被领取到最后一个分片完成的时间计算，不含快照获取和进程启动。
+    """
+    queue = WorkQueue(path)
+    factory = screener_factory or default_worker_screener
+    run = enqueue_run(target_date, shard_size, screener=factory(), queue=queue, max_stocks=max_stocks)
+    processes = [
+        multiprocessing.Process(target=worker_main, args=(queue.path, screener_factory, rate, f"local-{i}"))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    progress = queue.progress(run['run_id'])
+    results = merge_run(run['run_id'], factory(), queue, wait=False)
+    if results is None:
+        raise RuntimeError(f"运行 {run['run_id']} 未完成（worker 异常退出），可再次启动 worker 后合并")
+    seconds = (progress['finished_at'] or 0) - (progress['claimed_at'] or 0)
+    return results, {
+        'run_id': run['run_id'],
+        'workers': workers,
+        'active_workers': progress['workers'],
+        'shards': progress['total'],
+        'stocks': run['total_stocks'],
+        'seconds': seconds,
+        'stocks_per_second': run['total_stocks'] / seconds if seconds > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分片筛选：协调者 / worker / 合并者')
+    parser.add_argument('--db', default=DEFAULT_RUN_STORE_PATH, help='队列与运行存储的数据库文件')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='新建运行并切分为分片入队')
+    enqueue.add_argument('--date', help='筛选日期，默认今天')
+    enqueue.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    enqueue.add_argument('--max-stocks', type=int)
+
+    worker = commands.add_parser('worker', help='领取并处理分片')
+    worker.add_argument('--processes', type=int, default=1, help='本机启动的 worker 进程数')
+    worker.add_argument('--rate', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help='所有 worker 共享的请求速率上限（次/秒）')
+    worker.add_argument('--wait', action='store_true', help='队列为空时继续等待新的分片')
+
+    merge = commands.add_parser('merge', help='等待全部分片完成并输出最终结果')
+    merge.add_argument('run_id')
+    merge.add_argument('--no-wait', action='store_true', help='未完成时立即退出')
+
+    retry = commands.add_parser('retry', help='把多次失败的分片重新放回队列')
+    retry.add_argument('run_id')
+
+    run = commands.add_parser('run', help='在本机执行协调者、worker 和合并者')
+    run.add_argument('--date', help='筛选日期，默认今天')
+    run.add_argument('--workers', type=int, default=4)
+    run.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    run.add_argument('--rate', type=float, default=DEFAULT_REQUESTS_PER_SECOND)
+    run.add_argument('--max-stocks', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        run_info = enqueue_run(args.date, args.shard_size, queue=WorkQueue(args.db), max_stocks=args.max_stocks)
+        print(run_info['run_id'])
+    elif args.command == 'worker':
+        processes = [
+            multiprocessing.Process(target=worker_main, args=(args.db, None, args.rate, None, args.wait))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == 'merge':
+        from result_store import get_shared_result_store
+        results = merge_run(args.run_id, queue=WorkQueue(args.db), wait=not args.no_wait,
+                            result_store=get_shared_result_store())
+        if results is None:
+            print(json.dumps(WorkQueue(args.db).progress(args.run_id)))
+            raise SystemExit(1)
+        print(json.dumps(results, ensure_ascii=False, default=json_default, indent=2))
+    elif args.command == 'retry':
+        print(WorkQueue(args.db).retry_failed(args.run_id))
+    else:
+        results, stats = run_local(args.date, args.workers, args.shard_size, args.rate, path=args.db,
+                                   max_stocks=args.max_stocks)
+        logger.info(f"🏁 {stats['workers']} 个 worker 处理 {stats['stocks']} 只股票（{stats['shards']} 个分片），"
+                    f"耗时 {stats['seconds']:.1f} 秒，找到 {len(results)} 只符合条件的股票")
+        print(json.dumps(results, ensure_ascii=False, default=json_default, indent=2))
+
+
+if __name__ == '__main__':
+    main()